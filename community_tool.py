@@ -1,4 +1,4 @@
-import copy
+import threading
 import numpy as np
 import igraph as ig
 import matplotlib.pyplot as plt
@@ -89,7 +89,190 @@ def kruskal(adj_matrix:np.ndarray) -> np.ndarray:
             union(parent, rank, x, y)  # Merge the sets containing x and y
     return mst_edges
 
+'''
+interned strings of the current question, ids are stable until reset_vocabs (called by fastToG at the start of
+each question) so that a long run over a dataset does not keep the strings of every question
+RELATION_VOCAB: relation values (rel ids of RelationGraph and Community), LABEL_VOCAB: entity labels (label ids of Community)
+'''
+class InternTable:
+    def __init__(self):
+        self.values = []
+        self.value2id = {}
+        self._lock = threading.Lock() #communities are also built by the prefetch threads
+
+    def encode(self, value) -> int:
+        rel_id = self.value2id.get(value)
+        if rel_id is None:
+            with self._lock:
+                rel_id = self.value2id.get(value)
+                if rel_id is None:
+                    rel_id = len(self.values)
+                    self.values.append(value)
+                    self.value2id[value] = rel_id
+        return rel_id
+
+    def encode_all(self, values) -> np.ndarray:
+        return np.array([self.encode(value) for value in values], dtype=np.int32)
+
+    def decode(self, rel_id):
+        return self.values[rel_id]
+
+    def decode_all(self, ids) -> list:
+        return [self.values[i] for i in ids]
+
+    def clear(self):
+        with self._lock:
+            self.values = []
+            self.value2id = {}
+
+RELATION_VOCAB = InternTable()
+LABEL_VOCAB = InternTable()
+
+#forget the interned strings, communities and relation graphs built before are no longer decodable
+def reset_vocabs():
+    RELATION_VOCAB.clear()
+    LABEL_VOCAB.clear()
+
+'''
+sparse typed adjacency among a list of entities, replaces the n x n list of None/str of triples2matrix
+src/dst/rel_ids: directed relations (COO) over entity indices, one relation per ordered pair (the last one like
+triples2matrix), self-circles ignored, rel_ids index RELATION_VOCAB and are decoded only when text is rendered
+undirected edges are symmetrized on the arrays, their merged 'a/b' values are only built for the rendered edges
+the edge arrays and boolean adjacency matrices are computed on first use and cached
+'''
+class RelationGraph:
+    def __init__(self, num_node, src, dst, rel_ids):
+        self.num_node = num_node
+        self.src = src
+        self.dst = dst
+        self.rel_ids = rel_ids
+        self._pair2rel = None
+        self._adjacency = None
+        self._undirected_edges = None
+        self._undirected_adjacency = None
+        self._csr = None
+
+    @classmethod
+    def from_triples(cls, ent_triples: List[Tuple], rel_triples: List[Tuple]):
+        nid2index = {ent[0]:index for index,ent in enumerate(ent_triples)}
+        pair2rel = {}
+        for rel in rel_triples:
+            from_index,to_index = nid2index.get(rel[0]),nid2index.get(rel[2])
+            if from_index is not None and to_index is not None and from_index != to_index:
+                pair2rel[(from_index, to_index)] = RELATION_VOCAB.encode(rel[1])
+        pairs = np.array(list(pair2rel), dtype=np.int32).reshape(-1, 2)
+        graph = cls(len(ent_triples), pairs[:, 0], pairs[:, 1], np.array(list(pair2rel.values()), dtype=np.int32))
+        graph._pair2rel = pair2rel
+        return graph
+
+    #same graph as from_triples of the nid array of entities and the relation arrays (n1.nid, rel id, n2.nid)
+    @classmethod
+    def from_arrays(cls, nids: np.ndarray, rel_src: np.ndarray, rel_ids: np.ndarray, rel_dst: np.ndarray):
+        num_node = len(nids)
+        nid2index = dict(zip(nids.tolist(), range(num_node)))
+        src = np.array([nid2index.get(nid, -1) for nid in rel_src.tolist()], dtype=np.int64)
+        dst = np.array([nid2index.get(nid, -1) for nid in rel_dst.tolist()], dtype=np.int64)
+        kept = np.flatnonzero((src >= 0) & (dst >= 0) & (src != dst))
+        keys = (src * num_node + dst)[kept]
+        _,last = np.unique(keys[::-1], return_index=True) #the last relation of a pair wins
+        kept = kept[len(keys) - 1 - last]
+        return cls(num_node, src[kept].astype(np.int32), dst[kept].astype(np.int32), rel_ids[kept].astype(np.int32))
+
+    def __len__(self):
+        return self.num_node
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.src)
+
+    #directed adjacency, adjacency[i, j] for a relation i -> j
+    def adjacency(self) -> np.ndarray:
+        if self._adjacency is None:
+            adjacency = np.zeros((self.num_node, self.num_node), dtype=bool)
+            adjacency[self.src, self.dst] = True
+            self._adjacency = adjacency
+        return self._adjacency
+
+    #undirected edges as (rows, cols) with rows < cols, sorted in row order
+    def undirected_edges(self):
+        if self._undirected_edges is None:
+            low,high = np.minimum(self.src, self.dst).astype(np.int64),np.maximum(self.src, self.dst).astype(np.int64)
+            keys = np.unique(low * self.num_node + high)
+            self._undirected_edges = (keys // max(self.num_node, 1), keys % max(self.num_node, 1))
+        return self._undirected_edges
+
+    #undirected adjacency like directed2undirected followed by the None test
+    #upper: only the upper triangle i.e. each edge once (not cached)
+    def undirected_adjacency(self, upper=False) -> np.ndarray:
+        rows,cols = self.undirected_edges()
+        if upper:
+            adjacency = np.zeros((self.num_node, self.num_node), dtype=bool)
+            adjacency[rows, cols] = True
+            return adjacency
+        if self._undirected_adjacency is None:
+            adjacency = np.zeros((self.num_node, self.num_node), dtype=bool)
+            adjacency[rows, cols] = True
+            adjacency[cols, rows] = True
+            self._undirected_adjacency = adjacency
+        return self._undirected_adjacency
+
+    def out_degrees(self) -> np.ndarray:
+        return np.bincount(self.src, minlength=self.num_node)
+
+    #directed relations grouped by source index: (indptr, dst, rel_ids)
+    def csr(self):
+        if self._csr is None:
+            order = np.lexsort((self.dst, self.src))
+            indptr = np.zeros(self.num_node + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.src, minlength=self.num_node), out=indptr[1:])
+            self._csr = (indptr, self.dst[order], self.rel_ids[order])
+        return self._csr
+
+    #relation value of from_index -> to_index, None if there is no relation
+    def relation(self, from_index, to_index):
+        if self._pair2rel is None:
+            self._pair2rel = dict(zip(zip(self.src.tolist(), self.dst.tolist()), self.rel_ids.tolist()))
+        rel_id = self._pair2rel.get((from_index, to_index))
+        return None if rel_id is None else RELATION_VOCAB.decode(rel_id)
+
+    #relation value between two entities regardless of the direction like directed2undirected, 'a/b' if they differ
+    def undirected_relation(self, index, jndex):
+        index,jndex = min(index, jndex),max(index, jndex)
+        forward,backward = self.relation(index, jndex),self.relation(jndex, index)
+        if forward is not None and backward is not None and forward != backward:
+            return forward + '/' + backward
+        return forward if forward is not None else backward
+
+    #graph among the entities of given indices, in the given order
+    def subgraph(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        position = np.full(self.num_node, -1, dtype=np.int64)
+        position[index] = np.arange(len(index))
+        mask = (position[self.src] >= 0) & (position[self.dst] >= 0)
+        return RelationGraph(len(index), position[self.src[mask]].astype(np.int32), position[self.dst[mask]].astype(np.int32), self.rel_ids[mask])
+
+    #n x n list of relation value or None, the format of triples2matrix
+    def to_matrix(self) -> List[List]:
+        if self.num_node == 1:
+            return [[]]
+        matrix = [[None] * self.num_node for _ in range(self.num_node)]
+        for from_index,to_index,rel_id in zip(self.src.tolist(), self.dst.tolist(), self.rel_ids.tolist()):
+            matrix[from_index][to_index] = RELATION_VOCAB.decode(rel_id)
+        return matrix
+
+'''
+community of entities with their relations (intra and inter), many are built per search and most are pruned at once
+entities: nids, label ids (LABEL_VOCAB) and distances, relations: n1.nid, rel ids (RELATION_VOCAB) and n2.nid, all arrays
+graph, cid, quality, label, ent_nids and relation_matrix are computed on first access and kept, so are the nid -> index map
+and the inter relations keyed by their outside endpoint used by get_community_edges (memoized per other community)
+bfs2text is memoized per (summary_method, keep_one), a community is rendered many times per question
+ent_triples/rel_triples are rebuilt from the arrays as [(nid, label, distance),...]/[(n1.nid, r.value, n2.nid),...]
+'''
 class Community:
+    __slots__ = ('nids', 'label_ids', 'distances', 'rel_src', 'rel_ids', 'rel_dst', \
+                 '_cid', '_quality', '_label', '_ent_nids', '_graph', '_relation_matrix', \
+                 '_nid2index', '_rel_inside', '_inter_edges', '_edge_memo', '_text_memo')
+
     def __init__(
         self, 
         ent_triples: List[Tuple], #[(nid, label, distance),...]
@@ -98,101 +281,180 @@ class Community:
         quality = None,
         label = None
     ):
-        self.ent_triples = ent_triples 
-        self.rel_triples = rel_triples 
-        self.ent_nids = set([ent[0] for ent in ent_triples])
-        self.relation_matrix = triples2matrix(ent_triples, rel_triples) #relation matrix with row/column as ent_triples
-        if center_node_id is None:
-            if len(self.relation_matrix) > 0:
-                relation_2d_array = np.array(self.relation_matrix)
-                center_index = np.argmax(np.sum(np.where(relation_2d_array == None, 0, 1), axis=1)) #maximum degree node as community center
-                self.cid = ent_triples[center_index][0] #community center nid as community id
-            else:
-                self.cid = self.ent_triples[0][0]
-        else:
-            self.cid = center_node_id
-        if quality is not None:
-            self.quality = quality
-        else:
-            if len(self.relation_matrix) > 0:
-                self.quality =  np.sum(np.where(np.array(self.relation_matrix) == None, 0, 1))/(len(self.relation_matrix))**2
-            else:
-                self.quality = 0.0
-        self.label = label if label is not None else self.get_label_by_nid(self.cid) #center node label as community label
+        ent_columns,rel_columns = list(zip(*ent_triples)) or [(), (), ()],list(zip(*rel_triples)) or [(), (), ()]
+        self.nids = np.array(ent_columns[0], dtype=np.int64)
+        self.label_ids = LABEL_VOCAB.encode_all(ent_columns[1])
+        self.distances = np.array(ent_columns[2], dtype=np.int32)
+        self.rel_src = np.array(rel_columns[0], dtype=np.int64)
+        self.rel_ids = RELATION_VOCAB.encode_all(rel_columns[1])
+        self.rel_dst = np.array(rel_columns[2], dtype=np.int64)
+        self._init_lazy(center_node_id, quality, label)
+
+    #community of entity/relation arrays, e.g. slices of the arrays of a whole search window (see build_community)
+    @classmethod
+    def from_arrays(cls, nids, label_ids, distances, rel_src, rel_ids, rel_dst, center_node_id=None, quality=None, label=None):
+        community = cls.__new__(cls)
+        community.nids,community.label_ids,community.distances = nids,label_ids,distances
+        community.rel_src,community.rel_ids,community.rel_dst = rel_src,rel_ids,rel_dst
+        community._init_lazy(center_node_id, quality, label)
+        return community
+
+    def _init_lazy(self, center_node_id, quality, label):
+        self._cid = center_node_id
+        self._quality = quality
+        self._label = label
+        self._ent_nids = None
+        self._graph = None
+        self._relation_matrix = None
+        self._nid2index = None
+        self._rel_inside = None
+        self._inter_edges = None
+        self._edge_memo = None
+        self._text_memo = None
+
+    @property
+    def ent_triples(self) -> List[Tuple]:
+        return list(zip(self.nids.tolist(), LABEL_VOCAB.decode_all(self.label_ids.tolist()), self.distances.tolist()))
+
+    @property
+    def rel_triples(self) -> List[Tuple]:
+        return list(zip(self.rel_src.tolist(), RELATION_VOCAB.decode_all(self.rel_ids.tolist()), self.rel_dst.tolist()))
+
+    @property
+    def ent_nids(self) -> Set:
+        if self._ent_nids is None:
+            self._ent_nids = set(self.nids.tolist())
+        return self._ent_nids
+
+    #typed adjacency with row/column as ent_triples
+    @property
+    def graph(self) -> RelationGraph:
+        if self._graph is None:
+            self._graph = RelationGraph.from_arrays(self.nids, self.rel_src, self.rel_ids, self.rel_dst)
+        return self._graph
+
+    #community center nid as community id, maximum degree node by default
+    @property
+    def cid(self):
+        if self._cid is None:
+            self._cid = self.nids[np.argmax(self.graph.out_degrees())].item()
+        return self._cid
+
+    #ratio of related pairs by default
+    @property
+    def quality(self):
+        if self._quality is None:
+            self._quality = self.graph.num_edges/(len(self.nids))**2 if len(self.nids) > 0 else 0.0
+        return self._quality
+
+    #center node label as community label by default
+    @property
+    def label(self):
+        if self._label is None:
+            self._label = self.get_label_by_nid(self.cid)
+        return self._label
+
+    #n x n list of relation value or None (see triples2matrix)
+    @property
+    def relation_matrix(self) -> List[List]:
+        if self._relation_matrix is None:
+            self._relation_matrix = self.graph.to_matrix()
+        return self._relation_matrix
+
+    @property
+    def ent_labels(self) -> List:
+        return LABEL_VOCAB.decode_all(self.label_ids.tolist())
     
     def get_label_by_nid(self, nid):
-        label = None
-        for ent in self.ent_triples:
-            if ent[0] == nid:
-                label = ent[1]
-                break
-        return label
+        index = self.get_index_by_nid(nid)
+        return None if index is None else LABEL_VOCAB.decode(self.label_ids[index])
 
     def get_index_by_nid(self, nid):
-        index = None
-        for i,ent in enumerate(self.ent_triples):
-            if ent[0] == nid:
-                index = i
-                break
-        return index
+        if self._nid2index is None:
+            index = range(len(self.nids) - 1, -1, -1)
+            self._nid2index = dict(zip(self.nids[::-1].tolist(), index)) #first index of a nid
+        return self._nid2index.get(nid)
+
+    #(n1 in community, n2 in community) masks of the relations
+    def _rel_inside_masks(self):
+        if self._rel_inside is None:
+            self._rel_inside = (np.isin(self.rel_src, self.nids), np.isin(self.rel_dst, self.nids))
+        return self._rel_inside
+
+    #inter relations with one endpoint in community by the other endpoint: {nid: [(rel position, True if outgoing)]}
+    @property
+    def inter_edges(self) -> Dict:
+        if self._inter_edges is None:
+            src_in,dst_in = self._rel_inside_masks()
+            inter_edges = {}
+            out_position,in_position = np.flatnonzero(src_in & ~dst_in),np.flatnonzero(dst_in & ~src_in)
+            for position,nid in zip(out_position.tolist(), self.rel_dst[out_position].tolist()):
+                inter_edges.setdefault(nid, []).append((position, True))
+            for position,nid in zip(in_position.tolist(), self.rel_src[in_position].tolist()):
+                inter_edges.setdefault(nid, []).append((position, False))
+            self._inter_edges = inter_edges
+        return self._inter_edges
     
     # get intra relation triples of community
     def get_intra_rel_triples(self):
-        intra_rel_triples = []
-        for rel in self.rel_triples:
-            if rel[0] in self.ent_nids and rel[2] in self.ent_nids: 
-                intra_rel_triples.append(rel)
-        return intra_rel_triples
+        src_in,dst_in = self._rel_inside_masks()
+        return self._rel_triples_of(src_in & dst_in)
 
     # get inter relation triples of community
     def get_inter_rel_triples(self, direct=None):
-        inter_rel_triples = []
-        for rel in self.rel_triples:
-            if direct is None:
-                if rel[0] not in self.ent_nids or rel[2] not in self.ent_nids: 
-                    inter_rel_triples.append(rel)
-            elif direct.lower() == 'in':
-                if rel[2] in self.ent_nids and rel[0] not in self.ent_nids:
-                    inter_rel_triples.append(rel)
-            elif direct.lower() == 'out':
-                if rel[0] in self.ent_nids and rel[2] not in self.ent_nids:
-                    inter_rel_triples.append(rel)
-        return inter_rel_triples
+        src_in,dst_in = self._rel_inside_masks()
+        if direct is None:
+            mask = ~(src_in & dst_in)
+        elif direct.lower() == 'in':
+            mask = dst_in & ~src_in
+        elif direct.lower() == 'out':
+            mask = src_in & ~dst_in
+        else:
+            mask = np.zeros(len(self.rel_src), dtype=bool)
+        return self._rel_triples_of(mask)
+
+    def _rel_triples_of(self, mask) -> List[Tuple]:
+        return list(zip(self.rel_src[mask].tolist(), RELATION_VOCAB.decode_all(self.rel_ids[mask].tolist()), self.rel_dst[mask].tolist()))
         
     # Breadth-First Search (BFS)
     # summary_method = prims/kruskal
     # keep_one = use one way value if two exist
     def bfs2text(self, summary_method=prims, keep_one=True) -> List[str]:
+        if self._text_memo is None:
+            self._text_memo = {}
+        text = self._text_memo.get((summary_method, keep_one))
+        if text is None:
+            text = tuple(self._bfs2text(summary_method, keep_one))
+            self._text_memo[(summary_method, keep_one)] = text
+        return list(text)
+
+    def _bfs2text(self, summary_method, keep_one) -> List[str]:
         result = []
         from_node_index = self.get_index_by_nid(self.cid)
-        ent_label_list = [ent[1] for ent in self.ent_triples]
-        directed_rel_matrix = self.relation_matrix
-        undirected_adj_matrix = np.where(np.array(directed2undirected(directed_rel_matrix)) == None, 0, 1)
-        if undirected_adj_matrix.shape[0] <= 1: #single-node community
+        ent_label_list = self.ent_labels
+        graph = self.graph
+        if len(graph) <= 1: #single-node community
             return result
-        if keep_one: 
-            undirected_adj_matrix = np.triu(undirected_adj_matrix, 1)
+        undirected_adj_matrix = graph.undirected_adjacency(upper=keep_one).astype(np.int64) #keep_one: upper triangle
         if summary_method: #Prim, kruskal
             undirected_adj_matrix = summary_method(undirected_adj_matrix)
-        visited_node = np.zeros(len(directed_rel_matrix), dtype=np.int8)
-        visited_edge = np.zeros((len(directed_rel_matrix), len(directed_rel_matrix)), dtype=np.int8)
+        visited_node = np.zeros(len(graph), dtype=np.int8)
+        visited_edge = np.zeros((len(graph), len(graph)), dtype=np.int8)
         visited_node[from_node_index] = 1
         queue = deque([from_node_index])
         while queue:
             from_node_index = queue.popleft()
             visited_node[from_node_index] = 1
             #print(from_node_index)  # Do something with the node
-            for to_node_index in range(len(undirected_adj_matrix)):
-                is_connected = undirected_adj_matrix[from_node_index][to_node_index]
-                if is_connected > 0: #has undirect relation
-                    element = directed_rel_matrix[from_node_index][to_node_index]
-                    if visited_node[to_node_index] == 0: #should not be stop
-                        queue.append((to_node_index))
-                    if visited_edge[from_node_index][to_node_index] == 0:
-                        if element is not None: #only dircted elemnt will be added in
-                            result.append('(' + ent_label_list[from_node_index] + ', ' + str(element) \
-                                 + ', ' + ent_label_list[to_node_index] + ')') # Do something with the edge (directed)
-                        visited_edge[from_node_index][to_node_index] == 1                    
+            for to_node_index in np.flatnonzero(undirected_adj_matrix[from_node_index]).tolist(): #has undirect relation
+                element = graph.relation(from_node_index, to_node_index)
+                if visited_node[to_node_index] == 0: #should not be stop
+                    queue.append((to_node_index))
+                if visited_edge[from_node_index][to_node_index] == 0:
+                    if element is not None: #only dircted elemnt will be added in
+                        result.append('(' + ent_label_list[from_node_index] + ', ' + str(element) \
+                             + ', ' + ent_label_list[to_node_index] + ')') # Do something with the edge (directed)
+                    visited_edge[from_node_index][to_node_index] == 1                    
         return result
                     
     def _dfs2text(from_node_index, ent_label_list, directed_matrix, undirected_matrix, visited_node=None, visited_edge=None):
@@ -221,9 +483,9 @@ class Community:
     #def dfs2text(from_node_index, entity_list, relation_matrix, visited_node=None, visited_edge=None):
     def dfs2text(self, summary_method=prims, keep_one=True) -> List[str]:
         result = []
-        ent_label_list = [ent[1] for ent in self.ent_triples]
+        ent_label_list = self.ent_labels
         directed_matrix = self.relation_matrix
-        undirected_adj_matrix = np.where(np.array(directed2undirected(directed_matrix)) == None, 0, 1)
+        undirected_adj_matrix = self.graph.undirected_adjacency().astype(np.int64)
         if undirected_adj_matrix.shape[0] <= 1: #single-node community
             return result
         if keep_one: 
@@ -233,6 +495,62 @@ class Community:
         result = _dfs2text(self.get_index_by_nid(self.cid), ent_label_list, directed_matrix, undirected_adj_matrix, None, None)
         return result
 
+'''
+accumulated local subgraph of one question, grown by the delta of each community search
+node index, directed relations and undirected adjacency are updated incrementally on add,
+so a search only pays for its own region instead of rebuilding the matrices of the whole window
+'''
+class SubgraphWorkspace:
+    def __init__(self, capacity=128):
+        self.nid2index = {}
+        self.nids,self.labels = [],[]
+        self.out_relations = [] #index -> {(r.value, n2 index): None}, a dict keeps the insertion order of relations
+        self.adj_matrix = np.zeros((capacity, capacity), dtype=np.int8) #undirected, self-circle ignored
+
+    def __len__(self):
+        return len(self.nids)
+
+    def __contains__(self, nid):
+        return nid in self.nid2index
+
+    def _grow(self, size):
+        capacity = len(self.adj_matrix)
+        if size > capacity:
+            while capacity < size:
+                capacity *= 2
+            adj_matrix = np.zeros((capacity, capacity), dtype=np.int8)
+            adj_matrix[:len(self.nids), :len(self.nids)] = self.adj_matrix[:len(self.nids), :len(self.nids)]
+            self.adj_matrix = adj_matrix
+
+    # add entity triples (nid, label, distance) and relation triples (n1.nid, r.value, n2.nid)
+    # relations with an endpoint out of workspace are ignored, return the nids not seen before
+    def add(self, ent_triples: List[Tuple], rel_triples: List[Tuple]) -> List:
+        new_nids = [ent[0] for ent in ent_triples if ent[0] not in self.nid2index]
+        self._grow(len(self.nids) + len(new_nids))
+        for ent in ent_triples:
+            if ent[0] not in self.nid2index:
+                self.nid2index[ent[0]] = len(self.nids)
+                self.nids.append(ent[0])
+                self.labels.append(ent[1])
+                self.out_relations.append({})
+        for rel in rel_triples:
+            if rel[0] in self.nid2index and rel[2] in self.nid2index:
+                from_index,to_index = self.nid2index[rel[0]],self.nid2index[rel[2]]
+                if from_index != to_index:
+                    self.out_relations[from_index][(rel[1], to_index)] = None
+                    self.adj_matrix[from_index, to_index] = 1
+                    self.adj_matrix[to_index, from_index] = 1
+        return new_nids
+
+    # relation triples and undirected adjacency matrix among given nids (order kept), like triples2matrix + directed2undirected
+    def region(self, nids: List) -> (List[Tuple], np.ndarray):
+        index = [self.nid2index[nid] for nid in nids]
+        in_region = set(index)
+        rel_triples = [(self.nids[from_index], value, self.nids[to_index]) for from_index in index \
+                       for value,to_index in self.out_relations[from_index] if to_index in in_region]
+        adj_matrix = self.adj_matrix[np.ix_(index, index)].astype(np.int64)
+        return rel_triples,adj_matrix
+
 #get relation matrix from given enetiies and relation triples by entities order
 def triples2matrix(ent_triples: List[Tuple], rel_triples: List[Tuple]) -> List[List]:
     assert ent_triples is not None
@@ -264,44 +582,72 @@ def communiies2matrix(communities:List[Community]) -> (List[List[str]],Dict,Dict
     rel_matrix = triples2matrix(all_ent_triples, all_rel_triples)
     return rel_matrix,nid2index,index2nid
 
+#RelationGraph of all entities of given communities and the maps between nid and index
+def communities2graph(communities:List[Community]) -> (RelationGraph,Dict,Dict):
+    all_ent_triples,all_rel_triples = [],[]
+    nid2index,index2nid = {},{}
+    for commu in communities:
+        all_ent_triples.extend(commu.ent_triples)
+        all_rel_triples.extend(commu.rel_triples)
+    for index,ent in enumerate(all_ent_triples):
+        index2nid[index] = ent[0]
+        nid2index[ent[0]] = index
+    return RelationGraph.from_triples(all_ent_triples, all_rel_triples),nid2index,index2nid
+
 #transform a directed matrix to undirected matrix by copy or merge
+#only the related pairs are visited, RelationGraph.undirected_edges/undirected_relation do the same on edge arrays
 def directed2undirected(directed_matrix: List[List]) -> List[List]:
-    undirected_matrix = copy.deepcopy(directed_matrix)
-    for index in range(len(undirected_matrix)):
-        for jndex in range(index, len(undirected_matrix[index])):
-            if undirected_matrix[index][jndex] is not None and undirected_matrix[jndex][index] is not None:
-                if undirected_matrix[index][jndex] != undirected_matrix[jndex][index]:
-                    value = undirected_matrix[index][jndex] + '/' + undirected_matrix[jndex][index]
-                    undirected_matrix[index][jndex] = value
-                    undirected_matrix[jndex][index] = value
-            elif undirected_matrix[index][jndex] is not None:
-                undirected_matrix[jndex][index] = undirected_matrix[index][jndex]
-            elif undirected_matrix[jndex][index] is not None:
-                undirected_matrix[index][jndex] = undirected_matrix[jndex][index]
+    undirected_matrix = [list(row) for row in directed_matrix]
+    if len(directed_matrix) <= 1: #[] or [[]] of a single entity
+        return undirected_matrix
+    present = np.array(directed_matrix, dtype=object) != None
+    for index,jndex in zip(*np.nonzero(np.triu(present | present.T))):
+        forward,backward = directed_matrix[index][jndex],directed_matrix[jndex][index]
+        if forward is not None and backward is not None:
+            if forward != backward:
+                undirected_matrix[index][jndex] = undirected_matrix[jndex][index] = forward + '/' + backward
+        elif forward is not None:
+            undirected_matrix[jndex][index] = forward
+        else:
+            undirected_matrix[index][jndex] = backward
     return undirected_matrix
 
 #get connection between from_comm to to_comm
 #connection = from_conn or to_conn
 def get_community_connection(from_comm:Community, to_comm:Community) -> int:
-    from_conn,to_conn = 0,0
-    for rel in from_comm.rel_triples:
-        if rel[0] in to_comm.ent_nids or rel[2] in to_comm.ent_nids:
-            from_conn += 1
-    for rel in to_comm.rel_triples:
-        if rel[0] in from_comm.ent_nids or rel[2] in from_comm.ent_nids:
-            to_conn += 1
-    return max(from_conn, to_conn)
+    from_conn = np.count_nonzero(np.isin(from_comm.rel_src, to_comm.nids) | np.isin(from_comm.rel_dst, to_comm.nids))
+    to_conn = np.count_nonzero(np.isin(to_comm.rel_src, from_comm.nids) | np.isin(to_comm.rel_dst, from_comm.nids))
+    return int(max(from_conn, to_conn))
+
+#connection of every pair of communities, conn[i, j] = conn[j, i] = get_community_connection(communities[i], communities[j])
+#relations of the communities are stacked once and their endpoints looked up in one entity x community membership
+#matrix (communities may overlap), from_conn[i] is then the column sum of the relation rows of communities[i]
+def community_connection_matrix(communities:List[Community]) -> np.ndarray:
+    num_comm = len(communities)
+    if num_comm == 0:
+        return np.zeros((0, 0), dtype=np.int64)
+    ent_owner = np.repeat(np.arange(num_comm), [len(comm.nids) for comm in communities])
+    unique_nids,ent_index = np.unique(np.concatenate([comm.nids for comm in communities]), return_inverse=True)
+    membership = np.zeros((len(unique_nids) + 1, num_comm), dtype=np.int64) #last row for nids out of the communities
+    membership[ent_index, ent_owner] = 1
+    def member_row(nids):
+        position = np.minimum(np.searchsorted(unique_nids, nids), len(unique_nids) - 1)
+        return np.where(unique_nids[position] == nids, position, len(unique_nids))
+    rel_src = np.concatenate([comm.rel_src for comm in communities])
+    rel_dst = np.concatenate([comm.rel_dst for comm in communities])
+    touched = membership[member_row(rel_src)] | membership[member_row(rel_dst)] #relation x community
+    rel_ptr = np.zeros(num_comm + 1, dtype=np.int64)
+    np.cumsum([len(comm.rel_src) for comm in communities], out=rel_ptr[1:])
+    touched_sum = np.vstack([np.zeros((1, num_comm), dtype=np.int64), np.cumsum(touched, axis=0)])
+    from_conn = touched_sum[rel_ptr[1:]] - touched_sum[rel_ptr[:-1]]
+    return np.maximum(from_conn, from_conn.T)
 
 #get connected community from center_comm to other communities
 def get_connected_community(center_comm:Community, communities:List[Community], minimum_conn=0) -> List[Community]:
-    connected_comm = []
-    for comm in communities:
-        if comm.cid != center_comm.cid:
-            conn = get_community_connection(center_comm, comm)
-            #ipdb.set_trace(context=10)
-            if conn > minimum_conn:
-                connected_comm.append(comm)
-    return connected_comm
+    if len(communities) == 0:
+        return []
+    connection = community_connection_matrix([center_comm] + communities)[0, 1:].tolist()
+    return [comm for comm,conn in zip(communities, connection) if comm.cid != center_comm.cid and conn > minimum_conn]
 
 #community like [{0,3},{1,2}] to [0,1,1,0]
 def community_dict2list(community_dict):
@@ -345,44 +691,34 @@ def build_community(
     commtag2node_index: List[Set[int]], #set is the node index of comm 
     comm_scores: List[int] #len of commtag2node_index
 ) -> List[Community]:
-    index2entity = {index:(ent[0], ent[1], ent[2]) for index,ent in enumerate(ent_triples)} #0,1,2 for nid,label,distance
-    nid2index = {index2entity[index][0]:index for index in index2entity}
-    index2rel_from = {index:[] for index in index2entity}
-    index2rel_to = {index:[] for index in index2entity} #indexofrel
-    #split and copy the rel for each community
-    for rel in rel_triples:
-        from_nid,to_nid = rel[0],rel[2]
-        index2rel_from[nid2index[from_nid]].append((rel[0], rel[1], rel[2]))
-        index2rel_to[nid2index[to_nid]].append((rel[0], rel[1], rel[2]))
-    commtag2entity,commtag2relation,commtag2score,commtag = {},{},{},set() #commtag
-    for tag,node_ids in enumerate(commtag2node_index): #index as tag
-        if tag not in commtag2entity:
-            commtag2entity[tag] = []
-            commtag2relation[tag] = []
-        for node_index in node_ids:
-            commtag2entity[tag].append((index2entity[node_index][0], #nid
-                                     index2entity[node_index][1], #val
-                                     index2entity[node_index][2])) #dicstance
-            commtag2relation[tag].extend(index2rel_from[node_index] + index2rel_to[node_index])
-            commtag2score[tag] = comm_scores[tag] #index as tag
-            commtag.add(tag)
-    #build community
+    #entities and relations of the window as arrays once, communities keep slices of them
+    ent_columns,rel_columns = list(zip(*ent_triples)),list(zip(*rel_triples)) or [(), (), ()]
+    nids,label_ids = np.array(ent_columns[0], dtype=np.int64),LABEL_VOCAB.encode_all(ent_columns[1]) #0,1,2 for nid,label,distance
+    distances = np.array(ent_columns[2], dtype=np.int32)
+    rel_src,rel_ids,rel_dst = np.array(rel_columns[0], dtype=np.int64),RELATION_VOCAB.encode_all(rel_columns[1]),np.array(rel_columns[2], dtype=np.int64)
+    nid2index = {nid:index for index,nid in enumerate(ent_columns[0])}
+    index2rel_from = {index:[] for index in range(len(ent_triples))}
+    index2rel_to = {index:[] for index in range(len(ent_triples))} #indexofrel
+    #split the rel for each community, a relation inside a community is kept twice (from and to)
+    for rel_index,rel in enumerate(rel_triples):
+        index2rel_from[nid2index[rel[0]]].append(rel_index)
+        index2rel_to[nid2index[rel[2]]].append(rel_index)
     communities = []
-    for tag in commtag:
-        ents = commtag2entity[tag]
-        rels = commtag2relation[tag]
-        score = commtag2score[tag]
-        communities.append(Community(ent_triples=ents, rel_triples=rels, quality=score))
+    for tag,node_ids in enumerate(commtag2node_index): #index as tag
+        if len(node_ids) == 0:
+            continue
+        node_index = np.array(list(node_ids), dtype=np.int64)
+        rel_index = np.array([rel for index in node_index.tolist() for rel in index2rel_from[index] + index2rel_to[index]], dtype=np.int64)
+        communities.append(Community.from_arrays(nids[node_index], label_ids[node_index], distances[node_index], \
+                                                 rel_src[rel_index], rel_ids[rel_index], rel_dst[rel_index], quality=comm_scores[tag]))
     return communities
 
 # get the belonging community if entity with nid in community
 def find_belonged_community_by_nid(communities:List[Community], nid:int) -> Community:
     target_comm = None
     for comm in communities:
-        for ent in comm.ent_triples:
-            if ent[0] == nid:
-                target_comm = comm
-                break
+        if nid in comm.ent_nids:
+            target_comm = comm
     return target_comm
 
 #prune the communities of center_community from communities with connection less than minimum_conn
@@ -405,59 +741,40 @@ def get_interset(comm1:Community, comm2:Community):
     return comm1.ent_nids & comm2.ent_nids
 
 # get edges between community (only directed edges)
+# edges of the inter relations of comm1 then comm2 in their order, an edge from comm2 to comm1 is dropped with keep_out
+# if the pair of entities is already related, edges (and their text) are memoized on comm1 for (comm2, keep_out)
 def get_community_edges(comm1:Community, comm2:Community, keep_out:bool=True) -> List[Tuple]:
-    edges = set() #nid, value, nid
+    if comm1._edge_memo is None:
+        comm1._edge_memo = {}
+    memo = comm1._edge_memo.get((comm2.cid, keep_out))
+    if memo is not None and memo[0] is comm2:
+        return list(memo[1])
+    edges = set() #label, value, label
     direction = set() #nid, nid
-    for rel in comm1.get_inter_rel_triples(): #bidirectional
-        from_nid,value,to_nid = rel[0],rel[1],rel[2]
-        label1,label2,index1,index2 = None,None,-1,-1 
-        if from_nid in comm1.ent_nids and to_nid in comm2.ent_nids:
-            index1 = comm1.get_index_by_nid(from_nid)
-            index2 = comm2.get_index_by_nid(to_nid)
-            id1 = comm1.ent_triples[index1][0]
-            id2 = comm2.ent_triples[index2][0]
-            label1 = comm1.ent_triples[index1][1]
-            label2 = comm2.ent_triples[index2][1]
-            edges.add((label1, value, label2))
-            direction.add((id1, id2))
-        if from_nid in comm2.ent_nids and to_nid in comm1.ent_nids:
-            index1 = comm2.get_index_by_nid(from_nid)
-            index2 = comm1.get_index_by_nid(to_nid)
-            id1 = comm2.ent_triples[index1][0]
-            id2 = comm1.ent_triples[index2][0]
-            label1 = comm2.ent_triples[index1][1]
-            label2 = comm1.ent_triples[index2][1]
-            if keep_out:
-                if (id1, id2) in direction or (id2, id1) in direction:
+    for comm,other_comm in ((comm1, comm2), (comm2, comm1)):
+        inter_edges = comm.inter_edges
+        candidates = sorted(edge for nid in inter_edges.keys() & other_comm.ent_nids for edge in inter_edges[nid])
+        for position,outgoing in candidates:
+            from_nid,to_nid = comm.rel_src[position].item(),comm.rel_dst[position].item()
+            value = RELATION_VOCAB.decode(comm.rel_ids[position])
+            if outgoing == (comm is comm1): #comm1 -> comm2
+                edges.add((comm1.get_label_by_nid(from_nid), value, comm2.get_label_by_nid(to_nid)))
+            else: #comm2 -> comm1
+                if keep_out and ((from_nid, to_nid) in direction or (to_nid, from_nid) in direction):
                     continue
-            edges.add((label1, value, label2))
-            direction.add((id1, id2))
-    for rel in comm2.get_inter_rel_triples(): #bidirectional
-        from_nid,value,to_nid = rel[0],rel[1],rel[2]
-        label1,label2,index1,index2 = None,None,-1,-1 
-        if from_nid in comm1.ent_nids and to_nid in comm2.ent_nids:
-            index1 = comm1.get_index_by_nid(from_nid)
-            index2 = comm2.get_index_by_nid(to_nid)
-            id1 = comm1.ent_triples[index1][0]
-            id2 = comm2.ent_triples[index2][0]
-            label1 = comm1.ent_triples[index1][1]
-            label2 = comm2.ent_triples[index2][1]
-            edges.add((label1, value, label2))
-            direction.add((id1, id2))
-        if from_nid in comm2.ent_nids and to_nid in comm1.ent_nids:
-            index1 = comm2.get_index_by_nid(from_nid)
-            index2 = comm1.get_index_by_nid(to_nid)
-            id1 = comm2.ent_triples[index1][0]
-            id2 = comm1.ent_triples[index2][0]
-            label1 = comm2.ent_triples[index1][1]
-            label2 = comm1.ent_triples[index2][1]
-            if keep_out:
-                if (id1, id2) in direction or (id2, id1) in direction:
-                    continue
-            edges.add((label1, value, label2))
-            direction.add((id1, id2))
+                edges.add((comm2.get_label_by_nid(from_nid), value, comm1.get_label_by_nid(to_nid)))
+            direction.add((from_nid, to_nid))
     edges = list(edges)
-    return edges
+    comm1._edge_memo[(comm2.cid, keep_out)] = [comm2, edges, None]
+    return list(edges)
+
+#triple2text of the edges between communities, memoized with the edges
+def get_community_edge_text(comm1:Community, comm2:Community, keep_out:bool=True) -> List[str]:
+    edges = get_community_edges(comm1, comm2, keep_out)
+    memo = comm1._edge_memo[(comm2.cid, keep_out)]
+    if memo[2] is None:
+        memo[2] = tuple(triple2text(list(set(edges))))
+    return list(memo[2])
 
 #just return the text of edges with label - (r.value) -> label format 
 def triple2text(edges:List[Tuple]) -> List[str]:
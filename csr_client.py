@@ -0,0 +1,326 @@
+import csv
+import threading
+import numpy as np
+from array import array
+from kg_client import topk_by_distance
+
+#CSR arrays of a graph, node_nids must be sorted and edges are given by nid
+#return indptr, indices (undirected distinct neighbors), out_indptr, out_indices, out_rel_ids (directed relations)
+def build_csr(node_nids, src_nids, rel_ids, dst_nids):
+    num_node = len(node_nids)
+    index_dtype = np.int32 if num_node < 2**31 else np.int64
+    src = np.searchsorted(node_nids, src_nids).astype(np.int64)
+    dst = np.searchsorted(node_nids, dst_nids).astype(np.int64)
+    rel_ids = np.asarray(rel_ids, dtype=np.int32)
+    #directed relations sorted by (src, rel, dst) without duplicates
+    order = np.lexsort((dst, rel_ids, src))
+    src,rel_ids,dst = src[order],rel_ids[order],dst[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (rel_ids[1:] != rel_ids[:-1]) | (dst[1:] != dst[:-1])
+    src,rel_ids,dst = src[keep],rel_ids[keep],dst[keep]
+    out_indptr = np.zeros(num_node + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_node), out=out_indptr[1:])
+    #undirected distinct neighbors, self-circle ignored
+    head,tail = np.concatenate([src, dst]),np.concatenate([dst, src])
+    mask = head != tail
+    pair = np.unique(head[mask] * num_node + tail[mask]) #sorted by (head, tail)
+    head,indices = np.divmod(pair, max(num_node, 1))
+    indptr = np.zeros(num_node + 1, dtype=np.int64)
+    np.cumsum(np.bincount(head, minlength=num_node), out=indptr[1:])
+    return indptr,indices.astype(index_dtype),out_indptr,dst.astype(index_dtype),rel_ids
+
+'''
+in-memory knowledge graph on NumPy CSR arrays, drop-in replacement of neo4j_client without server
+node index i <-> node_nids[i] (sorted), labels[i] is the label of node i
+indptr/indices: undirected adjacency (distinct neighbors) used for neighbor sampling
+out_indptr/out_indices/out_rel_ids: directed relations, out_rel_ids index rel_vocab
+degree_cap: sample among the first degree_cap neighbors of each node like neo4j_client(degree_cap=...)
+expansion_policy: optional kg_profile.ExpansionPolicy of the bfs like neo4j_client(expansion_policy=...)
+neighbor_ranker: optional kg_relevance.NeighborRanker like neo4j_client(neighbor_ranker=...), scored on the relation ids
+relation_filter: optional kg_profile.RelationFilter like neo4j_client(relation_filter=...), neighbors linked only by
+                 filtered relations are never sampled
+'''
+class CSRGraphClient():
+    def __init__(self, node_nids, labels, indptr, indices, out_indptr, out_indices, out_rel_ids, rel_vocab, seed=None, degree_cap=None, expansion_policy=None, \
+                 neighbor_ranker=None, relation_filter=None):
+        self.node_nids = node_nids
+        self.labels = labels
+        self.indptr = indptr
+        self.indices = indices
+        self.out_indptr = out_indptr
+        self.out_indices = out_indices
+        self.out_rel_ids = out_rel_ids
+        self.rel_vocab = rel_vocab
+        self.seed = seed
+        self.degree_cap = degree_cap
+        self.expansion_policy = expansion_policy
+        self.neighbor_ranker = neighbor_ranker
+        self.relation_filter = relation_filter
+        self.rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock() #Generator is not thread-safe
+        self._label2index = None
+        self._rel_scores = None #(ranker, score of each rel id)
+        self._kept = None #(filter, mask of kept rel ids)
+
+    #triple dump with rows: nid, label, relation, nid[, label]
+    #rows with only nid, label register the node without relation
+    @classmethod
+    def from_triples_file(cls, path, delimiter='\t', seed=None, degree_cap=None):
+        nid2label = {}
+        src_nids,dst_nids,rel_ids,rel2id = array('q'),array('q'),array('l'),{}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                if len(row) < 2 or not row[0].lstrip('-').isdigit(): #empty or header
+                    continue
+                if nid2label.get(int(row[0])) is None: #head label overrides the placeholder of a destination seen before
+                    nid2label[int(row[0])] = row[1]
+                if len(row) >= 4 and len(row[2]) > 0:
+                    dst_nid = int(row[3])
+                    if len(row) >= 5:
+                        if nid2label.get(dst_nid) is None:
+                            nid2label[dst_nid] = row[4]
+                    else:
+                        nid2label.setdefault(dst_nid, None)
+                    if row[2] not in rel2id:
+                        rel2id[row[2]] = len(rel2id)
+                    src_nids.append(int(row[0]))
+                    dst_nids.append(dst_nid)
+                    rel_ids.append(rel2id[row[2]])
+        node_nids = np.array(sorted(nid2label), dtype=np.int64)
+        labels = [nid2label[nid] if nid2label[nid] is not None else str(nid) for nid in node_nids.tolist()]
+        rel_vocab = [None] * len(rel2id)
+        for rel,rel_id in rel2id.items():
+            rel_vocab[rel_id] = rel
+        return cls.from_edges(node_nids, labels, np.frombuffer(src_nids, dtype=np.int64), np.asarray(rel_ids, dtype=np.int32), \
+                              np.frombuffer(dst_nids, dtype=np.int64), rel_vocab, seed=seed, degree_cap=degree_cap)
+
+    #node_nids must be sorted, edges are given by nid
+    @classmethod
+    def from_edges(cls, node_nids, labels, src_nids, rel_ids, dst_nids, rel_vocab, seed=None, degree_cap=None):
+        indptr,indices,out_indptr,out_indices,out_rel_ids = build_csr(node_nids, src_nids, rel_ids, dst_nids)
+        return cls(np.asarray(node_nids, dtype=np.int64), labels, indptr, indices, out_indptr, out_indices, out_rel_ids, rel_vocab, \
+                   seed=seed, degree_cap=degree_cap)
+
+    def _label(self, index):
+        return self.labels[index]
+
+    def _index_of_label(self, label):
+        if self._label2index is None:
+            label2index = {}
+            for index,node_label in enumerate(self.labels):
+                label2index.setdefault(node_label, index)
+            self._label2index = label2index
+        return self._label2index.get(label)
+
+    #node indices of given nids, nids not in graph are dropped
+    def _indices_of(self, nid_list):
+        nids = np.asarray(nid_list, dtype=np.int64)
+        index = np.searchsorted(self.node_nids, nids)
+        index = np.minimum(index, len(self.node_nids) - 1)
+        return index[self.node_nids[index] == nids] if len(self.node_nids) > 0 else index[:0]
+
+    #slots of CSR of given rows, only the first cap slots of each row if cap is given
+    #return (row position of each slot, slot, offset of the row of each slot in the concatenated slots)
+    @staticmethod
+    def _row_slots(indptr, rows, cap=None):
+        starts = indptr[rows]
+        degrees = indptr[rows + 1] - starts
+        if cap is not None:
+            degrees = np.minimum(degrees, cap)
+        offsets = np.repeat(np.cumsum(degrees) - degrees, degrees)
+        row_pos = np.repeat(np.arange(len(rows)), degrees)
+        slots = np.repeat(starts, degrees) + np.arange(int(degrees.sum())) - offsets
+        return row_pos,slots,offsets
+
+    #sample at most max_neighbor distinct neighbors of every frontier node without replacement
+    #max_neighbor is a scalar or an array of the max neighbor of each frontier node
+    #exclude: node indices never sampled, they do not take the sampling slots
+    #return neighbor indices grouped by frontier order
+    def _sample_neighbors(self, frontier, max_neighbor, exclude=None):
+        row_pos,slots,offsets = self._candidate_slots(frontier, exclude)
+        if len(slots) == 0:
+            return slots
+        with self._rng_lock:
+            keys = self.rng.random(len(slots))
+        if self.neighbor_ranker is None:
+            order = np.lexsort((keys, row_pos)) #shuffle inside each row
+        else: #best scores first inside each row, shuffled among equal scores
+            order = np.lexsort((keys, -self._slot_scores(frontier, row_pos, slots), row_pos))
+        rank = np.arange(len(slots)) - offsets #row_pos is unchanged after sorting
+        if not np.isscalar(max_neighbor):
+            max_neighbor = np.asarray(max_neighbor)[row_pos]
+        return self.indices[slots[order[rank < max_neighbor]]]
+
+    #slots of the neighbors of frontier that can be sampled like _row_slots
+    #with relation_filter or exclude the degree_cap applies to the kept slots, as both come before LIMIT in neo4j
+    def _candidate_slots(self, frontier, exclude=None):
+        if self.relation_filter is None and exclude is None:
+            return self._row_slots(self.indptr, frontier, cap=self.degree_cap)
+        row_pos,slots,_ = self._row_slots(self.indptr, frontier)
+        keep = np.ones(len(slots), dtype=bool)
+        if self.relation_filter is not None: #linked by at least one kept relation
+            slot_pos,rel_ids = self._slot_relations(frontier, row_pos, slots)
+            keep &= np.bincount(slot_pos[self._kept_relations()[rel_ids]], minlength=len(slots)) > 0
+        if exclude is not None:
+            keep &= ~np.isin(self.indices[slots], exclude)
+        row_pos,slots = row_pos[keep],slots[keep]
+        degrees = np.bincount(row_pos, minlength=len(frontier))
+        offsets = np.repeat(np.cumsum(degrees) - degrees, degrees)
+        if self.degree_cap is not None:
+            keep = np.arange(len(slots)) - offsets < self.degree_cap
+            row_pos,slots = row_pos[keep],slots[keep]
+            degrees = np.minimum(degrees, self.degree_cap)
+            offsets = np.repeat(np.cumsum(degrees) - degrees, degrees)
+        return row_pos,slots,offsets
+
+    #mask of kept rel ids, built once per filter
+    def _kept_relations(self):
+        if self._kept is None or self._kept[0] is not self.relation_filter:
+            self._kept = (self.relation_filter, self.relation_filter.mask(self.rel_vocab))
+        return self._kept[1]
+
+    #directed relations in both directions between the frontier node and the neighbor of each candidate slot
+    #read from the out rows of the frontier and of the sampled neighbors only, so that no index of the whole graph is built
+    #return (position of the slot, rel id) of every relation, frontier nodes are distinct
+    def _slot_relations(self, frontier, row_pos, slots):
+        num_node = len(self.node_nids)
+        neighbors = self.indices[slots]
+        slot_keys = frontier[row_pos].astype(np.int64) * num_node + neighbors
+        key_order = np.argsort(slot_keys, kind='stable')
+        sorted_keys = slot_keys[key_order]
+        unique = np.unique(neighbors)
+        edge_pos,edge_slots,_ = self._row_slots(self.out_indptr, frontier)
+        out_keys = frontier[edge_pos].astype(np.int64) * num_node + self.out_indices[edge_slots]
+        back_pos,back_slots,_ = self._row_slots(self.out_indptr, unique)
+        back_keys = np.asarray(self.out_indices[back_slots], dtype=np.int64) * num_node + unique[back_pos]
+        edge_keys = np.concatenate([out_keys, back_keys])
+        edge_slots = np.concatenate([edge_slots, back_slots])
+        if len(sorted_keys) == 0:
+            return sorted_keys,edge_slots[:0]
+        index = np.minimum(np.searchsorted(sorted_keys, edge_keys), len(sorted_keys) - 1)
+        found = sorted_keys[index] == edge_keys #relations to neighbors beyond degree_cap are dropped
+        return key_order[index[found]],self.out_rel_ids[edge_slots[found]]
+
+    #question relevance of the candidate slots of _sample_neighbors, same score as the ranked neighbor query
+    #best relation score over both directions between the frontier node and the neighbor, plus the label score
+    def _slot_scores(self, frontier, row_pos, slots):
+        ranker = self.neighbor_ranker
+        if self._rel_scores is None or self._rel_scores[0] is not ranker:
+            self._rel_scores = (ranker, ranker.relation_scores(self.rel_vocab))
+        rel_scores = self._rel_scores[1]
+        if self.relation_filter is not None:
+            rel_scores = np.where(self._kept_relations(), rel_scores, 0)
+        neighbors = self.indices[slots]
+        scores = np.zeros(len(slots), dtype=np.int64)
+        slot_pos,rel_ids = self._slot_relations(frontier, row_pos, slots)
+        np.maximum.at(scores, slot_pos, rel_scores[rel_ids])
+        unique,inverse = np.unique(neighbors, return_inverse=True)
+        label_scores = np.array([ranker.label_score(self._label(i)) for i in unique.tolist()], dtype=np.int64)
+        return scores + label_scores[inverse]
+
+    #vectorized level-synchronous bfs, same sampling policy as neo4j_client.get_n_hop_neighbors
+    #return (node indices, distances) in BFS order
+    def _bfs(self, start_node_id, n_hop, max_neighbor, decline_rate):
+        return self._bfs_from(self._indices_of([start_node_id]), n_hop, max_neighbor, decline_rate)
+
+    #bfs from all start node indices at once, nodes of exclude indices are never sampled nor visited
+    def _bfs_from(self, start, n_hop, max_neighbor, decline_rate, exclude=None):
+        if len(start) == 0:
+            return start,start
+        nodes,distances,frontier = [start],[np.zeros(len(start), dtype=np.int64)],start
+        visited,num_result = start,len(start) #the node budget of expansion_policy counts the returned nodes only
+        for hop_count in range(n_hop):
+            if len(frontier) == 0:
+                break
+            number_neighbor = max(int(max_neighbor * (decline_rate**hop_count)), 1)
+            policy = self.expansion_policy
+            if policy is not None:
+                number_neighbor = policy.neighbor_limits(self.node_nids[frontier], number_neighbor, hop_count, num_result)
+            sampled = self._sample_neighbors(frontier, number_neighbor, exclude)
+            _,first = np.unique(sampled, return_index=True)
+            sampled = sampled[np.sort(first)] #distinct in BFS order
+            frontier = sampled[~np.isin(sampled, visited)]
+            if policy is not None:
+                frontier = frontier[policy.admit(self.node_nids[frontier])]
+                remaining = policy.remaining(num_result)
+                if remaining is not None:
+                    frontier = frontier[:remaining]
+            visited = np.concatenate([visited, frontier])
+            num_result += len(frontier)
+            nodes.append(frontier)
+            distances.append(np.full(len(frontier), hop_count + 1, dtype=np.int64))
+        return np.concatenate(nodes),np.concatenate(distances)
+
+    #directed relations among node indices, return (src index, rel id, dst index)
+    def _induced_relations(self, node_index):
+        row_pos,slots,_ = self._row_slots(self.out_indptr, node_index)
+        dst = self.out_indices[slots]
+        mask = np.isin(dst, node_index)
+        if self.relation_filter is not None:
+            mask &= self._kept_relations()[self.out_rel_ids[slots]]
+        return node_index[row_pos[mask]],self.out_rel_ids[slots[mask]],dst[mask]
+
+    def get_n_hop_neighbors(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch=True, print_cql=False):
+        node_index,distances = self._bfs(start_node_id, n_hop, max_neighbor, decline_rate)
+        result = [{'nid':nid, 'label':self._label(index), 'distance':distance} \
+                  for nid,index,distance in zip(self.node_nids[node_index].tolist(), node_index.tolist(), distances.tolist())]
+        return topk_by_distance(result, topk)
+
+    def get_node(self, nid, print_cql=False):
+        index = self._indices_of([nid])
+        if len(index) == 0:
+            return 0,None
+        return 1,(nid, self._label(int(index[0])), None)
+
+    def get_node_by_label(self, label, print_cql=False):
+        index = self._index_of_label(label)
+        if index is None:
+            return 0,None
+        return 1,(int(self.node_nids[index]), label, None)
+
+    def get_nodes_by_labels(self, labels:list, print_cql=False) -> dict:
+        return {label:self.get_node_by_label(label) for label in dict.fromkeys(labels)}
+
+    #return columnar lists (nid, label, distance), (n1.nid, r.value, n2.nid)
+    def get_neighborhood_subgraph(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+        node_index,distances = self._bfs(start_node_id, n_hop, max_neighbor, decline_rate)
+        return self._subgraph_columns(node_index[:topk], distances[:topk]) #already sorted by distance
+
+    #same as neo4j_client.get_neighborhood_subgraphs
+    def get_neighborhood_subgraphs(self, start_node_ids, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch_size=64, print_cql=False) -> dict:
+        return {nid:self.get_neighborhood_subgraph(nid, n_hop, max_neighbor, decline_rate, topk) for nid in dict.fromkeys(start_node_ids)}
+
+    #same as neo4j_client.get_multi_source_subgraph
+    def get_multi_source_subgraph(self, source_nids:list, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, exclude=None, print_cql=False):
+        start = self._indices_of(source_nids)
+        _,first = np.unique(start, return_index=True)
+        start = start[np.sort(first)]
+        exclude = self._indices_of(list(exclude)) if exclude else None
+        node_index,distances = self._bfs_from(start, n_hop, max_neighbor, decline_rate, exclude)
+        return self._subgraph_columns(node_index[:topk], distances[:topk])
+
+    #columnar lists of given nodes and the relations among them
+    def _subgraph_columns(self, node_index, distances):
+        src,rel_ids,dst = self._induced_relations(node_index)
+        ent_columns = (self.node_nids[node_index].tolist(), [self._label(i) for i in node_index.tolist()], distances.tolist())
+        rel_columns = (self.node_nids[src].tolist(), [self.rel_vocab[r] for r in rel_ids.tolist()], self.node_nids[dst].tolist())
+        return ent_columns,rel_columns
+
+    def get_relations_of_nodes(self, nid_list:list, print_cql=False):
+        src,rel_ids,dst = self._induced_relations(np.unique(self._indices_of(nid_list)))
+        return [{'n1.nid':n1, 'r.value':self.rel_vocab[r], 'n2.nid':n2} \
+                for n1,r,n2 in zip(self.node_nids[src].tolist(), rel_ids.tolist(), self.node_nids[dst].tolist())]
+
+    def count_node(self, print_cql=False):
+        return len(self.node_nids)
+
+    def count_edge(self, print_cql=False):
+        return len(self.out_indices)
+
+    def average_degree(self, sample=5000, print_cql=False):
+        degrees = np.diff(self.indptr)
+        sample_index = self.rng.choice(len(degrees), size=min(sample, len(degrees)), replace=False)
+        return np.round(degrees[sample_index].mean(), 3)
+
+    def close(self):
+        pass
@@ -0,0 +1,144 @@
+import re
+import csv
+import json
+import difflib
+import unicodedata
+from collections import Counter
+
+#all entities with their aliases, only for building the linker
+CQL_DUMP_LABELS = 'MATCH (n:Entity) \n\
+                   RETURN n.nid AS nid, n.label AS label, n.alias AS alias'
+
+#casefolded, accents and punctuation removed, whitespace collapsed
+def normalize_label(label:str) -> str:
+    label = unicodedata.normalize('NFKD', label.casefold())
+    label = ''.join(ch for ch in label if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[^\w\s]', ' ', label).split())
+
+def label_tokens(label:str) -> list:
+    return normalize_label(label).split()
+
+#alias property is a string or a list of strings
+def alias_list(alias) -> list:
+    if alias is None:
+        return []
+    if isinstance(alias, str):
+        return [alias] if len(alias) > 0 else []
+    return [a for a in alias if isinstance(a, str) and len(a) > 0]
+
+'''
+local entity-linking index of KG labels and aliases, resolves names without a KG round trip
+exact: label -> node, folded: normalized label/alias -> nodes, inverted: token -> names for fuzzy lookup
+link() returns (status, (nid, label, alias)) like neo4j_client.get_node_by_label, the first node wins for a duplicated name
+'''
+class EntityLinker():
+    def __init__(self, min_score=0.85, max_posting=10000, max_candidate=50):
+        self.min_score = min_score
+        self.max_posting = max_posting #tokens in more names than this are too common to propose candidates
+        self.max_candidate = max_candidate
+        self.nodes = [] #(nid, label, alias)
+        self.exact = {}
+        self.folded = {}
+        self.names = [] #(normalized name, node index)
+        self.inverted = {}
+
+    def add(self, nid, label, alias=None):
+        if label is None:
+            return
+        index = len(self.nodes)
+        self.nodes.append((nid, label, alias))
+        self.exact.setdefault(label, index)
+        for name in [label] + alias_list(alias):
+            normalized = normalize_label(name)
+            if len(normalized) == 0 or index in self.folded.get(normalized, ()):
+                continue
+            self.folded.setdefault(normalized, []).append(index)
+            name_index = len(self.names)
+            self.names.append((normalized, index))
+            for token in set(normalized.split()):
+                self.inverted.setdefault(token, []).append(name_index)
+
+    @classmethod
+    def from_neo4j(cls, kg_client, print_cql=False, **kwargs):
+        linker = cls(**kwargs)
+        for record in kg_client.runCQL(CQL_DUMP_LABELS, print_cql, stream=True, kind='entity_labels'):
+            linker.add(record['nid'], record['label'], record['alias'])
+        return linker
+
+    #triple dump with rows: nid, label, relation, nid[, label] (see neo4j_client.dump_triples)
+    @classmethod
+    def from_triples_file(cls, path, delimiter='\t', **kwargs):
+        linker,seen = cls(**kwargs),set()
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f, delimiter=delimiter):
+                if len(row) < 2 or not row[0].lstrip('-').isdigit(): #empty or header
+                    continue
+                for nid,label in [(row[0], row[1])] + ([(row[3], row[4])] if len(row) >= 5 and len(row[2]) > 0 else []):
+                    if nid not in seen:
+                        seen.add(nid)
+                        linker.add(int(nid), label)
+        return linker
+
+    #CSRGraphClient or MmapGraphClient
+    @classmethod
+    def from_graph_client(cls, graph_client, **kwargs):
+        linker = cls(**kwargs)
+        for index,nid in enumerate(graph_client.node_nids.tolist()):
+            linker.add(nid, graph_client._label(index))
+        return linker
+
+    #only the nodes are saved, the lookup tables are rebuilt on load
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for node in self.nodes:
+                f.write(json.dumps(node, ensure_ascii=False) + '\n')
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        linker = cls(**kwargs)
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                linker.add(*json.loads(line))
+        return linker
+
+    #best name by string similarity among the names sharing the most tokens with the query
+    def _fuzzy(self, normalized):
+        counts = Counter()
+        tokens = set(normalized.split())
+        postings = [self.inverted[token] for token in tokens if token in self.inverted]
+        rare = [posting for posting in postings if len(posting) <= self.max_posting]
+        for posting in (rare if len(rare) > 0 else postings):
+            counts.update(posting)
+        best_score,best_index = 0.0,None
+        for name_index,_ in counts.most_common(self.max_candidate):
+            name,index = self.names[name_index]
+            score = difflib.SequenceMatcher(None, normalized, name).ratio()
+            if score > best_score:
+                best_score,best_index = score,index
+        if best_score >= self.min_score:
+            return best_index,best_score
+        return None,best_score
+
+    #return (status, (nid, label, alias)), status 1 for found else 0
+    #fuzzy: fall back to the most similar name when neither exact nor folded match
+    def link(self, label, fuzzy=True):
+        index = self.exact.get(label)
+        if index is None:
+            normalized = normalize_label(label)
+            matched = self.folded.get(normalized)
+            if matched:
+                index = matched[0]
+            elif fuzzy and len(normalized) > 0:
+                index,_ = self._fuzzy(normalized)
+        if index is None:
+            return 0,None
+        return 1,self.nodes[index]
+
+    #resolve many names (e.g. topic entities of a whole dataset) in one pass, repeated names are looked up once
+    #return {label: (status, (nid, label, alias))}
+    def link_batch(self, labels, fuzzy=True) -> dict:
+        return {label:self.link(label, fuzzy) for label in dict.fromkeys(labels)}
+
+    #same interface as the kg clients
+    def get_node_by_label(self, label, print_cql=False):
+        return self.link(label)
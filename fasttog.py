@@ -1,5 +1,6 @@
 import os
 import re
+import json
 import time
 import shutil
 import argparse
@@ -9,12 +10,21 @@ from tqdm import tqdm,trange
 from datetime import datetime
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-from typing import List, Dict, Tuple, Callable, Optional
+from typing import List, Dict, Tuple, Callable, Optional, Set
 
 from utils import *
 import community_tool
 import prompt_adapter
-from kg_client import neo4j_client
+from kg_client import neo4j_client,BlockingNeo4jClient
+from csr_client import CSRGraphClient
+from graph_store import MmapGraphClient
+from kg_cache import LRUCache,SQLiteCache,TieredCache
+from kg_profile import ExpansionPolicy,HUB_MODES,load_degree_table,RelationFilter,load_relation_frequencies,load_relation_list
+from kg_prefetch import SearchPrefetcher
+from entity_linker import EntityLinker
+from kg_instrument import KGInstrument
+from kg_relevance import NeighborRanker,load_stopwords
+from neighborhood_store import NeighborhoodStore,NeighborhoodStoreClient
 from llms_client import llm_client
 from graph2text import graph2text_client
 from community_tool import Community,prims,kruskal
@@ -47,24 +57,32 @@ def community_search(
     search_depth: int = 5, 
     search_width: int = 3, 
     decline: float = 0.5, 
-    community_max_size: int = 5
+    community_max_size: int = 5,
+    multi_source: bool = False,
+    topk: int = 100,
+    exclude_nids: Optional[Set] = None,
+    workspace: Optional[community_tool.SubgraphWorkspace] = None
 ) -> (int, List[Community]):
-    from_entity = kg_client.get_node(from_community.cid)
-    if from_entity is None:
+    # Get n-hop distance nodes and relations among them in one round trip
+    if multi_source: #expand from every member of the community, skipping the nodes materialized before
+        entity_columns,relation_columns = kg_client.get_multi_source_subgraph([ent[0] for ent in from_community.ent_triples], \
+                        n_hop=search_depth, max_neighbor=search_width, decline_rate=decline, topk=topk, exclude=exclude_nids)
+    else:
+        entity_columns,relation_columns = kg_client.get_neighborhood_subgraph(from_community.cid, \
+                        n_hop=search_depth, max_neighbor=search_width, decline_rate=decline, topk=topk)
+    if len(entity_columns[0]) == 0:
         return Status.ENE, None
-    # Get n-hop distance nodes and relations
-    entity_triples = kg_client.get_n_hop_neighbors(from_community.cid, \
-                        n_hop=search_depth, max_neighbor=search_width, decline_rate=0.5)
-    if len(entity_triples) <= 1:
+    if len(entity_columns[0]) <= 1:
         return Status.ISOE, None
-    relation_triples = kg_client.get_relations_of_nodes([entity_triples[i]['nid'] for i in range(len(entity_triples))])
-    entity_triples = [(ent['nid'], ent['label'], ent['distance']) for ent in entity_triples]
-    relation_triples = [(rel['n1.nid'], rel['r.value'], rel['n2.nid']) for rel in relation_triples]
-    # Get Relation Matrix according to entity_triples list
-    relation_matrix = community_tool.triples2matrix(entity_triples, relation_triples) #entity_list: [id, label, dist]
-    # Get undirected_rel_matrix and adj matrix
-    undirected_rel_matrix = community_tool.directed2undirected(relation_matrix) #community must be in undirected
-    adj_matrix = np.where(np.array(undirected_rel_matrix) == None, 0, 1)
+    entity_triples = list(zip(*entity_columns)) #(nid, label, distance)
+    relation_triples = list(zip(*relation_columns)) #(n1.nid, r.value, n2.nid)
+    if workspace is not None: #adjacency of this region is kept by the workspace, with the relations known from earlier searches
+        workspace.add(entity_triples, relation_triples)
+        relation_triples,adj_matrix = workspace.region([ent[0] for ent in entity_triples])
+    else:
+        # Get typed adjacency according to entity_triples list
+        relation_graph = community_tool.RelationGraph.from_triples(entity_triples, relation_triples) #entity_list: [id, label, dist]
+        adj_matrix = relation_graph.undirected_adjacency().astype(np.int64) #community must be in undirected
     # Get community dict for {tag:List[int]} tag:community tag, List:index of nodes in entity_triples
     community_group,community_score = method(adj_matrix, m=community_max_size)
     communities = community_tool.build_community(entity_triples, relation_triples, community_group, community_score)
@@ -97,13 +115,10 @@ def community_display(
             label_list[nid2index[ent[0]]] = ent[1]
     if colors is None: 
         colors = [COLORS[i%len(COLORS)] for i in range(len(communities))]
-    directed_rel_matrix,_,_ = community_tool.communiies2matrix(communities)
-    undirected_rel_matrix = community_tool.directed2undirected(directed_rel_matrix)
-    undirected_adj_matrix = np.array([[]])
-    if len(directed_rel_matrix) > 1:
-        undirected_adj_matrix = np.where(np.array(undirected_rel_matrix) == None, 0, 1)
+    relation_graph,_,_ = community_tool.communities2graph(communities)
+    undirected_adj_matrix = relation_graph.undirected_adjacency().astype(np.int64)
     community_center_mask = community_tool.get_community_center_mask(undirected_adj_matrix, community_tag)
-    display_selected_community(selected_index, label_list, undirected_rel_matrix, community_tag, community_center_mask, \
+    display_selected_community(selected_index, label_list, relation_graph, community_tag, community_center_mask, \
         louvain_method, colors=colors, show_edges=show_edges, \
         random_state=random_state, figsize=figsize, dpi=dpi, save_path=save_path)
 
@@ -172,9 +187,9 @@ def community_prune_by_triples(
     for index in range(len(hist_communities)):
         premise_text = ','.join(hist_communities[index].bfs2text(summary_method)) #first parameter
         if index > 0: 
-            edges = community_tool.get_community_edges(hist_communities[index-1], hist_communities[index])
+            edges = community_tool.get_community_edge_text(hist_communities[index-1], hist_communities[index])
             if len(edges) > 0: #edges will be zero length if two community has interset 
-                edge_text = ','.join(community_tool.triple2text(list(set(edges)))) #list of str
+                edge_text = ','.join(edges) #list of str
             premise_text = edge_text + ' ' + premise_text
         if len(premise_text.strip()) > 0:
             premise.append(premise_text)
@@ -183,9 +198,9 @@ def community_prune_by_triples(
     index2comms_text = {}
     for id_ in index2comm: #add edges
         option_text = ','.join(index2comm[id_].bfs2text(summary_method))
-        edges = community_tool.get_community_edges(hist_communities[-1], index2comm[id_]) #use edges out first
+        edges = community_tool.get_community_edge_text(hist_communities[-1], index2comm[id_]) #use edges out first
         if len(edges) > 0: #overlap communities have no edges
-            edge_text = ','.join(community_tool.triple2text(list(set(edges))))
+            edge_text = ','.join(edges)
             option_text = edge_text + ',' + option_text
         index2comms_text[id_] = option_text
     request = prompt_adapter.get_prune_prompt(premise, question, index2comms_text, 'triple', keep_candidate)
@@ -242,9 +257,9 @@ def community_prune_by_g2t(
     for index in range(len(hist_communities)):
         premise_text = g2t_client.generate(','.join(hist_communities[index].bfs2text(summary_method))) #first parameter
         if index > 0: 
-            edges = community_tool.get_community_edges(hist_communities[index-1], hist_communities[index])
+            edges = community_tool.get_community_edge_text(hist_communities[index-1], hist_communities[index])
             if len(edges) > 0: #edges will be zero length if two community has interset 
-                edge_text = g2t_client.generate(','.join(community_tool.triple2text(list(set(edges)))))                
+                edge_text = g2t_client.generate(','.join(edges))                
             premise_text = edge_text + ' ' + premise_text
         if len(premise_text.strip()) > 0:
             premise.append(premise_text)
@@ -253,9 +268,9 @@ def community_prune_by_g2t(
     index2comm_text = {}
     for id_ in index2comm: #add edges
         option_text = g2t_client.generate(','.join(index2comm[id_].bfs2text(summary_method)))
-        edges = community_tool.get_community_edges(hist_communities[-1], index2comm[id_]) #use edges out first
+        edges = community_tool.get_community_edge_text(hist_communities[-1], index2comm[id_]) #use edges out first
         if len(edges) > 0: #edges will be zero length if two community has interset 
-            edge_text = g2t_client.generate(','.join(community_tool.triple2text(list(set(edges)))))
+            edge_text = g2t_client.generate(','.join(edges))
             option_text = edge_text + ' ' + option_text
         index2comm_text[id_] = option_text
     request = prompt_adapter.get_prune_prompt(premise, question, index2comm_text, 'text', keep_candidate)
@@ -315,11 +330,11 @@ def reasoning_by_triples(
             #edge_in_text,edge_out_text = [],[]
             edges = []
             if jndex == 0:
-                edges = community_tool.get_community_edges(start_community, commu) #use edges out first
+                edges = community_tool.get_community_edge_text(start_community, commu) #use edges out first
             else:
-                edges = community_tool.get_community_edges(chains[index][jndex-1], commu) #use edges out first
+                edges = community_tool.get_community_edge_text(chains[index][jndex-1], commu) #use edges out first
             if len(edges) > 0:
-                edge_text = community_tool.triple2text(list(set(edges))) #list of str
+                edge_text = edges #list of str
                 if len(edge_text) > 0:
                     text_of_list[index].append(','.join(edge_text))
             commu_text = commu.bfs2text(summary_method) #comm text will be [] if comm is a single-node comm
@@ -383,11 +398,11 @@ def reasoning_by_g2t(
             edges = []
             commu = chains[index][jndex]
             if jndex == 0:
-                edges = community_tool.get_community_edges(start_community, commu) #use edges out first
+                edges = community_tool.get_community_edge_text(start_community, commu) #use edges out first
             else:
-                edges = community_tool.get_community_edges(chains[index][jndex-1], commu) #use edges out first
+                edges = community_tool.get_community_edge_text(chains[index][jndex-1], commu) #use edges out first
             if len(edges) > 0:
-                edge_text = g2t_client.generate(','.join(community_tool.triple2text(list(set(edges)))))
+                edge_text = g2t_client.generate(','.join(edges))
                 if len(edge_text.strip()) > 0:
                     text_of_list[index].append(edge_text)
             commu_text = g2t_client.generate(','.join(commu.bfs2text(summary_method)))
@@ -440,13 +455,15 @@ Two phases of FastToG
 # 2. graph pruning for neighbor communities (first-pharse communities)
 # 3. append first-pharse communities to reasoning chain
 # return center_community, candidate_communities
-def initial_pharse(question, kg_cli, llm_cli, g2t_cli, start_community, args, log_path) -> (int,Community,List[Community]):
+# prefetcher: searches of the candidates start in background before the LLM pruning
+def initial_pharse(question, kg_cli, llm_cli, g2t_cli, start_community, args, log_path, workspace=None, prefetcher=None) -> (int,Community,List[Community]):
     status = Status.UNK
     #Build Center Community and search the neighbors
     if log_path is not None:
         print('initial phase...')
     status,communities = community_search(kg_cli, start_community, args.community_detect_algorithm,
-        args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, args.community_max_size)
+        args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, args.community_max_size, topk=args.search_topk,
+        workspace=workspace)
     if status != Status.OK:
         return status,None,None
     center_community = community_tool.find_belonged_community_by_nid(communities, nid=start_community.cid)
@@ -459,6 +476,9 @@ def initial_pharse(question, kg_cli, llm_cli, g2t_cli, start_community, args, lo
         candidate_communities = neighbor_communities
     else:
         return Status.NME,None,None
+    if prefetcher is not None: #exclude is the same as the first search of main_pharse
+        for comm in candidate_communities:
+            prefetcher.submit(comm, center_community.ent_nids - comm.ent_nids)
     #Second community pruning pharse (LLMs Pruning)
     if len(candidate_communities) > args.reasoning_chain_width:
         c_status,pruned_communities = Status.UNK,None 
@@ -480,6 +500,9 @@ def initial_pharse(question, kg_cli, llm_cli, g2t_cli, start_community, args, lo
                 summary_method=args.community_graph_prune_algo,
                 temperature=args.llm_prune_temperature,
                 log_path=log_path)
+        if prefetcher is not None:
+            kept = pruned_communities if c_status == Status.OK else []
+            prefetcher.discard([comm for comm in candidate_communities if comm not in kept])
         if c_status == Status.OK:
             if len(pruned_communities) == args.reasoning_chain_width:
                 candidate_communities = pruned_communities
@@ -499,11 +522,15 @@ def initial_pharse(question, kg_cli, llm_cli, g2t_cli, start_community, args, lo
 #         1. search communities
 #         2. append to chain
 #     reasoning
-def main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_chain, args, log_path) -> (int,str):
+# workspace: accumulated subgraph of the question, each search then only fetches and clusters the nodes new to the chain
+# prefetcher: the search of the next depth starts in background while the candidates are pruned by LLM
+def main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_chain, args, log_path, workspace=None, prefetcher=None) -> (int,str):
     count = 0
     is_updated = False
     status = Status.UNK
     communities_been_searched = set([center_community.cid]) #cid set for avoiding repeated communities being joined to reasoning chain
+    #nids already materialized by each chain, excluded from its next multi-source search
+    chain_materialized = [set(center_community.ent_nids).union(*[comm.ent_nids for comm in chain]) for chain in reasoning_chain]
     reasoning_range = None
     if log_path is not None:
         reasoning_range = tqdm(range(args.reasoning_chain_depth-1), desc='reasoning phase...')
@@ -521,16 +548,27 @@ def main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_
                 if len(reasoning_chain[jndex]) == 0: #not any community selected in the first round
                     continue
                 current_community = reasoning_chain[jndex][-1] #last as current
-                _,communities = community_search(kg_cli, current_community, args.community_detect_algorithm,
-                    args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, args.community_max_size)
+                exclude_nids = chain_materialized[jndex] - current_community.ent_nids
+                if prefetcher is not None: #started when current_community was a candidate
+                    _,communities = prefetcher.get(current_community, exclude_nids)
+                else:
+                    _,communities = community_search(kg_cli, current_community, args.community_detect_algorithm,
+                        args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, args.community_max_size,
+                        multi_source=args.search_multi_source or workspace is not None, topk=args.search_topk,
+                        exclude_nids=exclude_nids, workspace=workspace)
+                if (args.search_multi_source or workspace is not None) and communities is not None:
+                    chain_materialized[jndex].update(*[comm.ent_nids for comm in communities])
                 new_communities = [] #communities not in communities_been_searched
-                for comm in communities:
+                for comm in communities or []: #None when nothing new is found
                     if comm.cid not in communities_been_searched:
                         new_communities.append(comm)
                 if len(new_communities) > 0: #only one (best)
                     neighbor_communities = community_tool.get_neighbor_communities(current_community, new_communities, args.community_connected_threshold)
                     if len(neighbor_communities) > 0:
                         candidate_communities = graph_prune(current_community, neighbor_communities, args.community_max_candidate)
+                        if prefetcher is not None:
+                            for comm in candidate_communities:
+                                prefetcher.submit(comm, chain_materialized[jndex] - comm.ent_nids)
                         if len(candidate_communities) == 1: #only one no-neighbor candidate left
                             reasoning_chain[jndex].append(candidate_communities[-1])
                             communities_been_searched.add(candidate_communities[-1].cid)
@@ -561,6 +599,9 @@ def main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_
                                     temperature=args.llm_prune_temperature,
                                     log_path=log_path
                                 )
+                            if prefetcher is not None: #keep the prefetch of the winner only
+                                kept = pruned_communities[-1:] if c_status == Status.OK else []
+                                prefetcher.discard([comm for comm in candidate_communities if comm not in kept])
                             if c_status == Status.OK: #Single Selection
                                 reasoning_chain[jndex].append(pruned_communities[-1])
                                 communities_been_searched.add(pruned_communities[-1].cid)
@@ -619,6 +660,7 @@ def fastToG(
     g2t_cli,
     args
 ) -> (bool, str):
+    community_tool.reset_vocabs() #the interned labels and relations are scoped to one question
     reasoning_chains = [list() for i in range(args.reasoning_chain_width)] #WIDTH * DEPTH of Community
     reasoning_text_chains = [list() for i in range(args.reasoning_chain_width)] #WIDTH * DEPTH of Community (Text)
     max_depth = [len(rc) for rc in reasoning_chains]
@@ -627,8 +669,15 @@ def fastToG(
     reasoning_chain_log_path = case_path + '/' + args.reasoning_chains_log if args.reasoning_chains_log is not None else None
     reasoning_chain_vis_path = case_path + '/' + args.kg_graph_file_name if args.kg_graph_file_name is not None else None
     
+    workspace = community_tool.SubgraphWorkspace() if args.search_workspace else None
+    prefetcher = None
+    if args.search_prefetch > 0 and workspace is None: #a workspace is updated by each search, so it can not be speculated
+        prefetcher = SearchPrefetcher(lambda comm,exclude_nids: community_search(kg_cli, comm, args.community_detect_algorithm,
+                                          args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, args.community_max_size,
+                                          multi_source=args.search_multi_source, topk=args.search_topk, exclude_nids=exclude_nids),
+                                      max_workers=args.search_prefetch)
     status,center_community,candidate_communities = initial_pharse(question, kg_cli, llm_cli, g2t_cli, \
-                                                                 center_entity, args, llm_log_file_path)
+                                                                 center_entity, args, llm_log_file_path, workspace, prefetcher)
     answer = None
     if status == Status.OK: #something wrong with community searching else #ISOLATED ENTITY etc
         for i in range(len(candidate_communities)):
@@ -661,16 +710,20 @@ def fastToG(
                 display_chains(center_community, reasoning_chains, reasoning_chain_vis_path)
             if reasoning_chain_log_path:
                 save_chains(center_community, reasoning_chains, args.community_graph_prune_algo, reasoning_chain_log_path)
+            if prefetcher is not None:
+                prefetcher.close()
             return Status.OK,answer,max_depth
         else: #reasoning error
             #else is 0, which means can not figure out in this round, so continue
-            status,answer = main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_chains, args, llm_log_file_path)
+            status,answer = main_pharse(question, kg_cli, llm_cli, g2t_cli, center_community, reasoning_chains, args, llm_log_file_path, workspace, prefetcher)
             #display
             if reasoning_chain_vis_path:
                 display_chains(center_community, reasoning_chains, reasoning_chain_vis_path)
             if reasoning_chain_log_path:
                 save_chains(center_community, reasoning_chains, args.community_graph_prune_algo, reasoning_chain_log_path) 
 
+    if prefetcher is not None:
+        prefetcher.close()
     max_depth = [len(rc) for rc in reasoning_chains]
     return status,answer,max_depth
 
@@ -695,9 +748,17 @@ parser.add_argument("--search_max_hop", type=int,
 parser.add_argument("--search_max_neighbor", type=int,
                     default=20, help="max searching width for one KG query")
 parser.add_argument("--search_decline_rate", type=float,
-                    default=0.33, help="declining rate for searching hop by hop")
+                    default=0.5, help="declining rate for searching hop by hop")
 parser.add_argument("--search_topk", type=int,
                     default=100, help="topk nodes if the retrieving number is too large by above conditions")
+parser.add_argument("--search_settings", type=str,
+                    default=None, help="json report of kg_profile.py, its recommended search settings replace the ones above")
+parser.add_argument("--search_multi_source", action="store_true",
+                    help="expand from all nodes of the current community and skip the nodes fetched by earlier steps of the chain")
+parser.add_argument("--search_workspace", action="store_true",
+                    help="keep the subgraph of a question across depths, later searches only fetch and cluster new nodes (implies search_multi_source)")
+parser.add_argument("--search_prefetch", type=int,
+                    default=0, help="threads searching the candidate communities while LLM prunes them, 0 for no prefetch (not used with search_workspace)")
 #community specification
 parser.add_argument("--community_detect_algorithm", type=callable,
                     default=louvain_method, choices=[louvain_method, girvan_newman, spectral_clustering], 
@@ -732,11 +793,65 @@ parser.add_argument("--reasoning_chains_log", type=str,
                     default="reasoning_chains_log.csv", help="log the reasoning chains as text")
 #KG specification
 parser.add_argument("--kg_api", type=str, required=True,
-                    default="", help="api for knowledge graph engine")
-parser.add_argument("--kg_user", type=str, required=True,
+                    default="", help="api for knowledge graph engine (triple dump file for csr, store directory for mmap)")
+parser.add_argument("--kg_user", type=str,
                     default="", help="user for knowledge graph engine")
-parser.add_argument("--kg_pw", type=str, required=True,
+parser.add_argument("--kg_pw", type=str,
                     default="", help="password for knowledge graph engine")
+parser.add_argument("--kg_backend", type=str,
+                    default="neo4j", choices=["neo4j", "async", "csr", "mmap"], 
+                    help="client of knowledge graph engine, async overlaps the KG queries, csr loads a triple dump in memory, \
+                          mmap opens a graph store built by graph_store.py")
+parser.add_argument("--kg_seed", type=int,
+                    default=None, help="random seed for neighbor sampling, makes the sampling of neo4j backend reproducible")
+parser.add_argument("--kg_max_concurrency", type=int,
+                    default=8, help="max number of concurrent KG queries for the async backend")
+parser.add_argument("--kg_degree_cap", type=int,
+                    default=None, help="sample neighbors among at most this many neighbors of each node, bounds the expansion of hub nodes")
+parser.add_argument("--kg_degree_table", type=str,
+                    default=None, help="npz file of node degrees for hub-aware expansion, built there if missing")
+parser.add_argument("--kg_hub_degree", type=int,
+                    default=1000, help="nodes with degree >= kg_hub_degree are hubs")
+parser.add_argument("--kg_hub_mode", type=str, choices=HUB_MODES,
+                    default="terminal", help="hubs are not expanded (terminal), dropped (skip) or expanded with kg_hub_max_neighbor neighbors (downsample)")
+parser.add_argument("--kg_hub_max_neighbor", type=int,
+                    default=1, help="max neighbors of a hub in downsample mode")
+parser.add_argument("--kg_adaptive_neighbor", action="store_true",
+                    help="max neighbor of each node follows its degree in the degree table (needs kg_degree_table)")
+parser.add_argument("--kg_node_budget", type=int,
+                    default=None, help="max nodes of one neighborhood search, needs kg_degree_table")
+parser.add_argument("--kg_relation_allow", type=str,
+                    default=None, help="file of relation values (one per line), only these relations are fetched")
+parser.add_argument("--kg_relation_deny", type=str,
+                    default=None, help="file of relation values (one per line) never fetched e.g. metadata relations")
+parser.add_argument("--kg_relation_max_fraction", type=float,
+                    default=None, help="also deny the relations holding more than this fraction of all relations")
+parser.add_argument("--kg_relation_freq", type=str,
+                    default=None, help="tsv of relation frequencies for --kg_relation_max_fraction, counted and saved if missing")
+parser.add_argument("--kg_rank_neighbors", action="store_true",
+                    help="sample the neighbors whose relation or label matches the question first instead of at random")
+parser.add_argument("--stopword_path", type=str,
+                    default="freq_word.txt", help="stopwords ignored by --kg_rank_neighbors")
+parser.add_argument("--neighborhood_store", type=str,
+                    default=None, help="directory of the topic entity neighborhoods built by neighborhood_store.py")
+parser.add_argument("--kg_create_index", action="store_true",
+                    help="create the nid and label indexes of neo4j backend if missing")
+parser.add_argument("--kg_instrument", type=str,
+                    default=None, help="json file of per-kind latency, rows and db hits of the neo4j queries")
+parser.add_argument("--kg_profile_queries", action="store_true",
+                    help="run the instrumented queries with PROFILE to record db hits (slower)")
+parser.add_argument("--entity_index", type=str,
+                    default=None, help="file of the local entity linking index for --entity, built there if missing")
+parser.add_argument("--kg_cache_entries", type=int,
+                    default=0, help="max entries of the KG response cache of neo4j backend, 0 for no cache")
+parser.add_argument("--kg_cache_mb", type=float,
+                    default=None, help="max megabytes of the KG response cache of neo4j backend")
+parser.add_argument("--kg_cache_ttl", type=float,
+                    default=None, help="seconds before a cached KG response of neo4j backend expires")
+parser.add_argument("--kg_cache_path", type=str,
+                    default=None, help="sqlite file of the persistent KG response cache of neo4j backend")
+parser.add_argument("--kg_cache_sampled", action="store_true",
+                    help="also persist the random neighbor samples (keyed by --kg_seed, which is then required)")
 parser.add_argument("--kg_graph_file_name", type=str,
                     default="visual", help="path for visualization of local graph, nonable")
 #G2T specification
@@ -747,8 +862,65 @@ parser.add_argument("--graph2text_max_length", type=int,
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.kg_backend == 'async' and (args.kg_degree_table or args.kg_rank_neighbors):
+        parser.error('--kg_degree_table and --kg_rank_neighbors are not supported by the async backend')
+    if args.kg_backend == 'async' and args.kg_degree_cap is not None:
+        parser.error('--kg_degree_cap is not supported by the async backend')
+    if args.kg_backend == 'async' and args.kg_seed is not None:
+        parser.error('--kg_seed is not supported by the async backend, its sampling is not reproducible')
+    if args.kg_backend != 'neo4j' and (args.kg_cache_entries > 0 or args.kg_cache_path or args.kg_cache_sampled or \
+                                       args.kg_cache_ttl is not None or args.kg_cache_mb is not None):
+        parser.error('--kg_cache_* options are only supported by the neo4j backend')
+    if args.kg_backend != 'neo4j' and (args.kg_instrument or args.kg_profile_queries):
+        parser.error('--kg_instrument and --kg_profile_queries are only supported by the neo4j backend')
+    if args.kg_cache_sampled and args.kg_seed is None: #the cache would freeze one random draw of every unseeded sample
+        parser.error('--kg_cache_sampled requires --kg_seed')
+    if args.search_settings: #report of kg_profile.py, its recommended settings override the search arguments
+        with open(args.search_settings) as f:
+            settings = json.load(f)
+        settings = settings.get('recommended', settings)
+        for key in ('search_max_hop', 'search_max_neighbor', 'search_decline_rate', 'search_topk'):
+            if key in settings:
+                setattr(args, key, settings[key])
     
-    kg_cli = neo4j_client(args.kg_api, args.kg_user, args.kg_pw)
+    if args.kg_backend == 'async':
+        kg_cli = BlockingNeo4jClient(args.kg_api, args.kg_user, args.kg_pw, max_concurrency=args.kg_max_concurrency)
+    elif args.kg_backend == 'csr':
+        kg_cli = CSRGraphClient.from_triples_file(args.kg_api, seed=args.kg_seed, degree_cap=args.kg_degree_cap)
+    elif args.kg_backend == 'mmap':
+        kg_cli = MmapGraphClient(args.kg_api, seed=args.kg_seed, degree_cap=args.kg_degree_cap)
+    else:
+        kg_caches = []
+        if args.kg_cache_entries > 0:
+            kg_caches.append(LRUCache(max_entries=args.kg_cache_entries, ttl=args.kg_cache_ttl,
+                                max_bytes=int(args.kg_cache_mb * 2**20) if args.kg_cache_mb is not None else None))
+        if args.kg_cache_path:
+            kg_caches.append(SQLiteCache(args.kg_cache_path, cache_sampled=args.kg_cache_sampled))
+        kg_cache = None
+        if len(kg_caches) == 1:
+            kg_cache = kg_caches[0]
+        elif len(kg_caches) > 1:
+            kg_cache = TieredCache(*kg_caches)
+        kg_instrument = KGInstrument(profile=args.kg_profile_queries) if args.kg_instrument else None
+        kg_cli = neo4j_client(args.kg_api, args.kg_user, args.kg_pw, cache=kg_cache, seed=args.kg_seed,
+                              degree_cap=args.kg_degree_cap, instrument=kg_instrument)
+    if args.kg_relation_allow or args.kg_relation_deny or args.kg_relation_max_fraction is not None:
+        frequencies = load_relation_frequencies(args.kg_relation_freq, kg_cli) if args.kg_relation_max_fraction is not None else {}
+        relation_filter = RelationFilter.from_frequencies(frequencies, max_fraction=args.kg_relation_max_fraction,
+                                                          allow=load_relation_list(args.kg_relation_allow) if args.kg_relation_allow else None,
+                                                          deny=load_relation_list(args.kg_relation_deny) if args.kg_relation_deny else None)
+        if args.kg_backend == 'async':
+            kg_cli.client.relation_filter = relation_filter
+        else:
+            kg_cli.relation_filter = relation_filter
+    if args.kg_degree_table:
+        kg_cli.expansion_policy = ExpansionPolicy(load_degree_table(args.kg_degree_table, kg_cli), hub_degree=args.kg_hub_degree,
+                                                  hub_mode=args.kg_hub_mode, hub_max_neighbor=args.kg_hub_max_neighbor,
+                                                  node_budget=args.kg_node_budget, adaptive=args.kg_adaptive_neighbor)
+    if args.kg_rank_neighbors:
+        kg_cli.neighbor_ranker = NeighborRanker(args.query, load_stopwords(args.stopword_path))
+    if args.neighborhood_store: #first-phase searches of the topic entities pre-materialized by neighborhood_store.py
+        kg_cli = NeighborhoodStoreClient(kg_cli, NeighborhoodStore.load(args.neighborhood_store))
     llm_cli = llm_client(url=args.llm_api, 
                      api_key=args.llm_api_key, 
                      models=args.llm_model,
@@ -756,12 +928,23 @@ if __name__ == "__main__":
                      debug=False
                     )
     
-    status,res = kg_cli.get_node_by_label(args.entity)
+    if args.kg_create_index and args.kg_backend == 'neo4j':
+        kg_cli.create_indexes()
+    if args.entity_index: #local linking with case-folded and fuzzy matching instead of the exact label query
+        if os.path.exists(args.entity_index):
+            linker = EntityLinker.load(args.entity_index)
+        else:
+            linker = EntityLinker.from_graph_client(kg_cli) if args.kg_backend in ('csr', 'mmap') else EntityLinker.from_neo4j(kg_cli)
+            linker.save(args.entity_index)
+        status,res = linker.link(args.entity)
+    else:
+        status,res = kg_cli.get_node_by_label(args.entity)
     if status <= 0:
         print(f'entity:{args.entity} is not found.')
         kg_cli.close()
         exit()
     entity_id = res[0]
+    args.entity = res[1] #label in KG, differs from the given name when linked by folding or fuzzy matching
 
     case_path = None
     if len(args.base_path) > 0:
@@ -775,6 +958,8 @@ if __name__ == "__main__":
     g2t_cli = None
     if args.graph2text_path:
         g2t_cli = graph2text_client(args.graph2text_path, max_length=args.graph2text_max_length)
+    if getattr(kg_cli, 'instrument', None) is not None:
+        kg_cli.instrument.begin_question(args.query)
     status,pred,depth = fastToG(
         question=args.query, 
         entity_id=entity_id, 
@@ -785,6 +970,12 @@ if __name__ == "__main__":
         g2t_cli=g2t_cli,
         args=args
     )
+    if getattr(kg_cli, 'cache', None) is not None:
+        print(kg_cli.cache.stats())
+    if getattr(kg_cli, 'instrument', None) is not None:
+        kg_cli.instrument.end_question()
+        print(kg_cli.instrument.summary())
+        kg_cli.instrument.dump(args.kg_instrument)
     kg_cli.close()
     print(status)
     print(pred)
@@ -0,0 +1,219 @@
+import os
+import csv
+import json
+import argparse
+import numpy as np
+from array import array
+from csr_client import CSRGraphClient,build_csr
+
+'''
+on-disk graph store opened by numpy.memmap, worker processes share one copy of the graph by the page cache
+store_dir/
+    meta.json                        number of nodes and edges
+    relations.json                   relation vocabulary, index is the relation id
+    node_nids.npy                    sorted nid of each node index
+    indptr.npy, indices.npy          undirected distinct neighbors (CSR)
+    out_indptr.npy, out_indices.npy  directed relations (CSR)
+    out_rel_ids.npy                  relation id of each directed relation
+    label_offsets.npy, labels.bin    interned utf-8 labels, label of node i is labels.bin[offsets[i]:offsets[i+1]]
+    label_hash.npy                   label hash of every node, sorted
+    label_hash_nodes.npy             node index of each sorted hash (ascending for equal hashes)
+'''
+STORE_VERSION = 2
+
+#labels are copied and hashed by chunks of about this many bytes, so no whole-blob temporary is built
+LABEL_CHUNK_BYTES = 1 << 24
+
+#nids below it keep their label state of build_graph_store in a bytearray (at most 1GB), the others in a dict
+LABEL_STATE_NIDS = 1 << 30
+
+FNV_OFFSET,FNV_PRIME,HASH_MASK = 0xcbf29ce484222325,0x100000001b3,(1 << 64) - 1
+
+#64-bit FNV-1a, build_label_hash computes the same hash vectorized
+def label_hash(label_bytes:bytes) -> int:
+    value = FNV_OFFSET
+    for byte in label_bytes:
+        value = ((value ^ byte) * FNV_PRIME) & HASH_MASK
+    return value
+
+#node ranges [start, end) of about LABEL_CHUNK_BYTES label bytes each
+def label_chunks(label_offsets:np.ndarray):
+    num_node = len(label_offsets) - 1
+    bounds = np.searchsorted(label_offsets[1:], np.arange(LABEL_CHUNK_BYTES, int(label_offsets[-1]), LABEL_CHUNK_BYTES))
+    bounds = np.unique(np.concatenate([[0], bounds + 1, [num_node]])).tolist()
+    return [(start, end) for start,end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+#label_hash of each label of the chunk, byte k of every label longer than k is mixed in one step
+def _chunk_label_hashes(label_blob, starts, sizes) -> np.ndarray:
+    order = np.argsort(-sizes, kind='stable') #longest first, labels still being mixed are a prefix
+    starts,sizes = starts[order],sizes[order]
+    values = np.full(len(sizes), FNV_OFFSET, dtype=np.uint64)
+    alive = len(sizes)
+    for position in range(int(sizes[0]) if len(sizes) > 0 else 0):
+        while alive > 0 and sizes[alive - 1] <= position:
+            alive -= 1
+        values[:alive] ^= label_blob[starts[:alive] + position].astype(np.uint64)
+        values[:alive] *= np.uint64(FNV_PRIME)
+    hashes = np.empty_like(values)
+    hashes[order] = values
+    return hashes
+
+#sorted label hashes and their node indices, the first node of a duplicated label comes first among equal hashes
+def build_label_hash(label_blob:np.ndarray, label_offsets:np.ndarray) -> (np.ndarray, np.ndarray):
+    hashes = np.empty(len(label_offsets) - 1, dtype=np.uint64)
+    for start,end in label_chunks(label_offsets):
+        hashes[start:end] = _chunk_label_hashes(label_blob, label_offsets[start:end], label_offsets[start+1:end+1] - label_offsets[start:end])
+    nodes = np.argsort(hashes, kind='stable')
+    return hashes[nodes],nodes.astype(np.int64)
+
+#convert a triple dump (nid, label, relation, nid[, label]) to the store
+#labels are spooled to a temporary blob instead of python strings
+def build_graph_store(triples_path, store_dir, delimiter='\t'):
+    os.makedirs(store_dir, exist_ok=True)
+    spool_path = os.path.join(store_dir, 'labels.spool')
+    label_nids,label_starts,label_sizes,label_priority = array('q'),array('q'),array('q'),array('b')
+    src_nids,dst_nids,rel_ids,rel2id = array('q'),array('q'),array('l'),{}
+    spool_size,last_nid = 0,None
+    #label state of each nid (0 unseen, 1 placeholder, 2 labeled) so that at most 2 labels per node are spooled
+    #instead of the destination label of every edge
+    states,other_states = bytearray(),{}
+    with open(triples_path, newline='', encoding='utf-8') as f, open(spool_path, 'wb') as spool:
+        #priority 0 for given labels, 1 for the nid placeholder of a destination without label
+        def spool_label(nid, label, priority=0):
+            nonlocal spool_size,states
+            state = 2 - priority
+            if 0 <= nid < LABEL_STATE_NIDS:
+                if nid >= len(states):
+                    states.extend(bytes(min(max(nid + 1, 2 * len(states)), LABEL_STATE_NIDS) - len(states)))
+                if states[nid] >= state:
+                    return
+                states[nid] = state
+            else:
+                if other_states.get(nid, 0) >= state:
+                    return
+                other_states[nid] = state
+            label_bytes = label.encode('utf-8')
+            spool.write(label_bytes)
+            label_nids.append(nid)
+            label_starts.append(spool_size)
+            label_sizes.append(len(label_bytes))
+            label_priority.append(priority)
+            spool_size += len(label_bytes)
+        for row in csv.reader(f, delimiter=delimiter):
+            if len(row) < 2 or not row[0].lstrip('-').isdigit(): #empty or header
+                continue
+            nid = int(row[0])
+            if nid != last_nid: #dumps are grouped by head, skip the repeated labels
+                spool_label(nid, row[1])
+                last_nid = nid
+            if len(row) >= 4 and len(row[2]) > 0:
+                dst_nid = int(row[3])
+                if len(row) >= 5:
+                    spool_label(dst_nid, row[4])
+                else:
+                    spool_label(dst_nid, str(dst_nid), priority=1)
+                if row[2] not in rel2id:
+                    rel2id[row[2]] = len(rel2id)
+                src_nids.append(nid)
+                dst_nids.append(dst_nid)
+                rel_ids.append(rel2id[row[2]])
+    del states,other_states
+    #first given label of each nid, the nid placeholder only for nodes never labeled
+    label_nids = np.frombuffer(label_nids, dtype=np.int64)
+    order = np.lexsort((np.frombuffer(label_priority, dtype=np.int8), label_nids))
+    node_nids,first = np.unique(label_nids[order], return_index=True)
+    starts = np.frombuffer(label_starts, dtype=np.int64)[order[first]]
+    sizes = np.frombuffer(label_sizes, dtype=np.int64)[order[first]]
+    label_offsets = np.zeros(len(node_nids) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=label_offsets[1:])
+    label_path = os.path.join(store_dir, 'labels.bin')
+    with open(label_path, 'wb') as f:
+        if spool_size > 0:
+            spool_blob = np.memmap(spool_path, dtype=np.uint8, mode='r')
+            for start,end in label_chunks(label_offsets):
+                chunk_offsets = label_offsets[start:end] - label_offsets[start]
+                gather = np.repeat(starts[start:end] - chunk_offsets, sizes[start:end]) + np.arange(label_offsets[end] - label_offsets[start])
+                spool_blob[gather].tofile(f)
+            del spool_blob
+    os.remove(spool_path)
+    indptr,indices,out_indptr,out_indices,out_rel_ids = build_csr(node_nids, np.frombuffer(src_nids, dtype=np.int64), \
+        np.asarray(rel_ids, dtype=np.int32), np.frombuffer(dst_nids, dtype=np.int64))
+    arrays = {'node_nids':node_nids, 'indptr':indptr, 'indices':indices, 'out_indptr':out_indptr, \
+              'out_indices':out_indices, 'out_rel_ids':out_rel_ids, 'label_offsets':label_offsets}
+    for name,value in arrays.items():
+        np.save(os.path.join(store_dir, name + '.npy'), value)
+    label_blob = np.memmap(label_path, dtype=np.uint8, mode='r') if label_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+    hashes,hash_nodes = build_label_hash(label_blob, label_offsets)
+    del label_blob
+    np.save(os.path.join(store_dir, 'label_hash.npy'), hashes)
+    np.save(os.path.join(store_dir, 'label_hash_nodes.npy'), hash_nodes)
+    rel_vocab = [None] * len(rel2id)
+    for rel,rel_id in rel2id.items():
+        rel_vocab[rel_id] = rel
+    with open(os.path.join(store_dir, 'relations.json'), 'w', encoding='utf-8') as f:
+        json.dump(rel_vocab, f, ensure_ascii=False)
+    meta = {'version':STORE_VERSION, 'num_node':len(node_nids), 'num_edge':len(out_indices)}
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+'''
+client of the on-disk graph store, same interface as neo4j_client
+all arrays are numpy.memmap so opening is instant and neighborhoods are sliced without loading the graph
+'''
+class MmapGraphClient(CSRGraphClient):
+    def __init__(self, store_dir, seed=None, degree_cap=None):
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        assert self.meta['version'] == STORE_VERSION
+        with open(os.path.join(store_dir, 'relations.json'), encoding='utf-8') as f:
+            rel_vocab = json.load(f)
+        load = lambda name: np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r')
+        super().__init__(load('node_nids'), None, load('indptr'), load('indices'), \
+                         load('out_indptr'), load('out_indices'), load('out_rel_ids'), rel_vocab, \
+                         seed=seed, degree_cap=degree_cap)
+        self.label_offsets = load('label_offsets')
+        self.label_hash = load('label_hash')
+        self.label_hash_nodes = load('label_hash_nodes')
+        if self.label_offsets[-1] > 0:
+            self.label_blob = np.memmap(os.path.join(store_dir, 'labels.bin'), dtype=np.uint8, mode='r')
+        else:
+            self.label_blob = np.zeros(0, dtype=np.uint8)
+
+    def _label_bytes(self, index):
+        return self.label_blob[self.label_offsets[index]:self.label_offsets[index+1]].tobytes()
+
+    def _label(self, index):
+        return self._label_bytes(index).decode('utf-8')
+
+    def _index_of_label(self, label):
+        label_bytes = label.encode('utf-8')
+        value = np.uint64(label_hash(label_bytes))
+        for position in range(int(np.searchsorted(self.label_hash, value, 'left')), int(np.searchsorted(self.label_hash, value, 'right'))):
+            index = int(self.label_hash_nodes[position])
+            if self._label_bytes(index) == label_bytes:
+                return index
+        return None
+
+parser = argparse.ArgumentParser('convert a triple dump to the memory-mapped graph store')
+parser.add_argument("--triples", type=str, required=True,
+                    help="triple dump with rows: nid, label, relation, nid[, label]")
+parser.add_argument("--store_dir", type=str, required=True,
+                    help="output directory of the graph store")
+parser.add_argument("--delimiter", type=str,
+                    default="\t", help="delimiter of the triple dump")
+parser.add_argument("--kg_api", type=str,
+                    default="", help="export the triple dump from this neo4j first")
+parser.add_argument("--kg_user", type=str,
+                    default="", help="user for knowledge graph engine")
+parser.add_argument("--kg_pw", type=str,
+                    default="", help="password for knowledge graph engine")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.kg_api:
+        from kg_client import neo4j_client
+        kg_cli = neo4j_client(args.kg_api, args.kg_user, args.kg_pw)
+        kg_cli.dump_triples(args.triples, delimiter=args.delimiter)
+        kg_cli.close()
+    print(build_graph_store(args.triples, args.store_dir, delimiter=args.delimiter))
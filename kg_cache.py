@@ -0,0 +1,181 @@
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+#rough number of bytes held by a cached value (containers are walked, shared objects counted again)
+def estimate_size(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k,v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(v) for v in value)
+    return size
+
+'''
+bounded in-memory cache of KG responses
+entries are keyed by (kind, key), kind is the query kind e.g. node, neighbors, out_edges
+max_entries/max_bytes: least recently used entries are evicted beyond the limits (None for unlimited)
+ttl: seconds before an entry expires (None for never)
+'''
+class LRUCache():
+    def __init__(self, max_entries=100000, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.num_bytes = 0
+        self.hits,self.misses,self.evictions = 0,0,0
+        self._data = OrderedDict() #(kind, key) -> (value, size, expire time)
+        self._lock = threading.Lock()
+
+    #return (hit, value)
+    def get(self, kind, key):
+        with self._lock:
+            entry = self._data.get((kind, key))
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove((kind, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False,None
+            self._data.move_to_end((kind, key))
+            self.hits += 1
+            return True,entry[0]
+
+    def put(self, kind, key, value):
+        size = estimate_size(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expire = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if (kind, key) in self._data:
+                self._remove((kind, key))
+            self._data[(kind, key)] = (value, size, expire)
+            self.num_bytes += size
+            while (self.max_entries is not None and len(self._data) > self.max_entries) or \
+                  (self.max_bytes is not None and self.num_bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, full_key):
+        _,size,_ = self._data.pop(full_key)
+        self.num_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.num_bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'entries':len(self._data), 'bytes':self.num_bytes, 'hits':self.hits, 'misses':self.misses, \
+                'evictions':self.evictions, 'hit_rate':self.hits / total if total > 0 else 0.0}
+
+    def close(self):
+        pass
+
+#kinds of query whose result is a random sample (ORDER BY rand())
+SAMPLED_KINDS = ('neighbors', 'subgraph')
+
+'''
+persistent KG response cache in a local SQLite file, shared across runs and usable offline
+entries are keyed by (kind, normalized key), values are stored as json (tuples come back as lists)
+cache_sampled: also keep the results of random sampling queries, the client should then sample with a fixed
+               seed (neo4j_client(seed=...)) which is part of their keys, otherwise the cache would freeze one random draw
+'''
+class SQLiteCache():
+    def __init__(self, path, cache_sampled=False, commit_every=100):
+        self.path = path
+        self.cache_sampled = cache_sampled
+        self.commit_every = commit_every
+        self.hits,self.misses = 0,0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kg_cache ( \
+                                kind TEXT NOT NULL, \
+                                key TEXT NOT NULL, \
+                                value TEXT NOT NULL, \
+                                created REAL NOT NULL, \
+                                PRIMARY KEY (kind, key))')
+        self._conn.commit()
+
+    @staticmethod
+    def normalize_key(key) -> str:
+        return json.dumps(key, sort_keys=True, separators=(',', ':'))
+
+    def _accepts(self, kind) -> bool:
+        return self.cache_sampled or kind not in SAMPLED_KINDS
+
+    #return (hit, value)
+    def get(self, kind, key):
+        if not self._accepts(kind):
+            return False,None
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM kg_cache WHERE kind = ? AND key = ?', \
+                                     (kind, self.normalize_key(key))).fetchone()
+            if row is None:
+                self.misses += 1
+                return False,None
+            self.hits += 1
+        return True,json.loads(row[0])
+
+    def put(self, kind, key, value):
+        if not self._accepts(kind):
+            return
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO kg_cache (kind, key, value, created) VALUES (?, ?, ?, ?)', \
+                               (kind, self.normalize_key(key), json.dumps(value), time.time()))
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def clear(self, kind=None):
+        with self._lock:
+            if kind is None:
+                self._conn.execute('DELETE FROM kg_cache')
+            else:
+                self._conn.execute('DELETE FROM kg_cache WHERE kind = ?', (kind,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM kg_cache').fetchone()[0]
+        return {'entries':entries, 'hits':self.hits, 'misses':self.misses, 'hit_rate':self.hits / total if total > 0 else 0.0}
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+'''
+chain of caches e.g. TieredCache(LRUCache(), SQLiteCache(path)), a hit in a later tier fills the earlier tiers
+'''
+class TieredCache():
+    def __init__(self, *caches):
+        self.caches = caches
+
+    def get(self, kind, key):
+        for index,cache in enumerate(self.caches):
+            hit,value = cache.get(kind, key)
+            if hit:
+                for upper in self.caches[:index]:
+                    upper.put(kind, key, value)
+                return True,value
+        return False,None
+
+    def put(self, kind, key, value):
+        for cache in self.caches:
+            cache.put(kind, key, value)
+
+    def stats(self) -> dict:
+        return {type(cache).__name__:cache.stats() for cache in self.caches}
+
+    def close(self):
+        for cache in self.caches:
+            cache.close()
@@ -1,38 +1,419 @@
+import csv
+import time
 import neo4j
+import asyncio
+import threading
 import numpy as np
 from collections import deque
+from kg_relevance import TOKEN_SEPARATORS
 
+'''
+Cypher of neo4j_client
+all values are passed as $param so that the plan of each statement is compiled once and cached by neo4j
+only the properties in use (nid, label) are projected instead of the whole node map
+RELATION_FILTER is part of every query reading relations, its $allow_relations/$deny_relations come from
+relation_filter_params so that filtered relations are dropped by the server
+NEIGHBOR_EXCLUDE of the batch neighbor queries drops the nodes of $exclude (empty list for none) before sampling,
+so already materialized nodes do not take the sampling slots
+'''
+RELATION_FILTER = '($allow_relations IS NULL OR r.value IN $allow_relations) AND NOT coalesce(r.value, \'\') IN $deny_relations'
+
+NEIGHBOR_EXCLUDE = 'NOT n2.nid IN $exclude'
+
+CQL_GET_NODE = 'MATCH (n:Entity) \n\
+                WHERE n.nid = $nid \n\
+                RETURN n.nid AS nid, n.label AS label, n.alias AS alias \n\
+                LIMIT 1'
+
+CQL_GET_NODE_BY_LABEL = 'MATCH (n:Entity) \n\
+                         WHERE n.label = $label \n\
+                         RETURN n.nid AS nid, n.label AS label, n.alias AS alias \n\
+                         LIMIT 1'
+
+CQL_GET_NODES_BY_LABELS = 'UNWIND $labels AS query \n\
+                           MATCH (n:Entity) \n\
+                           WHERE n.label = query \n\
+                           WITH query, collect(n)[0] AS n \n\
+                           RETURN query, n.nid AS nid, n.label AS label, n.alias AS alias'
+
+#lookups by nid and label are index seeks instead of label scans
+CQL_CREATE_INDEXES = ['CREATE INDEX entity_nid IF NOT EXISTS FOR (n:Entity) ON (n.nid)',
+                      'CREATE INDEX entity_label IF NOT EXISTS FOR (n:Entity) ON (n.label)']
+
+CQL_GET_NEIGHBOR_NODES = 'MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                          WHERE n1.nid = $nid AND ' + RELATION_FILTER + ' \n\
+                          WITH DISTINCT n2, rand() as random_order \n\
+                          RETURN n2.nid AS nid, n2.label AS label \n\
+                          ORDER BY random_order \n\
+                          LIMIT $max_neighbor'
+
+CQL_GET_NEIGHBOR_NODES_BATCH = 'UNWIND $frontier AS fid \n\
+                                MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                                WHERE n1.nid = fid AND ' + RELATION_FILTER + ' AND ' + NEIGHBOR_EXCLUDE + ' \n\
+                                WITH DISTINCT fid, n2, rand() as random_order \n\
+                                ORDER BY random_order \n\
+                                WITH fid, collect({nid: n2.nid, label: n2.label})[..$max_neighbor] AS neighbors \n\
+                                RETURN fid, neighbors'
+
+#degree-capped sampling: only the first $degree_cap distinct neighbors in storage order are shuffled
+#LIMIT right after the expansion lets neo4j stop reading the relationship chain of hub nodes early,
+#so the cost of one expansion is bounded by the cap instead of the degree (sample is uniform only below the cap)
+CQL_GET_NEIGHBOR_NODES_CAPPED = 'MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                                 WHERE n1.nid = $nid AND ' + RELATION_FILTER + ' \n\
+                                 WITH DISTINCT n1, n2 \n\
+                                 LIMIT $degree_cap \n\
+                                 WITH n2, rand() as random_order \n\
+                                 RETURN n2.nid AS nid, n2.label AS label \n\
+                                 ORDER BY random_order \n\
+                                 LIMIT $max_neighbor'
+
+CQL_GET_NEIGHBOR_NODES_BATCH_CAPPED = 'UNWIND $frontier AS fid \n\
+                                       CALL { \n\
+                                           WITH fid \n\
+                                           MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                                           WHERE n1.nid = fid AND ' + RELATION_FILTER + ' AND ' + NEIGHBOR_EXCLUDE + ' \n\
+                                           WITH DISTINCT n1, n2 \n\
+                                           LIMIT $degree_cap \n\
+                                           RETURN n1, n2 \n\
+                                       } \n\
+                                       WITH fid, n2, rand() as random_order \n\
+                                       ORDER BY random_order \n\
+                                       WITH fid, collect({nid: n2.nid, label: n2.label})[..$max_neighbor] AS neighbors \n\
+                                       RETURN fid, neighbors'
+
+CQL_GET_RELATIONS_OF_NODES = 'MATCH (n1:Entity)-[r]->(n2:Entity) \n\
+                              WHERE n1.nid IN $nid_list AND n2.nid IN $nid_list AND ' + RELATION_FILTER + ' \n\
+                              RETURN n1.nid, r.value, n2.nid'
+
+#out relations of the nodes with at most $max_out_edges of them, other nodes only return their degree
+CQL_GET_OUT_RELATIONS_OF_NODES = 'MATCH (n1:Entity) \n\
+                                  WHERE n1.nid IN $nid_list \n\
+                                  WITH n1, size([(n1)-->() | 1]) AS degree \n\
+                                  OPTIONAL MATCH (n1)-[r]->(n2:Entity) \n\
+                                  WHERE degree <= $max_out_edges AND ' + RELATION_FILTER + ' \n\
+                                  RETURN n1.nid, degree, r.value, n2.nid'
+
+CQL_GET_RELATIONS_FROM_NODES = 'MATCH (n1:Entity)-[r]->(n2:Entity) \n\
+                                WHERE n1.nid IN $src_list AND n2.nid IN $nid_list AND ' + RELATION_FILTER + ' \n\
+                                RETURN n1.nid, r.value, n2.nid'
+
+#out relations of nodes with more of them are not cached, their relations inside the subgraph are queried each time
+MAX_CACHED_OUT_EDGES = 1000
+
+CQL_DUMP_TRIPLES = 'MATCH (n1:Entity) \n\
+                    OPTIONAL MATCH (n1)-[r]->(n2:Entity) \n\
+                    RETURN n1.nid, n1.label, r.value, n2.nid, n2.label'
+
+CQL_COUNT_NODE = 'MATCH (n) RETURN COUNT(n) AS count'
+
+CQL_COUNT_EDGE = 'MATCH ()-[r]->() RETURN COUNT(r) AS count'
+
+CQL_AVERAGE_DEGREE = 'MATCH (n) \n\
+                      WITH n \n\
+                      ORDER BY RAND() \n\
+                      LIMIT $sample \n\
+                      MATCH (n)-[r]-() \n\
+                      WITH n, count(r) as degree \n\
+                      RETURN avg(degree)'
+
+#values of the parameters of RELATION_FILTER, relation_filter is a kg_profile.RelationFilter or None
+def relation_filter_params(relation_filter) -> dict:
+    if relation_filter is None:
+        return {'allow_relations':None, 'deny_relations':[]}
+    return relation_filter.params()
+
+#reproducible replacement of rand() for neighbor sampling: MINSTD hash of (n1.nid, n2.nid, $seed)
+SEEDED_RAND = '(((n1.nid % 2147483647) * 48271 + n2.nid % 2147483647 + $seed) % 2147483647 * 48271 % 2147483647)'
+
+#same query with the random order of sampling fixed by $seed
+def seeded_cql(cql:str) -> str:
+    return cql.replace('rand()', SEEDED_RAND)
+
+#Cypher expression of the tokens of a string expression, same as kg_relevance.relevance_tokens
+def cypher_tokens(expr:str) -> str:
+    expr = "toLower(coalesce(%s, ''))" % expr
+    for sep in TOKEN_SEPARATORS:
+        expr = "replace(%s, '%s', ' ')" % (expr, sep)
+    return 'split(%s, \' \')' % expr
+
+#neighbor query ranked by the question tokens ($question_tokens) of kg_relevance.NeighborRanker
+#score: tokens matched by the best relation value between n1 and n2 plus tokens matched by the label of n2
+#ties keep the random order of sampling, so seeded_cql applies as well
+#batch: neighbors of every node of $frontier like CQL_GET_NEIGHBOR_NODES_BATCH (with NEIGHBOR_EXCLUDE)
+def ranked_neighbor_cql(batch=False, degree_cap=False) -> str:
+    source = 'fid' if batch else '$nid'
+    keys = 'fid, ' if batch else ''
+    expand_filter = RELATION_FILTER + ' AND ' + NEIGHBOR_EXCLUDE if batch else RELATION_FILTER
+    CQL = 'UNWIND $frontier AS fid \n' if batch else ''
+    if degree_cap:
+        CQL += 'CALL { \n\
+                    %sMATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                    WHERE n1.nid = %s AND %s \n\
+                    WITH DISTINCT n1, n2 \n\
+                    LIMIT $degree_cap \n\
+                    RETURN n1, n2 \n\
+                } \n\
+                MATCH (n1)-[r:Relation]-(n2) \n\
+                WHERE %s \n' % ('WITH fid \n' if batch else '', source, expand_filter, RELATION_FILTER)
+    else:
+        CQL += 'MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
+                WHERE n1.nid = %s AND %s \n' % (source, expand_filter)
+    CQL += 'WITH %sn1, n2, max(size([t IN $question_tokens WHERE t IN %s])) AS rel_score \n\
+            WITH %sn2, rel_score + size([t IN $question_tokens WHERE t IN %s]) AS score, rand() as random_order \n\
+            ORDER BY score DESC, random_order \n' % (keys, cypher_tokens('r.value'), keys, cypher_tokens('n2.label'))
+    if batch:
+        CQL += 'WITH fid, collect({nid: n2.nid, label: n2.label})[..$max_neighbor] AS neighbors \n\
+                RETURN fid, neighbors'
+    else:
+        CQL += 'RETURN n2.nid AS nid, n2.label AS label \n\
+                LIMIT $max_neighbor'
+    return CQL
+
+#one query for n_hop sampled bfs plus the induced edges, text only depends on n_hop
+#params: $nid, $topk and $k1..$kn (max neighbor of each hop), $degree_cap if degree_cap, relation_filter_params
+#multi_source: bfs from all nodes of $sources (distance 0) instead of $nid, nodes of $exclude are never visited
+#batch: one subgraph per start node of $nids instead of $nid, each row also returns its start node as source
+def neighborhood_subgraph_cql(n_hop:int, degree_cap=False, multi_source=False, batch=False) -> str:
+    if batch:
+        assert not multi_source
+        return 'UNWIND $nids AS source \n\
+                CALL { \n\
+                    WITH source \n' + neighborhood_subgraph_cql(n_hop, degree_cap).replace('$nid', 'source') + ' \n\
+                } \n\
+                RETURN source, nid, label, distance, src, rel, dst'
+    if multi_source:
+        CQL = 'MATCH (s:Entity) \n\
+               WHERE s.nid IN $sources \n\
+               WITH collect(s) AS nodes \n\
+               WITH nodes, [n IN nodes | 0] AS distance, nodes AS frontier \n'
+    else:
+        CQL = 'MATCH (s:Entity) \n\
+               WHERE s.nid = $nid \n\
+               WITH [s] AS nodes, [0] AS distance, [s] AS frontier \n'
+    visited = 'n IN nodes OR n IN acc OR n.nid IN $exclude' if multi_source else 'n IN nodes OR n IN acc'
+    expand = 'MATCH (n1)-[r:Relation]-(n2:Entity) \n\
+              WHERE %s \n' % RELATION_FILTER
+    if multi_source: #excluded nodes do not take the sampling slots
+        expand += 'AND NOT n2.nid IN $exclude \n'
+    for hop_count in range(1, n_hop + 1):
+        CQL += 'CALL { \n\
+                    WITH frontier \n\
+                    UNWIND range(0, size(frontier) - 1) AS i \n\
+                    WITH i, frontier[i] AS n1 \n'
+        if degree_cap:
+            CQL += 'CALL { \n\
+                        WITH n1 \n' + expand + \
+                       'WITH DISTINCT n2 \n\
+                        LIMIT $degree_cap \n\
+                        RETURN n2 \n\
+                    } \n'
+        else:
+            CQL += expand + 'WITH DISTINCT i, n1, n2 \n'
+        CQL += 'WITH i, n2, rand() as random_order \n\
+                    ORDER BY random_order \n\
+                    WITH i, collect(n2)[..$k%s] AS neighbors \n\
+                    ORDER BY i \n\
+                    UNWIND neighbors AS n2 \n\
+                    RETURN collect(n2) AS sampled \n\
+                } \n\
+                WITH nodes, distance, reduce(acc = [], n IN sampled | \n\
+                    CASE WHEN %s THEN acc ELSE acc + n END) AS frontier \n\
+                WITH nodes + frontier AS nodes, distance + [n IN frontier | %s] AS distance, frontier \n' % (hop_count, visited, hop_count)
+    CQL += 'WITH nodes[..$topk] AS nodes, distance[..$topk] AS distance \n\
+            CALL { \n\
+                WITH nodes \n\
+                UNWIND nodes AS n1 \n\
+                MATCH (n1)-[r]->(n2:Entity) \n\
+                WHERE n2 IN nodes AND ' + RELATION_FILTER + ' \n\
+                RETURN collect(DISTINCT [n1.nid, r.value, n2.nid]) AS edges \n\
+            } \n\
+            RETURN [n IN nodes | n.nid] AS nid, [n IN nodes | n.label] AS label, distance, \n\
+                   [e IN edges | e[0]] AS src, [e IN edges | e[1]] AS rel, [e IN edges | e[2]] AS dst'
+    return CQL
+
+#max neighbor of each hop for the neighborhood_subgraph_cql
+#start_node_id is the list of sources for multi_source query
+def neighborhood_subgraph_params(start_node_id, n_hop, max_neighbor, decline_rate, topk, exclude=None) -> dict:
+    if isinstance(start_node_id, (list, tuple)):
+        params = {'sources':list(start_node_id), 'exclude':list(exclude or []), 'topk':topk}
+    else:
+        params = {'nid':start_node_id, 'topk':topk}
+    for hop_count in range(1, n_hop + 1):
+        params['k%s' % hop_count] = max(int(max_neighbor * (decline_rate**(hop_count - 1))), 1)
+    return params
+
+#append the unvisited neighbors of frontier to result in BFS order, return the next frontier
+#frontier_neighbors: {nid: [{'nid', 'label'}, ...]}
+def merge_frontier(frontier:list, frontier_neighbors:dict, visited:set, result:list, distance:int) -> list:
+    next_frontier = []
+    for node_id in frontier: #keep the BFS order of the frontier
+        for node in frontier_neighbors.get(node_id, []):
+            if node['nid'] not in visited:
+                visited.add(node['nid'])
+                result.append({'nid':node['nid'], 'label':node['label'], 'distance':distance})
+                next_frontier.append(node['nid'])
+    return next_frontier
+
+#columnar lists (nid, label, distance), (n1.nid, r.value, n2.nid) of bfs nodes and their relations
+def subgraph_columns(nodes:list, relations:list):
+    ent_columns = ([node['nid'] for node in nodes], [node['label'] for node in nodes], [node['distance'] for node in nodes])
+    rel_columns = ([rel['n1.nid'] for rel in relations], [rel['r.value'] for rel in relations], [rel['n2.nid'] for rel in relations])
+    return ent_columns,rel_columns
+
+#keep topk nearest nodes of bfs result
+def topk_by_distance(result:list, topk:int) -> list:
+    if len(result) > topk:
+        result.sort(key=lambda x: x['distance'], reverse=False)
+        result = result[:topk]
+    return result
+
+#cache: optional cache of kg_cache (LRUCache, SQLiteCache, TieredCache) for node, neighbor, relation and subgraph lookups
+#seed: fix the random order of neighbor sampling, sampled results are then reproducible and cached per seed
+#degree_cap: sample among at most degree_cap neighbors of each node, bounds the latency of expanding hub nodes
+#expansion_policy: optional kg_profile.ExpansionPolicy (hub handling and node budget) of get_n_hop_neighbors
+#instrument: optional kg_instrument.KGInstrument recording latency, rows and server stats of every query
+#neighbor_ranker: optional kg_relevance.NeighborRanker, neighbors matching the question are sampled first
+#relation_filter: optional kg_profile.RelationFilter, filtered relations are dropped by the server
 class neo4j_client():
-    def __init__(self, uri, user, password, log_path=None):
+    def __init__(self, uri, user, password, log_path=None, database=None, cache=None, seed=None, degree_cap=None, expansion_policy=None, \
+                 instrument=None, neighbor_ranker=None, relation_filter=None):
         self.driver = neo4j.GraphDatabase.driver(uri, auth=(user, password))
+        self.database = database
+        self.cache = cache
+        self.seed = seed
+        self.degree_cap = degree_cap
+        self.expansion_policy = expansion_policy
+        self.instrument = instrument
+        self.neighbor_ranker = neighbor_ranker
+        self.relation_filter = relation_filter
         self.log_path = log_path
         if self.log_path:
             f = open(log_path, 'w')
             f.close()
-    
-    def runCQL(self, cql, print_cql=False):
-        session = self.driver.session()
-        result = None
+        self._local = threading.local() #one long-lived session for each thread
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    #capped_cql is used instead of cql when degree_cap is given
+    #ORDER BY rand() of sampling query is replaced by a seeded hash when seed is given
+    def _sampling_query(self, cql, params, capped_cql=None):
+        params = dict(params, **relation_filter_params(self.relation_filter))
+        if self.degree_cap is not None and capped_cql is not None:
+            cql,params = capped_cql,dict(params, degree_cap=self.degree_cap)
+        if self.seed is None:
+            return cql,params
+        return seeded_cql(cql),dict(params, seed=self.seed)
+
+    #random or question-ranked neighbor query of _get_neighbor_nodes(_batch)
+    def _neighbor_query(self, params, batch=False):
+        if batch:
+            params = dict({'exclude':[]}, **params)
+        if self.neighbor_ranker is None:
+            if batch:
+                return self._sampling_query(CQL_GET_NEIGHBOR_NODES_BATCH, params, capped_cql=CQL_GET_NEIGHBOR_NODES_BATCH_CAPPED)
+            return self._sampling_query(CQL_GET_NEIGHBOR_NODES, params, capped_cql=CQL_GET_NEIGHBOR_NODES_CAPPED)
+        return self._sampling_query(ranked_neighbor_cql(batch), dict(params, question_tokens=list(self.neighbor_ranker.tokens)), \
+                                    capped_cql=ranked_neighbor_cql(batch, degree_cap=True))
+
+    #ranked samples depend on the question tokens as well
+    def _neighbor_key(self, nid, max_neighbor):
+        if self.neighbor_ranker is None:
+            return (nid, max_neighbor, self.seed, self.degree_cap) + self._filter_key()
+        return (nid, max_neighbor, self.seed, self.degree_cap, self.neighbor_ranker.tokens) + self._filter_key()
+
+    #filtered results are cached apart from the unfiltered ones
+    def _filter_key(self) -> tuple:
+        return () if self.relation_filter is None else (self.relation_filter.key,)
+
+    #reuse the session of current thread instead of opening one for every statement
+    def _get_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None or session.closed():
+            session = self.driver.session(database=self.database, default_access_mode=neo4j.READ_ACCESS)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _drop_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is not None:
+            session.close()
+            self._local.session = None
+
+    def _log_error(self, cql, err):
+        if self.log_path is not None:
+            f = open(self.log_path, 'w')
+            f.write(cql + '\n')
+            f.write(str(err))
+            f.close()
+
+    @staticmethod
+    def _read_with_summary(tx, cql, params):
+        result = tx.run(cql, params)
+        return result.data(),result.consume()
+
+    #params: values of $param placeholders in cql
+    #stream: return an iterator of records (record['key']) instead of materializing them by .data()
+    #kind: query kind recorded by the instrument e.g. get_node, neighbors, relations
+    def runCQL(self, cql, print_cql=False, params=None, stream=False, kind='cql'):
+        result,summary,error = None,None,None
+        if self.instrument is not None:
+            cql = self.instrument.query_text(cql)
+            start = time.perf_counter()
         try:
             if print_cql:
                 print(cql)
-            result = session.run(cql).data()
+            if stream:
+                return self._stream_records(cql, params, kind)
+            session = self._get_session()
+            if self.instrument is None:
+                result = session.execute_read(lambda tx: tx.run(cql, params).data()) #explicit read transaction
+            else:
+                result,summary = session.execute_read(self._read_with_summary, cql, params)
             #print(re.sub(r'\s+', ' ', cql))
         except neo4j.exceptions.Neo4jError as err:
-            if self.log_path is not None:
-                f = open(self.log_path, 'w')
-                f.write(cql + '\n')
-                f.write(str(err))
-                f.close()
-            result = -1
-        finally:
-            session.close()
+            self._log_error(cql, err)
+            result,error = -1,err
+        except neo4j.exceptions.DriverError as err: #session expired, service unavailable...
+            self._log_error(cql, err)
+            self._drop_session()
+            result,error = -1,err
+        if self.instrument is not None:
+            self.instrument.record(kind, (time.perf_counter() - start) * 1000, 0 if result == -1 else len(result), summary, error)
         return result
 
+    #records are pulled lazily from server, a dedicated session is used so that
+    #the pooled session of this thread is still available while the stream is consumed
+    def _stream_records(self, cql, params=None, kind='cql'):
+        start,rows,summary,error = time.perf_counter(),0,None,None
+        try:
+            with self.driver.session(database=self.database, default_access_mode=neo4j.READ_ACCESS) as session:
+                result = session.run(cql, params)
+                for record in result:
+                    rows += 1
+                    yield record
+                summary = result.consume()
+        except (neo4j.exceptions.Neo4jError, neo4j.exceptions.DriverError) as err:
+            self._log_error(cql, err)
+            error = err
+        finally: #also recorded when the consumer stops early
+            if self.instrument is not None:
+                self.instrument.record(kind, (time.perf_counter() - start) * 1000, rows, summary, error)
+
     #bfs nodes of N hop from start_node
     #decline_rate: decline rate of max_neighbor of n hop distance node
+    #batch: expand a whole hop (frontier) with one query instead of one query per node
     #return id array in BFS manner
-    def get_n_hop_neighbors(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+    def get_n_hop_neighbors(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch=True, print_cql=False):
+        if batch:
+            result = self._get_n_hop_neighbors_batch(start_node_id, n_hop, max_neighbor, decline_rate, print_cql)
+        else:
+            result = self._get_n_hop_neighbors_single(start_node_id, n_hop, max_neighbor, decline_rate, print_cql)
+        return topk_by_distance(result, topk)
+
+    #node-at-a-time bfs, one neighbor query per visited node
+    def _get_n_hop_neighbors_single(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, print_cql=False):
         visited,result,hop_count = set(),[],0
         status,content = self.get_node(start_node_id, print_cql)
         if status == 0:
@@ -46,97 +427,520 @@ class neo4j_client():
                     visited.add(node_id)
                     result.append({'nid':node_id, 'label':node_label, 'distance':hop_count})
                     number_neighbor = max(int(max_neighbor * (decline_rate**hop_count)), 1)
-                    neighbor_list = self._get_neighbor_nodes(node_id, number_neighbor, print_cql)
+                    if self.expansion_policy is None:
+                        neighbor_list = self._get_neighbor_nodes(node_id, number_neighbor, print_cql)
+                    else:
+                        if self.expansion_policy.remaining(len(result)) == 0:
+                            break
+                        fetch = lambda nids,limit: {nids[0]:self._get_neighbor_nodes(nids[0], limit, print_cql)}
+                        neighbor_list = self.expansion_policy.expand([node_id], number_neighbor, hop_count, len(result), fetch).get(node_id, [])
                     for node in neighbor_list:
                         #nid as the element identifier in the queue
                         queue.append((node['nid'], node['label'], hop_count + 1))
-        if len(result) > topk:
-            result.sort(key=lambda x: x['distance'], reverse=False)
-            result = result[:topk]
         return result
 
+    #level-synchronous bfs, one neighbor query per hop for the whole frontier
+    #nodes of the last hop are not expanded since their neighbors are out of range anyway
+    def _get_n_hop_neighbors_batch(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, print_cql=False):
+        result = []
+        status,content = self.get_node(start_node_id, print_cql)
+        if status == 0:
+            return result
+        result.append({'nid':content[0], 'label':content[1], 'distance':0})
+        return self._expand_frontier(result, set([content[0]]), [content[0]], n_hop, max_neighbor, decline_rate, print_cql)
+
+    #expand the frontier hop by hop, unvisited neighbors are appended to result
+    #exclude: nids dropped from the neighbors before sampling, the budget of expansion_policy counts result only
+    def _expand_frontier(self, result, visited, frontier, n_hop, max_neighbor, decline_rate, print_cql=False, exclude=None):
+        for hop_count in range(n_hop):
+            if len(frontier) == 0:
+                break
+            number_neighbor = max(int(max_neighbor * (decline_rate**hop_count)), 1)
+            if self.expansion_policy is None:
+                frontier_neighbors = self._get_neighbor_nodes_batch(frontier, number_neighbor, print_cql, exclude)
+                frontier = merge_frontier(frontier, frontier_neighbors, visited, result, hop_count + 1)
+            else:
+                fetch = lambda nids,limit: self._get_neighbor_nodes_batch(nids, limit, print_cql, exclude)
+                frontier_neighbors = self.expansion_policy.expand(frontier, number_neighbor, hop_count, len(result), fetch)
+                frontier = merge_frontier(frontier, frontier_neighbors, visited, result, hop_count + 1)
+                frontier = self.expansion_policy.trim(result, frontier)
+        return result
+
+    #bfs from every source node at once (e.g. all members of a community) plus the relations among the result
+    #nodes of exclude (already materialized) are neither returned nor expanded
+    #return columnar lists like get_neighborhood_subgraph, sources first with distance 0
+    def get_multi_source_subgraph(self, source_nids:list, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, exclude=None, print_cql=False):
+        source_nids = list(dict.fromkeys(source_nids))
+        exclude = sorted(set(exclude or []) - set(source_nids))
+        if self.expansion_policy is not None or self.neighbor_ranker is not None:
+            result = []
+            for nid in source_nids:
+                status,content = self.get_node(nid, print_cql)
+                if status > 0:
+                    result.append({'nid':content[0], 'label':content[1], 'distance':0})
+            frontier = [node['nid'] for node in result]
+            result = self._expand_frontier(result, set(frontier) | set(exclude), frontier, n_hop, max_neighbor, decline_rate, print_cql, exclude)
+            nodes = topk_by_distance(result, topk)
+            return subgraph_columns(nodes, self.get_relations_of_nodes([node['nid'] for node in nodes], print_cql))
+        cache_key = ('multi', tuple(source_nids), tuple(exclude), n_hop, max_neighbor, decline_rate, topk, self.seed, self.degree_cap) + \
+                    self._filter_key()
+        if self.cache is not None:
+            hit,subgraph = self.cache.get('subgraph', cache_key)
+            if hit:
+                return subgraph
+        CQL,params = self._sampling_query(neighborhood_subgraph_cql(n_hop, multi_source=True), \
+                        neighborhood_subgraph_params(source_nids, n_hop, max_neighbor, decline_rate, topk, exclude), \
+                        capped_cql=neighborhood_subgraph_cql(n_hop, degree_cap=True, multi_source=True))
+        res = self.runCQL(CQL, print_cql=print_cql, params=params, kind='multi_source_subgraph')
+        if res != -1 and res is not None and len(res) > 0:
+            subgraph = (res[0]['nid'], res[0]['label'], res[0]['distance']),(res[0]['src'], res[0]['rel'], res[0]['dst'])
+            if self.cache is not None:
+                self.cache.put('subgraph', cache_key, subgraph)
+            return subgraph
+        return ([], [], []),([], [], [])
+
     #return list of nid and list of label
     def get_node(self, nid, print_cql=False):
-        CQL = 'MATCH (n:Entity) \n\
-               WHERE n.nid = %s \n\
-               RETURN n'%nid
-        res = self.runCQL(CQL, print_cql)
+        if self.cache is not None:
+            hit,content = self.cache.get('node', nid)
+            if hit:
+                return 1,tuple(content) #persistent caches return lists
+        res = self.runCQL(CQL_GET_NODE, print_cql, params={'nid':nid}, kind='get_node')
         if res != -1 and res is not None:
             if len(res) > 0:
-                return 1,(res[0]['n']['nid'], res[0]['n']['label'], res[0]['n'].get('alias'))
+                content = (res[0]['nid'], res[0]['label'], res[0]['alias'])
+                if self.cache is not None:
+                    self.cache.put('node', nid, content)
+                return 1,content
             else:
                 return 0,None
         else:
             return 0,None
 
-    
+
     #return entity by label
     def get_node_by_label(self, label, print_cql=False):
-        CQL = "MATCH (n:Entity) \n\
-               WHERE n.label = '%s' \n\
-               RETURN n"%label
-        res = self.runCQL(CQL, print_cql)
+        res = self.runCQL(CQL_GET_NODE_BY_LABEL, print_cql, params={'label':label}, kind='get_node_by_label')
         if res != -1 and res is not None:
             if len(res) > 0:
-                return 1,(res[0]['n']['nid'], res[0]['n']['label'], res[0]['n'].get('alias'))
+                return 1,(res[0]['nid'], res[0]['label'], res[0]['alias'])
             else:
                 return 0,None
         else:
             return 0,None
-    
-    #get id array of neighbors of node with nid 
+
+    #resolve many labels by one query, return {label: (status, (nid, label, alias))}
+    def get_nodes_by_labels(self, labels:list, print_cql=False) -> dict:
+        labels = list(dict.fromkeys(labels))
+        nodes = {label:(0, None) for label in labels}
+        res = self.runCQL(CQL_GET_NODES_BY_LABELS, print_cql, params={'labels':labels}, kind='get_nodes_by_labels')
+        if res != -1 and res is not None:
+            for record in res:
+                nodes[record['query']] = (1, (record['nid'], record['label'], record['alias']))
+        return nodes
+
+    #create the indexes of CQL_CREATE_INDEXES (needs write access), return False on error
+    def create_indexes(self, print_cql=False):
+        try:
+            with self.driver.session(database=self.database) as session:
+                for cql in CQL_CREATE_INDEXES:
+                    if print_cql:
+                        print(cql)
+                    session.run(cql).consume()
+        except (neo4j.exceptions.Neo4jError, neo4j.exceptions.DriverError) as err:
+            self._log_error(cql, err)
+            return False
+        return True
+
+    #bfs nodes of N hop from start_node and the relations among them in one query
+    #sampling, decline_rate and topk are same as get_n_hop_neighbors(batch=True)
+    #return columnar lists (nid, label, distance), (n1.nid, r.value, n2.nid)
+    def get_neighborhood_subgraph(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+        if self.expansion_policy is not None or self.neighbor_ranker is not None:
+            #degree-aware or ranked bfs is driven by the client, neighbors and relations are still cached
+            nodes = self.get_n_hop_neighbors(start_node_id, n_hop, max_neighbor, decline_rate, topk, print_cql=print_cql)
+            return subgraph_columns(nodes, self.get_relations_of_nodes([node['nid'] for node in nodes], print_cql))
+        cache_key = self._subgraph_key(start_node_id, n_hop, max_neighbor, decline_rate, topk)
+        if self.cache is not None:
+            hit,subgraph = self.cache.get('subgraph', cache_key)
+            if hit:
+                return subgraph
+        CQL,params = self._sampling_query(neighborhood_subgraph_cql(n_hop), \
+                        neighborhood_subgraph_params(start_node_id, n_hop, max_neighbor, decline_rate, topk), \
+                        capped_cql=neighborhood_subgraph_cql(n_hop, degree_cap=True))
+        res = self.runCQL(CQL, print_cql=print_cql, params=params, kind='subgraph')
+        if res != -1 and res is not None and len(res) > 0:
+            subgraph = (res[0]['nid'], res[0]['label'], res[0]['distance']),(res[0]['src'], res[0]['rel'], res[0]['dst'])
+            if self.cache is not None:
+                self.cache.put('subgraph', cache_key, subgraph)
+            return subgraph
+        return ([], [], []),([], [], [])
+
+    def _subgraph_key(self, start_node_id, n_hop, max_neighbor, decline_rate, topk):
+        return (start_node_id, n_hop, max_neighbor, decline_rate, topk, self.seed, self.degree_cap) + self._filter_key()
+
+    #get_neighborhood_subgraph of many start nodes with batch_size start nodes per query, e.g. to warm a whole dataset
+    #return {nid: columnar lists}, the subgraphs are cached like the ones of get_neighborhood_subgraph
+    def get_neighborhood_subgraphs(self, start_node_ids, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch_size=64, print_cql=False) -> dict:
+        start_node_ids = list(dict.fromkeys(start_node_ids))
+        if self.expansion_policy is not None or self.neighbor_ranker is not None:
+            return {nid:self.get_neighborhood_subgraph(nid, n_hop, max_neighbor, decline_rate, topk, print_cql) for nid in start_node_ids}
+        subgraphs,missing = {},[]
+        for nid in start_node_ids:
+            hit = False
+            if self.cache is not None:
+                hit,subgraph = self.cache.get('subgraph', self._subgraph_key(nid, n_hop, max_neighbor, decline_rate, topk))
+            if hit:
+                subgraphs[nid] = subgraph
+            else:
+                missing.append(nid)
+        params = neighborhood_subgraph_params(None, n_hop, max_neighbor, decline_rate, topk)
+        del params['nid']
+        for start in range(0, len(missing), batch_size):
+            nids = missing[start:start + batch_size]
+            CQL,batch_params = self._sampling_query(neighborhood_subgraph_cql(n_hop, batch=True), dict(params, nids=nids), \
+                                    capped_cql=neighborhood_subgraph_cql(n_hop, degree_cap=True, batch=True))
+            res = self.runCQL(CQL, print_cql=print_cql, params=batch_params, kind='subgraph_batch')
+            fetched = {nid:(([], [], []), ([], [], [])) for nid in nids} #start nodes not in KG or of a failed query (logged by runCQL)
+            for record in (res if res != -1 and res is not None else []):
+                fetched[record['source']] = (record['nid'], record['label'], record['distance']),(record['src'], record['rel'], record['dst'])
+            for nid,subgraph in fetched.items():
+                subgraphs[nid] = subgraph
+                if self.cache is not None and len(subgraph[0][0]) > 0:
+                    self.cache.put('subgraph', self._subgraph_key(nid, n_hop, max_neighbor, decline_rate, topk), subgraph)
+        return subgraphs
+
+    #get id array of neighbors of node with nid
     def _get_neighbor_nodes(self, nid, max_neighbor=5, print_cql=False):
-        CQL = 'MATCH (n1:Entity)-[r:Relation]-(n2:Entity) \n\
-               WHERE n1.nid = %s \n\
-               WITH DISTINCT n2, rand() as random_order \n\
-               RETURN n2 \n\
-               ORDER BY random_order \n\
-               LIMIT %s'%(nid, max_neighbor)
-        res = self.runCQL(CQL, print_cql=print_cql)
+        if self.cache is not None:
+            hit,node_list = self.cache.get('neighbors', self._neighbor_key(nid, max_neighbor))
+            if hit:
+                return node_list
+        CQL,params = self._neighbor_query({'nid':nid, 'max_neighbor':max_neighbor})
+        res = self.runCQL(CQL, print_cql=print_cql, params=params, kind='neighbors')
         node_list = []
         if res != -1 and res is not None:
             for index in range(len(res)):
                 nrn_json = res[index]
-                node_list.append({'nid':nrn_json['n2']['nid'], 'label':nrn_json['n2']['label']})
+                node_list.append({'nid':nrn_json['nid'], 'label':nrn_json['label']})
+            if self.cache is not None:
+                self.cache.put('neighbors', self._neighbor_key(nid, max_neighbor), node_list)
         return node_list
 
-    #RETURN relation among node with nid in nid_set format: {n1.nid, r.value, n2.nid}
-    def get_relations_of_nodes(self, nid_list:list, print_cql=False):
-        CQL = 'MATCH (n1:Entity)-[r]->(n2:Entity) \n\
-               WHERE n1.nid IN %s AND n2.nid IN %s \n\
-               RETURN n1.nid, r.value, n2.nid' % (str(nid_list), str(nid_list))
-        res = self.runCQL(CQL, print_cql)
-        rel_set,rel_list = set(),[]
+    #get neighbors of every node in frontier by one query, the sampling of each node is same as _get_neighbor_nodes
+    #return {nid: [{'nid', 'label'}, ...]}
+    #exclude: nids never sampled, such queries bypass the cache as their samples depend on exclude
+    def _get_neighbor_nodes_batch(self, frontier:list, max_neighbor=5, print_cql=False, exclude=None):
+        if exclude:
+            CQL,params = self._neighbor_query({'frontier':frontier, 'max_neighbor':max_neighbor, 'exclude':list(exclude)}, batch=True)
+            res = self.runCQL(CQL, print_cql=print_cql, params=params, kind='neighbors_batch')
+            return {} if res == -1 or res is None else {record['fid']:record['neighbors'] for record in res}
+        node_dict,missing = {},frontier
+        if self.cache is not None: #only query the frontier nodes not in cache
+            missing = []
+            for nid in frontier:
+                hit,node_list = self.cache.get('neighbors', self._neighbor_key(nid, max_neighbor))
+                if hit:
+                    node_dict[nid] = node_list
+                else:
+                    missing.append(nid)
+            if len(missing) == 0:
+                return node_dict
+        CQL,params = self._neighbor_query({'frontier':missing, 'max_neighbor':max_neighbor}, batch=True)
+        res = self.runCQL(CQL, print_cql=print_cql, params=params, kind='neighbors_batch')
         if res != -1 and res is not None:
             for index in range(len(res)):
                 nrn_json = res[index]
-                rel_hash = str(nrn_json['n1.nid']) + str(nrn_json['r.value']) + str(nrn_json['n2.nid'])
-                if rel_hash not in rel_set:
-                    rel_list.append({'n1.nid':nrn_json['n1.nid'], 'r.value':nrn_json['r.value'], 'n2.nid':nrn_json['n2.nid']})
-                    rel_set.add(rel_hash)
+                node_dict[nrn_json['fid']] = nrn_json['neighbors']
+            if self.cache is not None:
+                for nid in missing:
+                    self.cache.put('neighbors', self._neighbor_key(nid, max_neighbor), node_dict.get(nid, []))
+        return node_dict
+
+    #RETURN relation among node with nid in nid_set format: {n1.nid, r.value, n2.nid}
+    #stream: consume the records one by one instead of materializing all of them first
+    def get_relations_of_nodes(self, nid_list:list, print_cql=False, stream=False):
+        if self.cache is not None:
+            return self._get_relations_of_nodes_cached(nid_list, print_cql)
+        params = dict(relation_filter_params(self.relation_filter), nid_list=list(nid_list))
+        res = self.runCQL(CQL_GET_RELATIONS_OF_NODES, print_cql, params=params, stream=stream, kind='relations')
+        if res == -1 or res is None:
+            res = []
+        rel_set,rel_list = set(),[]
+        for record in res:
+            rel_hash = (record['n1.nid'], record['r.value'], record['n2.nid'])
+            if rel_hash not in rel_set:
+                rel_list.append({'n1.nid':record['n1.nid'], 'r.value':record['r.value'], 'n2.nid':record['n2.nid']})
+                rel_set.add(rel_hash)
+        return rel_list
+
+    #induced relations from the out relations cached per node, only nodes not in cache are queried
+    #nodes with more than MAX_CACHED_OUT_EDGES out relations (hubs) are not cached, only their induced relations are read
+    def _get_relations_of_nodes_cached(self, nid_list:list, print_cql=False):
+        nid_list = list(dict.fromkeys(nid_list))
+        out_relations,missing = {},[]
+        out_key = (lambda nid: nid) if self.relation_filter is None else (lambda nid: (nid, self.relation_filter.key))
+        for nid in nid_list:
+            hit,relations = self.cache.get('out_edges', out_key(nid))
+            if hit:
+                out_relations[nid] = relations
+            else:
+                missing.append(nid)
+        if len(missing) > 0:
+            params = dict(relation_filter_params(self.relation_filter), nid_list=missing, max_out_edges=MAX_CACHED_OUT_EDGES)
+            res = self.runCQL(CQL_GET_OUT_RELATIONS_OF_NODES, print_cql, params=params, kind='out_relations')
+            if res == -1 or res is None:
+                return []
+            fetched,hubs = {nid:[] for nid in missing},[]
+            for record in res:
+                if record['degree'] > MAX_CACHED_OUT_EDGES:
+                    hubs.append(record['n1.nid'])
+                elif record['n2.nid'] is not None: #no row of relation for nodes without out relations
+                    fetched[record['n1.nid']].append((record['r.value'], record['n2.nid']))
+            for nid in hubs:
+                del fetched[nid]
+            for nid,relations in fetched.items():
+                self.cache.put('out_edges', out_key(nid), relations)
+                out_relations[nid] = relations
+            if len(hubs) > 0:
+                params = dict(relation_filter_params(self.relation_filter), src_list=hubs, nid_list=nid_list)
+                res = self.runCQL(CQL_GET_RELATIONS_FROM_NODES, print_cql, params=params, kind='relations')
+                if res == -1 or res is None:
+                    return []
+                hub_relations = {nid:[] for nid in hubs}
+                for record in res:
+                    hub_relations[record['n1.nid']].append((record['r.value'], record['n2.nid']))
+                out_relations.update(hub_relations)
+        nid_set,rel_set,rel_list = set(nid_list),set(),[]
+        for nid in nid_list:
+            for value,to_nid in out_relations[nid]:
+                if to_nid in nid_set and (nid, value, to_nid) not in rel_set:
+                    rel_list.append({'n1.nid':nid, 'r.value':value, 'n2.nid':to_nid})
+                    rel_set.add((nid, value, to_nid))
         return rel_list
-            
+
+    #export the whole graph as triple dump (nid, label, relation, nid, label) by streaming
+    #node without out relations is exported as (nid, label, '', '', '')
+    def dump_triples(self, path, delimiter='\t', print_cql=False):
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            writer.writerow(['nid', 'label', 'relation', 'nid', 'label'])
+            for record in self.runCQL(CQL_DUMP_TRIPLES, print_cql, stream=True, kind='dump_triples'):
+                writer.writerow(['' if value is None else value for value in record.values()])
+                count += 1
+        return count
+
     def count_node(self, print_cql=False):
-        node_count = self.runCQL('MATCH (n) RETURN COUNT(n) AS count', print_cql=print_cql)
+        node_count = self.runCQL(CQL_COUNT_NODE, print_cql=print_cql, kind='count_node')
         return node_count[0]['count']
 
     def count_edge(self, print_cql=False):
-        edge_count = self.runCQL('MATCH ()-[r]->() RETURN COUNT(r) AS count', print_cql=print_cql)
+        edge_count = self.runCQL(CQL_COUNT_EDGE, print_cql=print_cql, kind='count_edge')
         return edge_count[0]['count']
 
-    def average_degree(self, sample=5000):
-        query = 'MATCH (n) \n\
-                 WITH n \n\
-                 ORDER BY RAND() \n\
-                 LIMIT %s \n\
-                 MATCH (n)-[r]-() \n\
-                 WITH n, count(r) as degree \n\
-                 RETURN avg(degree)'%sample
-        avg_degree = np.round(self.runCQL(query, print_cql=print_cql)[0]['avg(degree)'], 3)
+    def average_degree(self, sample=5000, print_cql=False):
+        avg_degree = np.round(self.runCQL(CQL_AVERAGE_DEGREE, print_cql=print_cql, params={'sample':sample}, kind='average_degree')[0]['avg(degree)'], 3)
         return avg_degree
-    
+
     # def empty_database(self):
     #     self.runCQL('MATCH (n) DETACH DELETE n')
-        
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+        self.driver.close()
+
+
+'''
+neo4j client on the async driver, same interface as neo4j_client but every method is a coroutine
+the frontier of a hop is expanded by concurrent queries (asyncio.gather) bounded by max_concurrency
+'''
+class AsyncNeo4jClient():
+    def __init__(self, uri, user, password, log_path=None, database=None, max_concurrency=8, relation_filter=None):
+        self.driver = neo4j.AsyncGraphDatabase.driver(uri, auth=(user, password))
+        self.database = database
+        self.max_concurrency = max_concurrency
+        self.relation_filter = relation_filter
+        self.log_path = log_path
+        if self.log_path:
+            f = open(log_path, 'w')
+            f.close()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _log_error(self, cql, err):
+        if self.log_path is not None:
+            f = open(self.log_path, 'w')
+            f.write(cql + '\n')
+            f.write(str(err))
+            f.close()
+
+    @staticmethod
+    async def _read_data(tx, cql, params):
+        result = await tx.run(cql, params)
+        return await result.data()
+
+    #a session is not concurrency-safe, so each query borrows its own one from the driver pool
+    async def runCQL(self, cql, print_cql=False, params=None):
+        result = None
+        async with self._semaphore:
+            try:
+                if print_cql:
+                    print(cql)
+                async with self.driver.session(database=self.database, default_access_mode=neo4j.READ_ACCESS) as session:
+                    result = await session.execute_read(self._read_data, cql, params)
+            except (neo4j.exceptions.Neo4jError, neo4j.exceptions.DriverError) as err:
+                self._log_error(cql, err)
+                result = -1
+        return result
+
+    #level-synchronous bfs, the frontier of each hop is expanded concurrently
+    #batch: split the frontier into max_concurrency UNWIND queries, else one query per frontier node
+    async def get_n_hop_neighbors(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch=True, print_cql=False):
+        result = []
+        status,content = await self.get_node(start_node_id, print_cql)
+        if status == 0:
+            return result
+        visited = set([content[0]])
+        result.append({'nid':content[0], 'label':content[1], 'distance':0})
+        frontier = [content[0]]
+        for hop_count in range(n_hop):
+            if len(frontier) == 0:
+                break
+            number_neighbor = max(int(max_neighbor * (decline_rate**hop_count)), 1)
+            frontier_neighbors = {}
+            if batch:
+                chunk_size = -(-len(frontier) // self.max_concurrency) #ceil
+                chunks = [frontier[i:i + chunk_size] for i in range(0, len(frontier), chunk_size)]
+                for chunk_neighbors in await asyncio.gather(*[self._get_neighbor_nodes_batch(chunk, number_neighbor, print_cql) for chunk in chunks]):
+                    frontier_neighbors.update(chunk_neighbors)
+            else:
+                neighbor_lists = await asyncio.gather(*[self._get_neighbor_nodes(nid, number_neighbor, print_cql) for nid in frontier])
+                frontier_neighbors = dict(zip(frontier, neighbor_lists))
+            frontier = merge_frontier(frontier, frontier_neighbors, visited, result, hop_count + 1)
+        return topk_by_distance(result, topk)
+
+    async def get_node(self, nid, print_cql=False):
+        res = await self.runCQL(CQL_GET_NODE, print_cql, params={'nid':nid})
+        if res != -1 and res is not None and len(res) > 0:
+            return 1,(res[0]['nid'], res[0]['label'], res[0]['alias'])
+        return 0,None
+
+    async def get_node_by_label(self, label, print_cql=False):
+        res = await self.runCQL(CQL_GET_NODE_BY_LABEL, print_cql, params={'label':label})
+        if res != -1 and res is not None and len(res) > 0:
+            return 1,(res[0]['nid'], res[0]['label'], res[0]['alias'])
+        return 0,None
+
+    async def get_neighborhood_subgraph(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+        CQL = neighborhood_subgraph_cql(n_hop)
+        params = neighborhood_subgraph_params(start_node_id, n_hop, max_neighbor, decline_rate, topk)
+        params.update(relation_filter_params(self.relation_filter))
+        res = await self.runCQL(CQL, print_cql=print_cql, params=params)
+        if res != -1 and res is not None and len(res) > 0:
+            return (res[0]['nid'], res[0]['label'], res[0]['distance']),(res[0]['src'], res[0]['rel'], res[0]['dst'])
+        return ([], [], []),([], [], [])
+
+    async def get_multi_source_subgraph(self, source_nids:list, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, exclude=None, print_cql=False):
+        source_nids = list(dict.fromkeys(source_nids))
+        exclude = sorted(set(exclude or []) - set(source_nids))
+        CQL = neighborhood_subgraph_cql(n_hop, multi_source=True)
+        params = neighborhood_subgraph_params(source_nids, n_hop, max_neighbor, decline_rate, topk, exclude)
+        params.update(relation_filter_params(self.relation_filter))
+        res = await self.runCQL(CQL, print_cql=print_cql, params=params)
+        if res != -1 and res is not None and len(res) > 0:
+            return (res[0]['nid'], res[0]['label'], res[0]['distance']),(res[0]['src'], res[0]['rel'], res[0]['dst'])
+        return ([], [], []),([], [], [])
+
+    async def _get_neighbor_nodes(self, nid, max_neighbor=5, print_cql=False):
+        params = dict(relation_filter_params(self.relation_filter), nid=nid, max_neighbor=max_neighbor)
+        res = await self.runCQL(CQL_GET_NEIGHBOR_NODES, print_cql, params=params)
+        if res == -1 or res is None:
+            return []
+        return [{'nid':record['nid'], 'label':record['label']} for record in res]
+
+    async def _get_neighbor_nodes_batch(self, frontier:list, max_neighbor=5, print_cql=False):
+        params = dict(relation_filter_params(self.relation_filter), frontier=frontier, max_neighbor=max_neighbor, exclude=[])
+        res = await self.runCQL(CQL_GET_NEIGHBOR_NODES_BATCH, print_cql, params=params)
+        if res == -1 or res is None:
+            return {}
+        return {record['fid']:record['neighbors'] for record in res}
+
+    async def get_relations_of_nodes(self, nid_list:list, print_cql=False):
+        params = dict(relation_filter_params(self.relation_filter), nid_list=list(nid_list))
+        res = await self.runCQL(CQL_GET_RELATIONS_OF_NODES, print_cql, params=params)
+        rel_set,rel_list = set(),[]
+        if res != -1 and res is not None:
+            for record in res:
+                rel_hash = (record['n1.nid'], record['r.value'], record['n2.nid'])
+                if rel_hash not in rel_set:
+                    rel_list.append({'n1.nid':record['n1.nid'], 'r.value':record['r.value'], 'n2.nid':record['n2.nid']})
+                    rel_set.add(rel_hash)
+        return rel_list
+
+    async def close(self):
+        await self.driver.close()
+
+'''
+blocking facade of AsyncNeo4jClient with the interface of neo4j_client, so fastToG can use it unchanged
+coroutines run on a private event loop thread, thus the facade can also be called from several threads
+whose KG I/O is then overlapped on the same loop
+'''
+class BlockingNeo4jClient():
+    def __init__(self, uri, user, password, log_path=None, database=None, max_concurrency=8, relation_filter=None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self.client = self._run(self._create_client(uri, user, password, log_path, database, max_concurrency, relation_filter))
+
+    @staticmethod
+    async def _create_client(uri, user, password, log_path, database, max_concurrency, relation_filter):
+        return AsyncNeo4jClient(uri, user, password, log_path, database, max_concurrency, relation_filter)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    #stream and kind as neo4j_client.runCQL for the dump queries (entity labels, degree table, relation frequencies),
+    #records are fetched at once by the async client and a failed stream yields no record like neo4j_client
+    def runCQL(self, cql, print_cql=False, params=None, stream=False, kind='cql'):
+        result = self._run(self.client.runCQL(cql, print_cql, params))
+        if stream and result == -1:
+            return iter([])
+        return iter(result) if stream else result
+
+    def get_n_hop_neighbors(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch=True, print_cql=False):
+        return self._run(self.client.get_n_hop_neighbors(start_node_id, n_hop, max_neighbor, decline_rate, topk, batch, print_cql))
+
+    def get_node(self, nid, print_cql=False):
+        return self._run(self.client.get_node(nid, print_cql))
+
+    def get_node_by_label(self, label, print_cql=False):
+        return self._run(self.client.get_node_by_label(label, print_cql))
+
+    def get_neighborhood_subgraph(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+        return self._run(self.client.get_neighborhood_subgraph(start_node_id, n_hop, max_neighbor, decline_rate, topk, print_cql))
+
+    def get_multi_source_subgraph(self, source_nids:list, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, exclude=None, print_cql=False):
+        return self._run(self.client.get_multi_source_subgraph(source_nids, n_hop, max_neighbor, decline_rate, topk, exclude, print_cql))
+
+    #neighborhoods of several start nodes (e.g. the heads of all reasoning chains) fetched concurrently
+    #same as neo4j_client.get_neighborhood_subgraphs, batch_size is unused as every start node has its own query
+    def get_neighborhood_subgraphs(self, start_node_ids:list, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch_size=64, print_cql=False) -> dict:
+        start_node_ids = list(dict.fromkeys(start_node_ids))
+        async def gather_subgraphs():
+            return await asyncio.gather(*[self.client.get_neighborhood_subgraph(nid, n_hop, max_neighbor, decline_rate, topk, print_cql) \
+                                          for nid in start_node_ids])
+        return dict(zip(start_node_ids, self._run(gather_subgraphs())))
+
+    def get_relations_of_nodes(self, nid_list:list, print_cql=False):
+        return self._run(self.client.get_relations_of_nodes(nid_list, print_cql))
+
     def close(self):
-        self.driver.close()
\ No newline at end of file
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
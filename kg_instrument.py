@@ -0,0 +1,108 @@
+import json
+import threading
+import numpy as np
+
+#upper bounds (ms) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+#total db hits of a profiled plan (dict of ResultSummary.profile) and its children
+def plan_db_hits(plan) -> int:
+    if not plan:
+        return 0
+    return plan.get('dbHits', 0) + sum(plan_db_hits(child) for child in plan.get('children', []))
+
+#(operator type, db hits) of the operator with most db hits in a profiled plan
+def plan_hottest_operator(plan):
+    if not plan:
+        return None,0
+    best = (plan.get('operatorType'), plan.get('dbHits', 0))
+    for child in plan.get('children', []):
+        candidate = plan_hottest_operator(child)
+        if candidate[1] > best[1]:
+            best = candidate
+    return best
+
+#aggregated stats of the queries of one kind
+def new_kind_stats() -> dict:
+    return {'count':0, 'errors':0, 'rows':0, 'total_ms':0.0, 'max_ms':0.0, 'server_ms':0.0, 'db_hits':0, \
+            'histogram':[0] * (len(LATENCY_BUCKETS) + 1), 'hottest_operators':{}}
+
+def update_kind_stats(stats:dict, record:dict):
+    stats['count'] += 1
+    stats['errors'] += int(record['error'] is not None)
+    stats['rows'] += record['rows']
+    stats['total_ms'] += record['wall_ms']
+    stats['max_ms'] = max(stats['max_ms'], record['wall_ms'])
+    stats['server_ms'] += record['server_ms'] or 0.0
+    stats['db_hits'] += record['db_hits'] or 0
+    stats['histogram'][int(np.searchsorted(LATENCY_BUCKETS, record['wall_ms']))] += 1
+    if record['hottest_operator'] is not None:
+        operators = stats['hottest_operators']
+        operators[record['hottest_operator']] = operators.get(record['hottest_operator'], 0) + 1
+
+'''
+per-query instrumentation of neo4j_client.runCQL: wall time, rows, query kind and ResultSummary counters
+profile: run the queries with PROFILE to record db hits and the hottest operator of the plan (slower, debug only)
+keep_records: also keep every query record besides the aggregates, stats are aggregated per kind for the run
+and for each question (begin_question/end_question)
+'''
+class KGInstrument():
+    def __init__(self, profile=False, keep_records=False):
+        self.profile = profile
+        self.keep_records = keep_records
+        self.records = []
+        self.run_stats = {}
+        self.questions = [] #(question, stats of kinds)
+        self._question = None
+        self._question_stats = None
+        self._lock = threading.Lock()
+
+    def begin_question(self, question):
+        with self._lock:
+            self._question,self._question_stats = question,{}
+
+    def end_question(self) -> dict:
+        with self._lock:
+            stats = self._question_stats
+            if stats is not None:
+                self.questions.append((self._question, stats))
+            self._question,self._question_stats = None,None
+        return stats
+
+    def query_text(self, cql) -> str:
+        return 'PROFILE ' + cql if self.profile else cql
+
+    #summary: neo4j.ResultSummary of the query, None for failed queries
+    def record(self, kind, wall_ms, rows, summary=None, error=None):
+        record = {'kind':kind, 'wall_ms':wall_ms, 'rows':rows, 'server_ms':None, 'db_hits':None, \
+                  'hottest_operator':None, 'counters':None, 'error':None if error is None else type(error).__name__}
+        if summary is not None:
+            if summary.result_available_after is not None and summary.result_consumed_after is not None:
+                record['server_ms'] = float(summary.result_available_after + summary.result_consumed_after)
+            if summary.profile:
+                record['db_hits'] = plan_db_hits(summary.profile)
+                record['hottest_operator'] = plan_hottest_operator(summary.profile)[0]
+            if summary.counters.contains_updates or summary.counters.contains_system_updates:
+                record['counters'] = {key:value for key,value in vars(summary.counters).items() if not key.startswith('_') and value}
+        with self._lock:
+            if self.keep_records:
+                record['question'] = self._question
+                self.records.append(record)
+            update_kind_stats(self.run_stats.setdefault(kind, new_kind_stats()), record)
+            if self._question_stats is not None:
+                update_kind_stats(self._question_stats.setdefault(kind, new_kind_stats()), record)
+
+    #slowest kinds first
+    def summary(self, stats=None) -> list:
+        stats = self.run_stats if stats is None else stats
+        return sorted([(kind, value['count'], round(value['total_ms'], 1), round(value['max_ms'], 1), value['db_hits']) \
+                       for kind,value in stats.items()], key=lambda x: x[2], reverse=True)
+
+    def dump(self, path):
+        with self._lock:
+            content = {'latency_buckets_ms':list(LATENCY_BUCKETS), 'run':self.run_stats, \
+                       'questions':[{'question':question, 'stats':stats} for question,stats in self.questions]}
+            if self.keep_records:
+                content['records'] = self.records
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False, indent=1)
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+speculative community search, run in background threads while the LLM prunes the candidates
+search(community, *args) is the search of one community, e.g. fasttog.community_search with the search arguments bound
+results are keyed by the community and args, get() of a key never submitted falls back to a synchronous search
+the kg client must be thread-safe (neo4j_client, BlockingNeo4jClient and CSRGraphClient are)
+'''
+class SearchPrefetcher():
+    def __init__(self, search, max_workers=4):
+        self.search = search
+        self.hits,self.misses,self.cancelled = 0,0,0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kg_prefetch')
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(community, args):
+        return (community.cid, frozenset(community.ent_nids)) + tuple(frozenset(arg) if isinstance(arg, set) else arg for arg in args)
+
+    #start the search of community in background
+    def submit(self, community, *args):
+        key = self._key(community, args)
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self._executor.submit(self.search, community, *args)
+
+    #result of the search of community, waits for the prefetch if it is in flight
+    def get(self, community, *args):
+        with self._lock:
+            future = self._futures.pop(self._key(community, args), None)
+        if future is None or future.cancelled():
+            self.misses += 1
+            return self.search(community, *args)
+        self.hits += 1
+        return future.result()
+
+    #drop the prefetches of given communities (all if None) e.g. the losers of pruning
+    #pending ones are cancelled, running ones are left to finish and their KG responses stay in the cache of kg client
+    def discard(self, communities=None):
+        with self._lock:
+            if communities is None:
+                keys = list(self._futures)
+            else:
+                dropped = set((community.cid, frozenset(community.ent_nids)) for community in communities)
+                keys = [key for key in self._futures if key[:2] in dropped]
+            for key in keys:
+                if self._futures.pop(key).cancel():
+                    self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {'hits':self.hits, 'misses':self.misses, 'cancelled':self.cancelled}
+
+    def close(self):
+        self.discard()
+        self._executor.shutdown(wait=False)
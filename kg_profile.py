@@ -0,0 +1,388 @@
+import os
+import json
+import argparse
+import numpy as np
+
+#undirected degree of every entity, counted once offline for the degree table
+CQL_NODE_DEGREES = 'MATCH (n:Entity) \n\
+                    RETURN n.nid AS nid, size([(n)-[:Relation]-() | 1]) AS degree'
+
+#undirected degree of randomly sampled entities
+CQL_SAMPLE_NODE_DEGREES = 'MATCH (n:Entity) \n\
+                           WITH n \n\
+                           ORDER BY rand() \n\
+                           LIMIT $sample \n\
+                           RETURN n.nid AS nid, size([(n)-[:Relation]-() | 1]) AS degree'
+
+'''
+precomputed degree of every node, nids are sorted and looked up by binary search
+built once from neo4j (from_neo4j) or from the CSR arrays (from_csr), saved as a .npz file
+'''
+class DegreeTable():
+    def __init__(self, nids, degrees):
+        order = np.argsort(nids, kind='stable')
+        self.nids = np.asarray(nids, dtype=np.int64)[order]
+        self.degrees = np.asarray(degrees, dtype=np.int64)[order]
+
+    @classmethod
+    def from_neo4j(cls, kg_client, print_cql=False):
+        nids,degrees = [],[]
+        for record in kg_client.runCQL(CQL_NODE_DEGREES, print_cql, stream=True, kind='degree_table'):
+            nids.append(record['nid'])
+            degrees.append(record['degree'])
+        return cls(nids, degrees)
+
+    @classmethod
+    def from_csr(cls, csr_client):
+        return cls(csr_client.node_nids, np.diff(csr_client.indptr))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['nids'], data['degrees'])
+
+    def save(self, path):
+        np.savez(path, nids=self.nids, degrees=self.degrees)
+
+    #degrees of given nids, 0 for nids not in table
+    def degrees_of(self, nid_list) -> np.ndarray:
+        nids = np.asarray(nid_list, dtype=np.int64)
+        if len(self.nids) == 0:
+            return np.zeros(len(nids), dtype=np.int64)
+        index = np.minimum(np.searchsorted(self.nids, nids), len(self.nids) - 1)
+        return np.where(self.nids[index] == nids, self.degrees[index], 0)
+
+    def degree(self, nid) -> int:
+        return int(self.degrees_of([nid])[0])
+
+#load the degree table at path, it is built by the client and saved there first if missing
+def load_degree_table(path, kg_client):
+    if os.path.exists(path):
+        return DegreeTable.load(path)
+    if hasattr(kg_client, 'indptr'):
+        table = DegreeTable.from_csr(kg_client)
+    else:
+        table = DegreeTable.from_neo4j(kg_client)
+    table.save(path)
+    return table
+
+HUB_MODES = ('terminal', 'skip', 'downsample')
+
+#largest integer level with sum(min(capacity, level)) <= budget, level <= max_level
+def water_level(capacity:np.ndarray, budget:int, max_level:int) -> int:
+    low,high = 0,max_level
+    while low < high:
+        level = (low + high + 1) // 2
+        if np.minimum(capacity, level).sum() <= budget:
+            low = level
+        else:
+            high = level - 1
+    return low
+
+'''
+degree-aware expansion of get_n_hop_neighbors
+hub_degree: nodes with degree >= hub_degree are hubs, the start node is always expanded
+hub_mode: terminal - hubs are kept but never expanded
+          skip - hubs are dropped from the result
+          downsample - hubs are expanded with at most hub_max_neighbor neighbors
+node_budget: max number of nodes of one search, the sampled neighbors of a hop share the remaining budget
+adaptive: max_neighbor of a node follows its degree, the slots that low degree nodes cannot fill go to the others
+          so a hop still samples about max_neighbor * len(frontier) nodes, no node gets more than
+          adaptive_max_scale * max_neighbor
+'''
+class ExpansionPolicy():
+    def __init__(self, degree_table, hub_degree=1000, hub_mode='terminal', hub_max_neighbor=1, node_budget=None, \
+                 adaptive=False, adaptive_max_scale=4):
+        assert hub_mode in HUB_MODES
+        self.degree_table = degree_table
+        self.hub_degree = hub_degree
+        self.hub_mode = hub_mode
+        self.hub_max_neighbor = hub_max_neighbor
+        self.node_budget = node_budget
+        self.adaptive = adaptive
+        self.adaptive_max_scale = adaptive_max_scale
+
+    def is_hub(self, nid_list) -> np.ndarray:
+        return self.degree_table.degrees_of(nid_list) >= self.hub_degree
+
+    #number of nodes that can still be added, None for unlimited
+    def remaining(self, num_node):
+        if self.node_budget is None:
+            return None
+        return max(self.node_budget - num_node, 0)
+
+    #max neighbor of every frontier node at hop_count, 0 for nodes not to be expanded
+    def neighbor_limits(self, frontier, number_neighbor, hop_count, num_node) -> np.ndarray:
+        limits = np.full(len(frontier), number_neighbor, dtype=np.int64)
+        if hop_count > 0 and len(frontier) > 0:
+            hub = self.is_hub(frontier)
+            limits[hub] = self.hub_max_neighbor if self.hub_mode == 'downsample' else 0
+            if self.adaptive: #hop_count 0 is the start node alone, nothing to redistribute
+                limits = self._adaptive_limits(frontier, limits, ~hub, number_neighbor)
+        remaining = self.remaining(num_node)
+        if remaining is not None: #spread the budget over the expanded nodes instead of first come first served
+            expanded = int((limits > 0).sum())
+            if remaining == 0:
+                limits[:] = 0
+            elif expanded > 0:
+                limits = np.minimum(limits, max(remaining // expanded, 1))
+        return limits
+
+    #water filling of the slots of the non-hub nodes over their degrees
+    def _adaptive_limits(self, frontier, limits, expanded, number_neighbor) -> np.ndarray:
+        if not expanded.any():
+            return limits
+        capacity = np.maximum(self.degree_table.degrees_of(np.asarray(frontier)[expanded]) - 1, 1) #minus the edge we came by
+        budget = number_neighbor * int(expanded.sum())
+        level = water_level(capacity, budget, number_neighbor * self.adaptive_max_scale)
+        limits = limits.copy()
+        limits[expanded] = np.maximum(np.minimum(capacity, level), 1)
+        return limits
+
+    #mask of sampled neighbors admitted to the result
+    def admit(self, nid_list) -> np.ndarray:
+        if self.hub_mode == 'skip' and len(nid_list) > 0:
+            return ~self.is_hub(nid_list)
+        return np.ones(len(nid_list), dtype=bool)
+
+    #one hop of the level-synchronous bfs of neo4j_client
+    #fetch(frontier, max_neighbor) -> {nid: [{'nid', 'label'}, ...]}, return {nid: admitted neighbors}
+    def expand(self, frontier, number_neighbor, hop_count, num_node, fetch) -> dict:
+        limits = self.neighbor_limits(frontier, number_neighbor, hop_count, num_node)
+        frontier_neighbors = {}
+        for limit in sorted(set(limits.tolist())):
+            if limit > 0:
+                frontier_neighbors.update(fetch([nid for nid,node_limit in zip(frontier, limits.tolist()) if node_limit == limit], limit))
+        for nid,node_list in frontier_neighbors.items():
+            mask = self.admit([node['nid'] for node in node_list])
+            frontier_neighbors[nid] = [node for node,keep in zip(node_list, mask.tolist()) if keep]
+        return frontier_neighbors
+
+    #drop the nodes beyond the budget from the end of bfs result, return the trimmed frontier
+    def trim(self, result:list, frontier:list) -> list:
+        if self.node_budget is None or len(result) <= self.node_budget:
+            return frontier
+        overflow = len(result) - self.node_budget
+        del result[self.node_budget:]
+        return frontier[:len(frontier) - overflow]
+
+#number of relations of every relation value, counted once offline for the relation vocabulary
+CQL_RELATION_FREQUENCIES = 'MATCH ()-[r:Relation]->() \n\
+                            RETURN r.value AS value, count(*) AS count'
+
+#{relation value: number of relations} of neo4j or of the CSR arrays, most frequent first
+def relation_frequencies(kg_client, print_cql=False) -> dict:
+    if hasattr(kg_client, 'out_rel_ids'):
+        counts = np.bincount(np.asarray(kg_client.out_rel_ids), minlength=len(kg_client.rel_vocab))
+        frequencies = dict(zip(kg_client.rel_vocab, counts.tolist()))
+    else:
+        frequencies = {}
+        for record in kg_client.runCQL(CQL_RELATION_FREQUENCIES, print_cql, stream=True, kind='relation_frequencies'):
+            frequencies[record['value']] = record['count']
+    return dict(sorted(frequencies.items(), key=lambda x: x[1], reverse=True))
+
+#tab separated file: relation value, count
+def save_relation_frequencies(path, frequencies:dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        for value,count in frequencies.items():
+            f.write('%s\t%d\n' % (value, count))
+
+#load the relation frequencies at path, they are counted by the client and saved there first if missing
+def load_relation_frequencies(path, kg_client) -> dict:
+    if path and os.path.exists(path):
+        frequencies = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                value,count = line.rstrip('\n').rsplit('\t', 1)
+                frequencies[value] = int(count)
+        return frequencies
+    frequencies = relation_frequencies(kg_client)
+    if path:
+        save_relation_frequencies(path, frequencies)
+    return frequencies
+
+#one relation value per line
+def load_relation_list(path) -> list:
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f if len(line.strip()) > 0]
+
+'''
+allow/deny lists of relation values, set as relation_filter of a kg client
+the clients drop filtered relations from neighbor sampling and relation lookups (inside the query for neo4j)
+allow: only relations with these values are kept, None for all
+deny: relations with these values are dropped e.g. metadata like "described by source"
+'''
+class RelationFilter():
+    def __init__(self, allow=None, deny=None):
+        self.allow = None if allow is None else frozenset(allow)
+        self.deny = frozenset(deny or [])
+        #part of the cache keys of filtered results
+        self.key = (None if self.allow is None else tuple(sorted(self.allow)), tuple(sorted(self.deny)))
+
+    #deny the relations holding more than max_fraction of all relations besides the given lists
+    @classmethod
+    def from_frequencies(cls, frequencies:dict, max_fraction=None, allow=None, deny=None):
+        deny = set(deny or [])
+        total = sum(frequencies.values())
+        if max_fraction is not None and total > 0:
+            deny.update(value for value,count in frequencies.items() if count / total > max_fraction)
+        return cls(allow, deny)
+
+    def keep(self, value) -> bool:
+        return (self.allow is None or value in self.allow) and value not in self.deny
+
+    #mask of kept relation ids of a relation vocabulary
+    def mask(self, rel_vocab) -> np.ndarray:
+        return np.array([self.keep(value) for value in rel_vocab], dtype=bool)
+
+    #values of $allow_relations and $deny_relations of the neo4j queries
+    def params(self) -> dict:
+        return {'allow_relations':None if self.allow is None else sorted(self.allow), 'deny_relations':sorted(self.deny)}
+
+#degrees of a random sample of nodes, all nodes if the client has CSR arrays and sample is None
+def sample_degrees(kg_client, sample=10000, seed=None, print_cql=False) -> np.ndarray:
+    if hasattr(kg_client, 'indptr'):
+        degrees = np.diff(np.asarray(kg_client.indptr))
+        if sample is None or sample >= len(degrees):
+            return degrees
+        return np.random.default_rng(seed).choice(degrees, size=sample, replace=False)
+    res = kg_client.runCQL(CQL_SAMPLE_NODE_DEGREES, print_cql, params={'sample':sample}, kind='sample_degrees')
+    if res == -1 or res is None:
+        return np.zeros(0, dtype=np.int64)
+    return np.array([record['degree'] for record in res], dtype=np.int64)
+
+PERCENTILES = (50, 75, 90, 95, 99, 99.9)
+
+def degree_percentiles(degrees, percentiles=PERCENTILES) -> dict:
+    if len(degrees) == 0:
+        return {}
+    return {str(p):float(value) for p,value in zip(percentiles, np.percentile(degrees, percentiles))}
+
+#distinct degrees and the number of nodes of each, the expectations below only depend on them
+def degree_counts(degrees):
+    values,counts = np.unique(np.asarray(degrees, dtype=np.int64), return_counts=True)
+    return values,counts
+
+#expected nodes of each hop (hop 0 is the start node) and relations read by each hop of the sampled bfs
+#the start node is a random node, later frontier nodes are reached by a relation so their degree is size-biased
+#and one of their relations leads back; overlaps between the neighborhoods are ignored (upper bound)
+#counts: number of nodes of each degree when degrees are compressed by degree_counts
+def expected_neighborhood(degrees, n_hop, max_neighbor, decline_rate, degree_cap=None, counts=None):
+    degrees = np.asarray(degrees, dtype=np.float64)
+    weights = np.ones(len(degrees)) if counts is None else np.asarray(counts, dtype=np.float64)
+    nodes,cost = [1.0],[]
+    if len(degrees) == 0 or (weights * degrees).sum() == 0:
+        return nodes,cost
+    cap = np.inf if degree_cap is None else degree_cap
+    uniform = weights / weights.sum()
+    biased = weights * degrees / (weights * degrees).sum()
+    frontier = 1.0
+    for hop_count in range(n_hop):
+        number_neighbor = max(int(max_neighbor * (decline_rate**hop_count)), 1)
+        if hop_count == 0:
+            read = (uniform * np.minimum(degrees, cap)).sum()
+            new = (uniform * np.minimum(np.minimum(degrees, cap), number_neighbor)).sum()
+        else:
+            read = (biased * np.minimum(degrees, cap)).sum()
+            new = (biased * np.minimum(np.minimum(np.maximum(degrees - 1, 0), cap), number_neighbor)).sum()
+        cost.append(frontier * read)
+        frontier *= new
+        nodes.append(frontier)
+    return nodes,cost
+
+#search settings (search_max_hop, search_max_neighbor, search_decline_rate, search_topk) whose expected
+#neighborhood reaches target_nodes with the fewest relations read, the largest neighborhood if none does
+def recommend_settings(degrees, target_nodes=60, max_hop=4, degree_cap=None, max_neighbors=range(1, 51), \
+                       decline_rates=(1.0, 0.7, 0.5, 0.33)) -> dict:
+    best,best_rank = None,None
+    values,counts = degree_counts(degrees) #a few thousand distinct degrees instead of every node
+    for n_hop in range(1, max_hop + 1):
+        for decline_rate in decline_rates:
+            for max_neighbor in max_neighbors:
+                nodes,cost = expected_neighborhood(values, n_hop, max_neighbor, decline_rate, degree_cap, counts)
+                total,read = float(sum(nodes)),float(sum(cost))
+                reached = total >= target_nodes
+                rank = (0, read, n_hop) if reached else (1, -total, read)
+                if best_rank is None or rank < best_rank:
+                    best_rank = rank
+                    best = {'search_max_hop':n_hop, 'search_max_neighbor':max_neighbor, 'search_decline_rate':decline_rate, \
+                            'search_topk':target_nodes, 'expected_nodes':round(total, 1), 'expected_reads':round(read, 1), \
+                            'reached_target':reached}
+    return best
+
+#mean number of nodes of each hop of actual searches from the given start nodes
+def probe_neighborhoods(kg_client, start_nids, n_hop, max_neighbor, decline_rate) -> list:
+    counts = np.zeros(n_hop + 1)
+    for nid in start_nids:
+        for node in kg_client.get_n_hop_neighbors(nid, n_hop, max_neighbor, decline_rate, topk=2**31):
+            counts[node['distance']] += 1
+    return (counts / max(len(start_nids), 1)).round(2).tolist()
+
+#degree statistics, expected (and probed) neighborhood of the given settings and the recommended settings
+def profile_kg(kg_client, sample=10000, target_nodes=60, max_hop=4, max_neighbor=20, decline_rate=0.5, n_hop=3, \
+               degree_cap=None, probe=0, seed=None, degree_table=None) -> dict:
+    degrees = degree_table.degrees if degree_table is not None else sample_degrees(kg_client, sample, seed)
+    values,counts = degree_counts(degrees)
+    nodes,cost = expected_neighborhood(values, n_hop, max_neighbor, decline_rate, degree_cap, counts)
+    report = {'degree_sample':int(len(degrees)), 'mean_degree':float(np.mean(degrees)) if len(degrees) > 0 else 0.0, \
+              'max_degree':int(np.max(degrees)) if len(degrees) > 0 else 0, 'degree_percentiles':degree_percentiles(degrees), \
+              'current':{'search_max_hop':n_hop, 'search_max_neighbor':max_neighbor, 'search_decline_rate':decline_rate, \
+                         'expected_nodes_per_hop':[round(x, 1) for x in nodes], 'expected_reads_per_hop':[round(x, 1) for x in cost]}, \
+              'recommended':recommend_settings(degrees, target_nodes, max_hop, degree_cap)}
+    if probe > 0 and degree_table is not None:
+        start_nids = np.random.default_rng(seed).choice(degree_table.nids, size=min(probe, len(degree_table.nids)), replace=False)
+        report['current']['probed_nodes_per_hop'] = probe_neighborhoods(kg_client, start_nids.tolist(), n_hop, max_neighbor, decline_rate)
+    return report
+
+parser = argparse.ArgumentParser('profile the degrees of a knowledge graph and recommend the search settings of fasttog')
+parser.add_argument("--kg_api", type=str, required=True,
+                    help="neo4j uri, triple dump (csr) or store directory (mmap)")
+parser.add_argument("--kg_user", type=str,
+                    default="", help="user for knowledge graph engine")
+parser.add_argument("--kg_pw", type=str,
+                    default="", help="password for knowledge graph engine")
+parser.add_argument("--kg_backend", type=str,
+                    default="neo4j", choices=["neo4j", "csr", "mmap"], help="knowledge graph client")
+parser.add_argument("--kg_degree_table", type=str,
+                    default=None, help="degree table (.npz) of all nodes instead of a sample, built and saved if missing")
+parser.add_argument("--kg_degree_cap", type=int,
+                    default=None, help="degree cap of neighbor sampling (see fasttog --kg_degree_cap)")
+parser.add_argument("--sample", type=int,
+                    default=10000, help="number of nodes sampled for the degree statistics")
+parser.add_argument("--probe", type=int,
+                    default=0, help="run the current settings from this many random nodes (needs kg_degree_table)")
+parser.add_argument("--seed", type=int,
+                    default=None, help="seed of the node sampling")
+parser.add_argument("--target_nodes", type=int,
+                    default=60, help="expected number of nodes of one search for the recommended settings")
+parser.add_argument("--max_hop", type=int,
+                    default=4, help="max search_max_hop of the recommended settings")
+parser.add_argument("--search_max_hop", type=int,
+                    default=3, help="current max searching depth")
+parser.add_argument("--search_max_neighbor", type=int,
+                    default=20, help="current max searching width")
+parser.add_argument("--search_decline_rate", type=float,
+                    default=0.5, help="current declining rate")
+parser.add_argument("--output", type=str,
+                    default=None, help="json file of the report, its recommended settings can be given to fasttog --search_settings")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.kg_backend == 'csr':
+        from csr_client import CSRGraphClient
+        kg_cli = CSRGraphClient.from_triples_file(args.kg_api, seed=args.seed, degree_cap=args.kg_degree_cap)
+    elif args.kg_backend == 'mmap':
+        from graph_store import MmapGraphClient
+        kg_cli = MmapGraphClient(args.kg_api, seed=args.seed, degree_cap=args.kg_degree_cap)
+    else:
+        from kg_client import neo4j_client
+        kg_cli = neo4j_client(args.kg_api, args.kg_user, args.kg_pw, seed=args.seed, degree_cap=args.kg_degree_cap)
+    degree_table = load_degree_table(args.kg_degree_table, kg_cli) if args.kg_degree_table else None
+    report = profile_kg(kg_cli, sample=args.sample, target_nodes=args.target_nodes, max_hop=args.max_hop, \
+                        max_neighbor=args.search_max_neighbor, decline_rate=args.search_decline_rate, n_hop=args.search_max_hop, \
+                        degree_cap=args.kg_degree_cap, probe=args.probe, seed=args.seed, degree_table=degree_table)
+    kg_cli.close()
+    print(json.dumps(report, indent=1))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,48 @@
+import string
+import numpy as np
+
+#characters splitting relation values and labels into tokens, e.g. people.person.place_of_birth
+#same list is used by the ranked neighbor queries of neo4j_client so both sides tokenize alike
+TOKEN_SEPARATORS = ('.', '_', '-', ',', '(', ')', '/', ':')
+
+def relevance_tokens(text) -> list:
+    if text is None:
+        return []
+    text = text.lower()
+    for sep in TOKEN_SEPARATORS:
+        text = text.replace(sep, ' ')
+    return text.split()
+
+#one word per line e.g. freq_word.txt
+def load_stopwords(path='freq_word.txt') -> set:
+    with open(path, encoding='utf-8') as f:
+        return set(line.strip().lower() for line in f if len(line.strip()) > 0)
+
+'''
+question-relevance ranking of the sampled neighbors, set as neighbor_ranker of a kg client
+score of a neighbor: question tokens in its best relation value with the expanded node + question tokens in its label
+neighbors with the highest score are kept first, ties are broken by the random (or seeded) order of sampling
+tokens: distinct question tokens without stopwords, sorted so they can be part of cache keys
+'''
+class NeighborRanker():
+    def __init__(self, question, stopwords=None):
+        stopwords = stopwords or set()
+        tokens = [token.strip(string.punctuation) for token in relevance_tokens(question)] #question marks, quotes...
+        self.tokens = tuple(sorted(set(token for token in tokens if len(token) > 0 and token not in stopwords)))
+        self._token_set = set(self.tokens)
+        self._label_scores = {}
+
+    def score(self, text) -> int:
+        return len(self._token_set.intersection(relevance_tokens(text)))
+
+    #scores of a relation vocabulary (list of relation values) as an array indexed by rel id
+    def relation_scores(self, rel_vocab) -> np.ndarray:
+        return np.array([self.score(rel) for rel in rel_vocab], dtype=np.int64)
+
+    #label scores are memoized, the same neighbors show up in many searches of a question
+    def label_score(self, label) -> int:
+        score = self._label_scores.get(label)
+        if score is None:
+            score = self.score(label)
+            self._label_scores[label] = score
+        return score
@@ -0,0 +1,219 @@
+import os
+import json
+import argparse
+import numpy as np
+
+'''
+pre-materialized neighborhood subgraphs of the topic entities of a dataset, built offline in one pass
+store_dir/
+    meta.json                    search settings of the subgraphs, label and relation vocabularies
+    neighborhoods.npz            sources (sorted start nids), node_ptr/edge_ptr (CSR offsets of each source)
+                                 node_nids, node_labels (label ids), node_distances
+                                 edge_src/edge_dst (positions in the nodes of the source), edge_rels (relation ids)
+subgraphs are returned in the columnar form of neo4j_client.get_neighborhood_subgraph
+'''
+STORE_VERSION = 1
+
+#parameters of kg_profile.ExpansionPolicy kept in the store settings
+POLICY_SETTINGS = ('hub_degree', 'hub_mode', 'hub_max_neighbor', 'node_budget', 'adaptive', 'adaptive_max_scale')
+
+#settings of a kg client that change the sampled neighborhoods besides the search arguments, as json values
+#(a store is only served to a client with the same ones), the relation filter of the async facade is on its client
+def sampling_settings(kg_client) -> dict:
+    relation_filter = getattr(kg_client, 'relation_filter', getattr(getattr(kg_client, 'client', None), 'relation_filter', None))
+    policy = getattr(kg_client, 'expansion_policy', None)
+    ranker = getattr(kg_client, 'neighbor_ranker', None)
+    settings = {'seed':getattr(kg_client, 'seed', None), 'degree_cap':getattr(kg_client, 'degree_cap', None), \
+                'relation_filter':None if relation_filter is None else relation_filter.key, \
+                'expansion_policy':None if policy is None else {key:getattr(policy, key) for key in POLICY_SETTINGS}, \
+                'neighbor_ranker':None if ranker is None else ranker.tokens}
+    return json.loads(json.dumps(settings)) #tuples as lists like in meta.json
+
+class NeighborhoodStore():
+    def __init__(self, settings:dict, sources, node_ptr, edge_ptr, node_nids, node_labels, node_distances, \
+                 edge_src, edge_rels, edge_dst, labels:list, relations:list):
+        self.settings = settings
+        self.sources = sources
+        self.node_ptr = node_ptr
+        self.edge_ptr = edge_ptr
+        self.node_nids = node_nids
+        self.node_labels = node_labels
+        self.node_distances = node_distances
+        self.edge_src = edge_src
+        self.edge_rels = edge_rels
+        self.edge_dst = edge_dst
+        self.labels = labels
+        self.relations = relations
+
+    #subgraphs: {start nid: ((nid, label, distance), (n1.nid, r.value, n2.nid))}
+    @classmethod
+    def from_subgraphs(cls, subgraphs:dict, settings:dict):
+        label2id,rel2id = {},{}
+        node_ptr,edge_ptr = [0],[0]
+        node_nids,node_labels,node_distances,edge_src,edge_rels,edge_dst = [],[],[],[],[],[]
+        sources = sorted(nid for nid,subgraph in subgraphs.items() if len(subgraph[0][0]) > 0)
+        for source in sources:
+            (nids,labels,distances),(src,rels,dst) = subgraphs[source]
+            position = {nid:index for index,nid in enumerate(nids)}
+            node_nids.extend(nids)
+            node_labels.extend(label2id.setdefault(label, len(label2id)) for label in labels)
+            node_distances.extend(distances)
+            edge_src.extend(position[nid] for nid in src)
+            edge_rels.extend(rel2id.setdefault(rel, len(rel2id)) for rel in rels)
+            edge_dst.extend(position[nid] for nid in dst)
+            node_ptr.append(len(node_nids))
+            edge_ptr.append(len(edge_src))
+        return cls(settings, np.array(sources, dtype=np.int64), np.array(node_ptr, dtype=np.int64), np.array(edge_ptr, dtype=np.int64), \
+                   np.array(node_nids, dtype=np.int64), np.array(node_labels, dtype=np.int32), np.array(node_distances, dtype=np.int8), \
+                   np.array(edge_src, dtype=np.int32), np.array(edge_rels, dtype=np.int32), np.array(edge_dst, dtype=np.int32), \
+                   list(label2id), list(rel2id))
+
+    def save(self, store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        with open(os.path.join(store_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version':STORE_VERSION, 'settings':self.settings, 'labels':self.labels, 'relations':self.relations}, f, ensure_ascii=False)
+        np.savez(os.path.join(store_dir, 'neighborhoods.npz'), sources=self.sources, node_ptr=self.node_ptr, edge_ptr=self.edge_ptr, \
+                 node_nids=self.node_nids, node_labels=self.node_labels, node_distances=self.node_distances, \
+                 edge_src=self.edge_src, edge_rels=self.edge_rels, edge_dst=self.edge_dst)
+
+    @classmethod
+    def load(cls, store_dir):
+        with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        assert meta['version'] == STORE_VERSION
+        with np.load(os.path.join(store_dir, 'neighborhoods.npz')) as data:
+            arrays = {key:data[key] for key in data.files}
+        return cls(meta['settings'], arrays['sources'], arrays['node_ptr'], arrays['edge_ptr'], arrays['node_nids'], \
+                   arrays['node_labels'], arrays['node_distances'], arrays['edge_src'], arrays['edge_rels'], arrays['edge_dst'], \
+                   meta['labels'], meta['relations'])
+
+    #True if the subgraphs were searched with these settings, sampling: sampling_settings of the client if given
+    def matches(self, n_hop, max_neighbor, decline_rate, topk, sampling=None) -> bool:
+        if sampling is not None and any(self.settings.get(key) != value for key,value in sampling.items()):
+            return False
+        return self.settings['n_hop'] == n_hop and self.settings['max_neighbor'] == max_neighbor and \
+               self.settings['decline_rate'] == decline_rate and self.settings['topk'] == topk
+
+    #columnar lists of the subgraph of start nid, None if it is not in store
+    def get(self, nid):
+        index = int(np.searchsorted(self.sources, nid))
+        if index >= len(self.sources) or self.sources[index] != nid:
+            return None
+        node_slice = slice(self.node_ptr[index], self.node_ptr[index + 1])
+        edge_slice = slice(self.edge_ptr[index], self.edge_ptr[index + 1])
+        nids = self.node_nids[node_slice]
+        ent_columns = (nids.tolist(), [self.labels[i] for i in self.node_labels[node_slice].tolist()], self.node_distances[node_slice].tolist())
+        rel_columns = (nids[self.edge_src[edge_slice]].tolist(), [self.relations[i] for i in self.edge_rels[edge_slice].tolist()], \
+                       nids[self.edge_dst[edge_slice]].tolist())
+        return ent_columns,rel_columns
+
+    def __len__(self):
+        return len(self.sources)
+
+#fetch the neighborhoods of start nids with the batched subgraph queries of the kg client
+def build_neighborhood_store(kg_client, start_nids, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, batch_size=64):
+    settings = dict({'n_hop':n_hop, 'max_neighbor':max_neighbor, 'decline_rate':decline_rate, 'topk':topk}, **sampling_settings(kg_client))
+    subgraphs = kg_client.get_neighborhood_subgraphs(start_nids, n_hop, max_neighbor, decline_rate, topk, batch_size=batch_size)
+    return NeighborhoodStore.from_subgraphs(subgraphs, settings)
+
+'''
+kg client answering get_neighborhood_subgraph of the stored start nodes from the store, everything else goes to the
+wrapped client, e.g. the first-phase community_search of every question of a pre-materialized dataset
+the wrapped client is used as well when its seed, degree cap, relation filter, policy or ranker differ from the store
+'''
+class NeighborhoodStoreClient():
+    def __init__(self, kg_client, store:NeighborhoodStore):
+        self.kg_client = kg_client
+        self.store = store
+        self.hits,self.misses = 0,0
+
+    def __getattr__(self, name):
+        return getattr(self.kg_client, name)
+
+    def get_neighborhood_subgraph(self, start_node_id, n_hop=3, max_neighbor=10, decline_rate=0.5, topk=100, print_cql=False):
+        if self.store.matches(n_hop, max_neighbor, decline_rate, topk, sampling_settings(self.kg_client)):
+            subgraph = self.store.get(start_node_id)
+            if subgraph is not None:
+                self.hits += 1
+                return subgraph
+        self.misses += 1
+        return self.kg_client.get_neighborhood_subgraph(start_node_id, n_hop, max_neighbor, decline_rate, topk, print_cql)
+
+#topic entities of a question file: json list or jsonl of objects (entity_key holds a label or a list of labels)
+#or plain text with one label per line
+def read_topic_entities(path, entity_key='entity') -> list:
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        items = json.loads(text)
+        items = items if isinstance(items, list) else [items]
+    except json.JSONDecodeError:
+        try:
+            items = [json.loads(line) for line in text.splitlines() if len(line.strip()) > 0]
+        except json.JSONDecodeError:
+            return [line.strip() for line in text.splitlines() if len(line.strip()) > 0]
+    entities = []
+    for item in items:
+        value = item.get(entity_key) if isinstance(item, dict) else item
+        if isinstance(value, list):
+            entities.extend(value)
+        elif value is not None:
+            entities.append(value)
+    return list(dict.fromkeys(entities))
+
+parser = argparse.ArgumentParser('pre-materialize the neighborhoods of the topic entities of a question file')
+parser.add_argument("--questions", type=str, required=True,
+                    help="question file (json, jsonl or one topic entity per line)")
+parser.add_argument("--entity_key", type=str,
+                    default="entity", help="field of the topic entity (label or list of labels) in the json questions")
+parser.add_argument("--store_dir", type=str, required=True,
+                    help="output directory of the neighborhood store")
+parser.add_argument("--kg_api", type=str, required=True,
+                    help="neo4j uri, triple dump (csr) or store directory (mmap)")
+parser.add_argument("--kg_user", type=str,
+                    default="", help="user for knowledge graph engine")
+parser.add_argument("--kg_pw", type=str,
+                    default="", help="password for knowledge graph engine")
+parser.add_argument("--kg_backend", type=str,
+                    default="neo4j", choices=["neo4j", "csr", "mmap"], help="knowledge graph client")
+parser.add_argument("--kg_seed", type=int,
+                    default=None, help="seed of neighbor sampling, must be the one of the fasttog runs to reproduce them")
+parser.add_argument("--kg_degree_cap", type=int,
+                    default=None, help="degree cap of neighbor sampling (see fasttog --kg_degree_cap)")
+parser.add_argument("--entity_index", type=str,
+                    default=None, help="entity linking index of fasttog to resolve the topic entities")
+parser.add_argument("--search_max_hop", type=int,
+                    default=3, help="max searching depth, same as fasttog")
+parser.add_argument("--search_max_neighbor", type=int,
+                    default=20, help="max searching width, same as fasttog")
+parser.add_argument("--search_decline_rate", type=float,
+                    default=0.5, help="declining rate, same as fasttog")
+parser.add_argument("--search_topk", type=int,
+                    default=100, help="topk nodes of each neighborhood, same as fasttog")
+parser.add_argument("--batch_size", type=int,
+                    default=64, help="topic entities per query")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.kg_backend == 'csr':
+        from csr_client import CSRGraphClient
+        kg_cli = CSRGraphClient.from_triples_file(args.kg_api, seed=args.kg_seed, degree_cap=args.kg_degree_cap)
+    elif args.kg_backend == 'mmap':
+        from graph_store import MmapGraphClient
+        kg_cli = MmapGraphClient(args.kg_api, seed=args.kg_seed, degree_cap=args.kg_degree_cap)
+    else:
+        from kg_client import neo4j_client
+        kg_cli = neo4j_client(args.kg_api, args.kg_user, args.kg_pw, seed=args.kg_seed, degree_cap=args.kg_degree_cap)
+    entities = read_topic_entities(args.questions, args.entity_key)
+    if args.entity_index:
+        from entity_linker import EntityLinker
+        linked = EntityLinker.load(args.entity_index).link_batch(entities)
+    else:
+        linked = kg_cli.get_nodes_by_labels(entities)
+    start_nids = [content[0] for status,content in linked.values() if status > 0]
+    print('%d of %d topic entities found' % (len(start_nids), len(entities)))
+    store = build_neighborhood_store(kg_cli, start_nids, args.search_max_hop, args.search_max_neighbor, args.search_decline_rate, \
+                                     args.search_topk, batch_size=args.batch_size)
+    store.save(args.store_dir)
+    kg_cli.close()
+    print('%d neighborhoods, %d nodes, %d relations' % (len(store), len(store.node_nids), len(store.edge_src)))
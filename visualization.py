@@ -28,7 +28,8 @@ def _short_name(s, trunc_len):
     else:
         return '\n'.join(result)
 
-def display_community(label_list, relation_matrix, community_list, 
+#relation_graph: community_tool.RelationGraph of the entities in label_list
+def display_community(label_list, relation_graph, community_list, 
                       community_centers=None, algo_method=None, colors=None, show_edges=True, 
                       random_state=3, figsize=(6,6), dpi=200, save_path=None):
     fig, ax = plt.subplots(figsize=figsize, dpi=dpi, clear=True)
@@ -41,19 +42,13 @@ def display_community(label_list, relation_matrix, community_list,
     _,community_tags = np.unique(community_list, return_inverse=True) #reflect from 0 to N
     community_unique_list = sorted(list(set(community_list)), reverse=False)
     community_centers = np.array(community_centers)[random_index]
-    relation_matrix_ = np.array(relation_matrix)
-    #ipdb.set_trace(context=15)
-    if relation_matrix_.shape[0] > 0 and relation_matrix_.shape[-1] > 0:
-        relation_matrix_ = relation_matrix_[random_index]
-        relation_matrix_ = relation_matrix_[:, random_index]
-    adj_matrix = np.where(np.array(relation_matrix_) == None, 0, 1)
+    relation_graph = relation_graph.subgraph(random_index)
+    adj_matrix = relation_graph.undirected_adjacency()
     # Create an igraph Graph from the adjacency matrix A
     edge_label,vertex_label = [],[_short_name(label_list[i], 12) for i in range(len(label_list))]
-    if show_edges:
-        for index in range(len(relation_matrix_)):
-            for jndex in range(index, len(relation_matrix_[index])):
-                if relation_matrix_[index][jndex] is not None:
-                    edge_label.append(_short_name(relation_matrix_[index][jndex], 15))
+    if show_edges: #upper triangle in row order, the edge order of ig.Graph.Adjacency
+        for index,jndex in zip(*np.nonzero(np.triu(adj_matrix))):
+            edge_label.append(_short_name(relation_graph.undirected_relation(int(index), int(jndex)), 15))
     g = ig.Graph.Adjacency((adj_matrix > 0).tolist(), mode="UNDIRECTED")
     comm = ig.VertexClustering(g, membership=community_tags)
     selected_colors,community_mapping = [],True
@@ -122,9 +117,9 @@ def display_community(label_list, relation_matrix, community_list,
 
 
 #selected_index = [0,3]
-#display_selected_community(selected_index, label_list, relation_matrix, commtag_list, center_list, \
+#display_selected_community(selected_index, label_list, relation_graph, commtag_list, center_list, \
 #                           louvain_method, colors=[COLORS[i] for i in selected_index], random_state=123)
-def display_selected_community(select_community, label_list, relation_matrix, commtag_list, center_list, \
+def display_selected_community(select_community, label_list, relation_graph, commtag_list, center_list, \
                                method, colors, show_edges=True, random_state=123, figsize=(6,6), dpi=200, save_path=None):
     select_index = []
     for index in range(len(select_community)):
@@ -135,9 +130,6 @@ def display_selected_community(select_community, label_list, relation_matrix, co
     commtag_list_ = [commtag_list[i] for i in select_index]
     #_,commtag_list_ = np.unique(commtag_list_, return_inverse=True)
     center_list_ = [center_list[i] for i in select_index]
-    relation_matrix_ = np.array(relation_matrix)
-    if relation_matrix_.shape[0] > 0 and relation_matrix_.shape[-1] > 0:
-        relation_matrix_ = relation_matrix_[select_index]
-        relation_matrix_ = relation_matrix_[:, select_index]
-    display_community(label_list_, relation_matrix_, commtag_list_, center_list_, method, 
+    relation_graph_ = relation_graph.subgraph(select_index)
+    display_community(label_list_, relation_graph_, commtag_list_, center_list_, method, 
         colors=colors, show_edges=show_edges, random_state=random_state, figsize=figsize, dpi=dpi, save_path=save_path)
\ No newline at end of file